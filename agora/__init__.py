@@ -26,7 +26,7 @@ from rdflib import Graph
 
 from agora.collector import Collector
 from agora.collector.cache import RedisCache
-from agora.collector.scholar import FragmentIndex
+from agora.collector.scholar import FragmentIndex, Scholar
 from agora.engine.fountain import Fountain
 from agora.engine.fountain.index import Index
 from agora.engine.fountain.path import PathManager
@@ -112,7 +112,12 @@ class Agora(object):
         return result
 
     def fragment_generator(self, query=None, agps=None, collector=None, cache=None, loader=None, force_seed=None,
-                           stop_event=None, follow_cycles=True):
+                           stop_event=None, follow_cycles=True, cursor=None, limit=None):
+        """
+        :param cursor: Token of the page to be read (as returned in a previous result) when paging
+        :param limit: Size of pages, if the fragment is to be paged
+        """
+
         def comp_gen(gens):
             for gen in [g['generator'] for g in gens]:
                 for q in gen:
@@ -121,8 +126,17 @@ class Agora(object):
         graph = self.__get_agora_graph(collector, cache, loader, force_seed)
         agps = list(graph.agps(query)) if query else agps
 
+        paging = {}
+        if cursor is not None or limit is not None:
+            if len(agps) != 1:
+                raise ValueError('Only queries with a single graph pattern can be paged')
+            # Only fragments that are kept by a scholar can be read by pages
+            if not isinstance(graph.collector, Scholar):
+                raise ValueError('Fragments can only be paged when served by a scholar')
+            paging = {'cursor': cursor, 'limit': limit}
+
         generators = [graph.collector.get_fragment_generator(agp, filters=filters, stop_event=stop_event,
-                                                             follow_cycles=follow_cycles) for
+                                                             follow_cycles=follow_cycles, **paging) for
                       agp, filters in
                       agps]
         prefixes = {}
@@ -131,7 +145,10 @@ class Agora(object):
             comp_plan.__iadd__(g['plan'])
             prefixes.update(g['prefixes'])
 
-        return {'prefixes': prefixes, 'plan': comp_plan, 'generator': comp_gen(generators), 'gens': generators}
+        result = {'prefixes': prefixes, 'plan': comp_plan, 'generator': comp_gen(generators), 'gens': generators}
+        if paging:
+            result['cursor'] = generators[0].get('cursor', None)
+        return result
 
     def search_plan(self, query, force_seed=None):
         collector = Collector()
@@ -19,12 +19,13 @@
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
 """
 import logging
-import re
 from abc import abstractmethod
+from ast import literal_eval
 
 from rdflib import BNode
 from rdflib import Literal
 from rdflib import URIRef
+from rdflib.util import from_n3
 from shortuuid import uuid
 
 from agora.collector.cache import RedisCache
@@ -135,35 +136,130 @@ class Collector(AbstractCollector):
 
 
 def triplify(x):
-    def __extract_lang(v):
-        def __lang_tag_match(strg, search=re.compile(r'[^a-z]').search):
-            return not bool(search(strg))
-
-        if '@' in v:
-            try:
-                (v_aux, lang) = tuple(v.split('@'))
-                (v, lang) = (v_aux, lang) if __lang_tag_match(lang) else (v, None)
-            except ValueError:
-                lang = None
-        else:
-            lang = None
-        return v, lang
+    # type: (any) -> tuple
+    """
+    Decodes a legacy quad, i.e. a (tp, s, p, o) tuple of N3 terms or its string representation
+    """
 
     def __term(elm):
-        if elm.startswith('<'):
-            return URIRef(elm.lstrip('<').rstrip('>'))
-        elif '^^' in elm:
-            (value, ty) = tuple(elm.split('^^'))
-            return Literal(value.replace('"', ''), datatype=URIRef(ty.lstrip('<').rstrip('>')))
-        elif elm.startswith('_:'):
-            return BNode(elm.replace('_:', ''))
-        else:
-            (elm, lang) = __extract_lang(elm)
-            elm = elm.replace('"', '')
-            if lang is not None:
-                return Literal(elm, lang=lang)
-            else:
-                return Literal(elm)
+        if isinstance(elm, str):
+            elm = elm.decode('utf-8')
+        return from_n3(elm)
 
-    c, s, p, o = eval(x)
+    if isinstance(x, basestring):
+        x = literal_eval(x)
+    c, s, p, o = x
     return c, __term(s), __term(p), __term(o)
+
+
+QUAD_ENCODING = 'Q1'
+
+
+def __netstring(value):
+    # type: (basestring) -> str
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return '{}:{}'.format(len(value), value)
+
+
+def __read_netstring(x, i):
+    # type: (str, int) -> (str, int)
+    sep = x.index(':', i)
+    start = sep + 1
+    end = start + int(x[i:sep])
+    if end > len(x):
+        raise ValueError('Truncated quad')
+    return x[start:end], end
+
+
+def __encode_term(term):
+    # type: (any) -> str
+    if isinstance(term, URIRef):
+        return '<' + __netstring(term)
+    elif isinstance(term, BNode):
+        return '_' + __netstring(term)
+    elif isinstance(term, Literal):
+        if term.language:
+            return '@' + __netstring(term.language) + __netstring(term)
+        elif term.datatype:
+            return '^' + __netstring(term.datatype) + __netstring(term)
+        return '"' + __netstring(term)
+    raise TypeError('Cannot encode term: {}'.format(term))
+
+
+def encode_quad(tp, s, p, o):
+    # type: (any, any, any, any) -> str
+    """
+    Compact, versioned encoding of a quad: the encoding tag followed by length-prefixed fields.
+    Each term is preceded by its kind (<, _, \", @ or ^), language tags and datatypes come before the value
+    """
+    if not isinstance(tp, basestring):
+        tp = repr(tp)
+    return QUAD_ENCODING + __netstring(tp) + __encode_term(s) + __encode_term(p) + __encode_term(o)
+
+
+def decode_quad(x):
+    # type: (str) -> tuple
+    if not x.startswith(QUAD_ENCODING):
+        return triplify(x)
+
+    try:
+        c, i = __read_netstring(x, len(QUAD_ENCODING))
+        terms = []
+        for _ in range(3):
+            kind = x[i]
+            extra = None
+            if kind in '@^':
+                extra, i = __read_netstring(x, i + 1)
+            else:
+                i += 1
+            value, i = __read_netstring(x, i)
+            value = value.decode('utf-8')
+            if kind == '<':
+                terms.append(URIRef(value))
+            elif kind == '_':
+                terms.append(BNode(value))
+            elif kind == '@':
+                terms.append(Literal(value, lang=extra))
+            elif kind == '^':
+                terms.append(Literal(value, datatype=URIRef(extra.decode('utf-8'))))
+            elif kind == '"':
+                terms.append(Literal(value))
+            else:
+                raise ValueError('Unknown term kind: {}'.format(kind))
+    except IndexError:
+        raise ValueError('Truncated quad')
+
+    s, p, o = terms
+    return c, s, p, o
+
+
+def encode_quad_record(tp, s, p, o):
+    # type: (any, any, any, any) -> str
+    """
+    Frames an encoded quad for streaming (a length-prefixed record followed by a newline)
+    """
+    return __netstring(encode_quad(tp, s, p, o)) + '\n'
+
+
+def decode_quad_records(chunks):
+    # type: (iter) -> iter
+    """
+    Decodes a stream of framed quads regardless of how it is chunked. Newlines between records are ignored
+    """
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        i = 0
+        while True:
+            while i < len(buf) and buf[i] == '\n':
+                i += 1
+            sep = buf.find(':', i)
+            if sep < 0:
+                break
+            end = sep + 1 + int(buf[i:sep])
+            if end > len(buf):
+                break
+            yield decode_quad(buf[sep + 1:end])
+            i = end
+        buf = buf[i:]
@@ -20,15 +20,19 @@
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
 """
 
+import base64
 import calendar
+import json
 import logging
 import math
+import os
 import shutil
 import zlib
 from StringIO import StringIO
 from datetime import datetime as dt, timedelta as delta
 from threading import Thread, Lock as TLock
 from time import sleep
+from urlparse import urlparse
 
 import shortuuid
 from concurrent.futures import ThreadPoolExecutor
@@ -39,7 +43,7 @@ from redis.lock import Lock
 
 from agora.collector.execution import parse_rdf
 from agora.collector.http import http_get, extract_ttl
-from agora.engine.utils import stopped
+from agora.engine.utils import stopped, prepare_store_path
 from agora.engine.utils.graph import get_triple_store
 from agora.engine.utils.kv import get_kv
 
@@ -53,7 +57,7 @@ class RedisCache(object):
 
     def __init__(self, persist_mode=None, key_prefix='', min_cache_time=5, force_cache_time=False,
                  base='store', path='cache', redis_host='localhost', redis_port=6379, redis_db=1, redis_file=None,
-                 graph_memory_limit=5000):
+                 graph_memory_limit=5000, snapshot_file=None):
         self.__key_prefix = key_prefix
         self.__cache_key = '{}:cache'.format(key_prefix)
         self.__persist_mode = persist_mode
@@ -69,11 +73,26 @@ class RedisCache(object):
 
         self.__resources_ts = {}
 
+        self.__stats_lock = TLock()
+        self.__counters = {'hits': 0, 'memory_hits': 0, 'misses': 0, 'refreshes': 0, 'negatives': 0}
+        self.__last_purge = None
+        self.__purge_pending = 0
+
+        self.__snapshot_path = None
+        if snapshot_file is not None:
+            prepare_store_path(base, path)
+            self.__snapshot_path = '/'.join(filter(lambda x: x, [base, path, snapshot_file]))
+
         for lock_key in self._r.keys('{}:l*'.format(self.__key_prefix)):
             self._r.delete(lock_key)
 
         self._r.delete(key_prefix)
 
+        self.__build_uri_index()
+
+        if self.__snapshot_path is not None and os.path.exists(self.__snapshot_path):
+            self.restore(self.__snapshot_path)
+
         self.__enabled = True
         self.__purge_th = Thread(target=self.__purge)
         self.__purge_th.daemon = True
@@ -114,6 +133,48 @@ class RedisCache(object):
     def __clean(self, name):
         shutil.rmtree('{}/{}'.format(self.__base_path, name))
 
+    def __count(self, counter):
+        with self.__stats_lock:
+            self.__counters[counter] += 1
+
+    def __size(self, gid):
+        return self._r.hget('{}:sizes'.format(self.__cache_key), gid)
+
+    def __resize(self, p, gid, size, old_size):
+        sizes_key = '{}:sizes'.format(self.__cache_key)
+        delta_size = size - (int(old_size) if old_size is not None else 0)
+        if size:
+            p.hset(sizes_key, gid, size)
+        else:
+            p.hdel(sizes_key, gid)
+        if delta_size:
+            p.incrby('{}:bytes'.format(self.__cache_key), delta_size)
+
+    def __host_key(self, gid):
+        return '{}:hosts:{}'.format(self.__cache_key, urlparse(gid).netloc.lower())
+
+    def __index_uri(self, p, gid):
+        p.zadd('{}:uris'.format(self.__cache_key), 0, gid)
+        p.sadd(self.__host_key(gid), gid)
+
+    def __unindex_uri(self, p, gid):
+        p.zrem('{}:uris'.format(self.__cache_key), gid)
+        p.srem(self.__host_key(gid), gid)
+
+    def __build_uri_index(self, chunk_size=1000):
+        # Stores created before the uri index existed are indexed once here
+        gids_key = '{}:gids'.format(self.__cache_key)
+        if self._r.exists('{}:uris'.format(self.__cache_key)) or not self._r.hlen(gids_key):
+            return
+
+        log.info('Building uri index of the cache...')
+        with self._r.pipeline(transaction=False) as p:
+            for i, (gid, _) in enumerate(self._r.hscan_iter(gids_key, count=chunk_size)):
+                self.__index_uri(p, gid)
+                if i % chunk_size == chunk_size - 1:
+                    p.execute()
+            p.execute()
+
     def uri_lock(self, uri):
         with self.__lock:
             key = '{}:l:'.format(self.__key_prefix) + uri
@@ -130,6 +191,7 @@ class RedisCache(object):
                         lambda x: not self._r.exists('{}:{}'.format(self.__cache_key, self._r.hget(gids_key, x))),
                         gids)
 
+                    self.__purge_pending = len(obsolete)
                     if obsolete:
                         with self._r.pipeline(transaction=True) as p:
                             p.multi()
@@ -139,11 +201,15 @@ class RedisCache(object):
                                 with lock:
                                     try:
                                         self._r.hdel(gids_key, uri)
+                                        self.__unindex_uri(p, uri)
+                                        self.__resize(p, uri, 0, self.__size(uri))
                                         self.__forget(uri)
                                     except Exception:
                                         # traceback.print_exc()
                                         log.error('Purging resource {}'.format(uri))
                                     p.execute()
+                                self.__purge_pending -= 1
+                    self.__last_purge = dt.utcnow()
                 except Exception, e:
                     if not stopped.isSet():
                         log.error(e.message)
@@ -175,6 +241,21 @@ class RedisCache(object):
             except:
                 pass
 
+    def __cached_graph(self, gid, gid_key, format):
+        try:
+            g = self.__recall(gid)
+            self.__count('memory_hits')
+        except KeyError:
+            source_z = self._r.hget(gid_key, 'data')
+            if source_z is None:
+                # Expired in the meantime
+                return None
+            g = Graph(identifier=gid)
+            g.parse(StringIO(zlib.decompress(source_z)), format=format)
+            self.__memoize(gid, g)
+        self.__count('hits')
+        return g
+
     def release_locks(self):
         try:
             with self.__lock:
@@ -184,7 +265,10 @@ class RedisCache(object):
         except ConnectionError as e:
             raise EnvironmentError(e.message)
 
-    def create(self, conjunctive=False, gid=None, loader=None, format=None):
+    def create(self, conjunctive=False, gid=None, loader=None, format=None, min_ttl=0):
+        """
+        :param min_ttl: Seconds that a cached resource has to be valid for at least, otherwise it is loaded again
+        """
         try:
             if conjunctive:
                 uuid = shortuuid.uuid()
@@ -199,9 +283,11 @@ class RedisCache(object):
                 lock = self.uri_lock(gid)
                 with lock:
                     uuid = self._r.hget('{}:gids'.format(self.__cache_key), gid)
+                    known = bool(uuid)
                     if not uuid:
                         uuid = shortuuid.uuid()
                         p.hset('{}:gids'.format(self.__cache_key), gid, uuid)
+                        self.__index_uri(p, gid)
 
                     gid_key = '{}:{}'.format(self.__cache_key, uuid)
 
@@ -209,24 +295,20 @@ class RedisCache(object):
                     if ttl_ts is not None:
                         ttl_dt = dt.utcfromtimestamp(int(ttl_ts))
                         now = dt.utcnow()
-                        if ttl_dt > now:
-                            try:
-                                g = self.__recall(gid)
-                            except KeyError:
-                                source_z = self._r.hget(gid_key, 'data')
-                                source = zlib.decompress(source_z)
-                                g.parse(StringIO(source), format=format)
-                                self.__memoize(gid, g)
-
-                            ttl = math.ceil((ttl_dt - dt.utcnow()).total_seconds())
-                            return g, math.ceil(ttl)
+                        if ttl_dt > now + delta(seconds=min_ttl):
+                            cached_g = self.__cached_graph(gid, gid_key, format)
+                            if cached_g is not None:
+                                ttl = math.ceil((ttl_dt - dt.utcnow()).total_seconds())
+                                return cached_g, math.ceil(ttl)
 
                     log.debug('Caching {}'.format(gid))
+                    self.__count('refreshes' if known else 'misses')
                     response = loader(gid, format)
                     if response is None and loader != http_get:
                         response = http_get(gid, format)
 
                     if isinstance(response, bool):
+                        self.__count('negatives')
                         return response
 
                     ttl = self.__min_cache_time
@@ -245,7 +327,9 @@ class RedisCache(object):
                     if not self.__force_cache_time:
                         ttl = extract_ttl(headers) or ttl
 
-                    p.hset(gid_key, 'data', zlib.compress(data))
+                    data_z = zlib.compress(data)
+                    p.hset(gid_key, 'data', data_z)
+                    self.__resize(p, gid, len(data_z), self.__size(gid))
                     ttl_ts = calendar.timegm((dt.utcnow() + delta(seconds=ttl)).timetuple())
                     p.hset(gid_key, 'ttl', ttl_ts)
                     p.expire(gid_key, ttl)
@@ -261,24 +345,245 @@ class RedisCache(object):
             else:
                 g.remove((None, None, None))
 
-    def expire(self, gid):
+    def expire(self, *gids):
+        # type: (iter) -> int
+        """
+        Expires all given resources with pipelined deletes. Unknown resources are ignored
+        :return: Number of expired resources
+        """
+        gids = list(gids)
+        if not gids:
+            return 0
+        try:
+            uuids = self._r.hmget('{}:gids'.format(self.__cache_key), gids)
+            expired = [(gid, uuid) for gid, uuid in zip(gids, uuids) if uuid]
+            if expired:
+                with self._r.pipeline(transaction=False) as p:
+                    for gid, uuid in expired:
+                        p.delete('{}:{}'.format(self.__cache_key, uuid))
+                    p.execute()
+            for gid, _ in expired:
+                self.__forget(gid)
+            return len(expired)
+        except ConnectionError as e:
+            raise EnvironmentError(e.message)
+
+    def expire_matching(self, part):
+        # type: (str) -> int
+        return self.expire(*self.get_matching_uris(part))
+
+    def get_matching_uris(self, part):
+        # type: (str) -> list
+        """
+        Resolves the cached URIs of an authority (host[:port], or the authority of the given URI)
+        through the uri index. Authorities that are not indexed match nothing
+        """
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        authority = urlparse(part).netloc if '://' in part else part
         try:
-            lock = self.uri_lock(gid)
-            with lock:
-                uuid = self._r.hget('{}:gids'.format(self.__cache_key), gid)
-                with self._r.pipeline(transaction=True) as p:
+            return list(self._r.smembers('{}:hosts:{}'.format(self.__cache_key, authority.lower())))
+        except ConnectionError as e:
+            raise EnvironmentError(e.message)
+
+    def list_resources(self, cursor=None, count=100):
+        # type: (str, int) -> (str, list)
+        """
+        Cursor-based listing of cached resources in lexicographic order.
+        A returned cursor of None means that there are no more pages
+        """
+        if count < 1:
+            raise ValueError('Invalid count: {}'.format(count))
+        try:
+            start = '-' if not cursor else '(' + base64.urlsafe_b64decode(str(cursor))
+            page = self._r.zrangebylex('{}:uris'.format(self.__cache_key), start, '+', start=0, num=count)
+            next_cursor = base64.urlsafe_b64encode(page[-1]) if page and len(page) == count else None
+            return next_cursor, page
+        except TypeError:
+            raise ValueError('Invalid cursor: {}'.format(cursor))
+        except ConnectionError as e:
+            raise EnvironmentError(e.message)
+
+    @property
+    def stats(self):
+        # type: () -> dict
+        try:
+            with self._r.pipeline(transaction=False) as p:
+                p.hlen('{}:gids'.format(self.__cache_key))
+                p.get('{}:bytes'.format(self.__cache_key))
+                n_entries, n_bytes = p.execute()
+        except ConnectionError as e:
+            raise EnvironmentError(e.message)
+
+        with self.__stats_lock:
+            counters = self.__counters.copy()
+        with self.__mlock:
+            n_graphs = len(self.__memory_graphs)
+
+        requests = counters['hits'] + counters['misses'] + counters['refreshes']
+        rates = {}
+        for counter in ['hits', 'misses', 'refreshes', 'negatives']:
+            rates[counter] = float(counters[counter]) / requests if requests else 0.0
+
+        purge_lag = None
+        if self.__last_purge is not None:
+            purge_lag = (dt.utcnow() - self.__last_purge).total_seconds()
+
+        return {'entries': n_entries,
+                'bytes': int(n_bytes or 0),
+                'requests': requests,
+                'counters': counters,
+                'rates': rates,
+                'memory': {'graphs': n_graphs,
+                           'limit': self.__graph_memory_limit,
+                           'occupancy': float(n_graphs) / self.__graph_memory_limit
+                           if self.__graph_memory_limit else 0.0},
+                'purge': {'lag': purge_lag,
+                          'pending': self.__purge_pending}}
+
+    def __hot_gids(self, limit):
+        with self.__mlock:
+            memory_order = list(reversed(self.__memory_order))
+        seen = set([])
+        hot = []
+        for gid in memory_order:
+            if gid not in seen:
+                seen.add(gid)
+                hot.append(gid)
+        for gid in hot[:limit]:
+            yield gid
+        if len(hot) < limit:
+            pending = limit - len(hot)
+            for gid, _ in self._r.hscan_iter('{}:gids'.format(self.__cache_key)):
+                if not pending:
+                    break
+                if gid not in seen:
+                    pending -= 1
+                    yield gid
+
+    def snapshot(self, path=None, limit=None, chunk_size=500):
+        # type: (str, int, int) -> int
+        """
+        Dumps the hot set of cached resources (memory tier first) to a local file
+        :return: Number of dumped resources
+        """
+        path = path or self.__snapshot_path
+        if path is None:
+            raise ValueError('No snapshot file was given')
+        if limit is None:
+            limit = self.__graph_memory_limit
+
+        gids_key = '{}:gids'.format(self.__cache_key)
+        gids = list(self.__hot_gids(limit))
+        n_dumped = 0
+        try:
+            with open(path + '.tmp', 'w') as f:
+                for i in xrange(0, len(gids), chunk_size):
+                    chunk = gids[i:i + chunk_size]
+                    uuids = self._r.hmget(gids_key, chunk)
+                    with self._r.pipeline(transaction=False) as p:
+                        for uuid in uuids:
+                            p.hmget('{}:{}'.format(self.__cache_key, uuid), 'data', 'ttl')
+                        entries = p.execute()
+                    for gid, (data, ttl_ts) in zip(chunk, entries):
+                        if data is None or ttl_ts is None:
+                            continue
+                        f.write(json.dumps({'gid': gid, 'ttl': int(ttl_ts), 'data': base64.b64encode(data)}) + '\n')
+                        n_dumped += 1
+            os.rename(path + '.tmp', path)
+        except ConnectionError as e:
+            raise EnvironmentError(e.message)
+
+        log.info('Dumped {} cached resources to {}'.format(n_dumped, path))
+        return n_dumped
+
+    def restore(self, path=None, chunk_size=500):
+        # type: (str, int) -> int
+        """
+        Loads a snapshot file in bulk, skipping those resources that already expired
+        :return: Number of restored resources
+        """
+        path = path or self.__snapshot_path
+        if path is None:
+            raise ValueError('No snapshot file was given')
+
+        def parse(line):
+            entry = json.loads(line)
+            return str(entry['gid']), int(entry['ttl']), base64.b64decode(entry['data'])
+
+        def flush(entries):
+            if not entries:
+                return 0
+            gids = [gid for gid, _, _ in entries]
+            uuids = self._r.hmget(gids_key, gids)
+            old_sizes = self._r.hmget(sizes_key, gids)
+            with self._r.pipeline(transaction=False) as p:
+                for (gid, ttl_ts, data), uuid, old_size in zip(entries, uuids, old_sizes):
                     if not uuid:
                         uuid = shortuuid.uuid()
-                        p.hset('{}:gids'.format(self.__cache_key), gid, uuid)
-
+                        p.hset(gids_key, gid, uuid)
+                        self.__index_uri(p, gid)
                     gid_key = '{}:{}'.format(self.__cache_key, uuid)
-                    p.delete(gid_key)
-                    p.execute()
+                    p.hmset(gid_key, {'data': data, 'ttl': ttl_ts})
+                    p.expire(gid_key, ttl_ts - now_ts)
+                    self.__resize(p, gid, len(data), old_size)
+                p.execute()
+            return len(entries)
+
+        gids_key = '{}:gids'.format(self.__cache_key)
+        sizes_key = '{}:sizes'.format(self.__cache_key)
+        now_ts = calendar.timegm(dt.utcnow().timetuple())
+        n_restored = 0
+        batch = []
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = parse(line)
+                    except (ValueError, KeyError, TypeError):
+                        log.warn('Skipping malformed snapshot entry')
+                        continue
+                    if entry[1] <= now_ts:
+                        continue
+                    batch.append(entry)
+                    if len(batch) >= chunk_size:
+                        n_restored += flush(batch)
+                        batch = []
+                n_restored += flush(batch)
         except ConnectionError as e:
             raise EnvironmentError(e.message)
 
-    def get_matching_uris(self, part):
-        return filter(lambda gid: part in gid, self._r.hkeys('{}:gids'.format(self.__cache_key)))
+        log.info('Restored {} cached resources from {}'.format(n_restored, path))
+        return n_restored
+
+    def warm_up(self, uris, loader=None, format='turtle', workers=8):
+        # type: (iter, callable, str, int) -> int
+        """
+        Pre-warms the cache by dereferencing the given seed URIs in parallel
+        :return: Number of resources that were successfully cached
+        """
+        if loader is None:
+            loader = http_get
+
+        def load(uri):
+            try:
+                return not isinstance(self.create(gid=uri, loader=loader, format=format), bool)
+            except EnvironmentError:
+                raise
+            except Exception as e:
+                log.warn('Warming up {}: {}'.format(uri, e.message))
+                return False
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            return sum(pool.map(load, uris))
+        finally:
+            pool.shutdown(wait=True)
 
     def close(self):
         self.__enabled = False
+        if self.__snapshot_path is not None:
+            try:
+                self.snapshot()
+            except EnvironmentError as e:
+                log.warn('Could not snapshot the cache: {}'.format(e.message))
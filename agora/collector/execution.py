@@ -100,7 +100,7 @@ def _release_graph(g, cache=None):
         pass
 
 
-def _open_graph(gid, loader, format, cache=None):
+def _open_graph(gid, loader, format, cache=None, min_ttl=0):
     if cache is None:
         result = loader(gid, format)
         if result is None and loader != http_get:
@@ -117,7 +117,7 @@ def _open_graph(gid, loader, format, cache=None):
             return g, ttl if ttl is not None else 0
         return result
     else:
-        return cache.create(gid=gid, loader=loader, format=format)
+        return cache.create(gid=gid, loader=loader, format=format, min_ttl=min_ttl)
 
 
 def _follow_in_breadth(n, next_seeds, tree_graph, workers, follow, pool, parent=None, queue=None, cycle=False):
@@ -214,7 +214,7 @@ class PlanExecutor(object):
         return graph
 
     def get_fragment_generator(self, workers=None, stop_event=None, queue_wait=None, queue_size=100, cache=None,
-                               loader=None, filters=None, follow_cycles=True, type_strict=True):
+                               loader=None, filters=None, follow_cycles=True, type_strict=True, min_ttl=0):
 
         from rdflib.plugins.sparql.sparql import QueryContext
 
@@ -242,7 +242,7 @@ class PlanExecutor(object):
         def __treat_resource_content(tg, uri, parse_format):
 
             try:
-                resource = _open_graph(uri, loader=loader, format=parse_format, cache=cache)
+                resource = _open_graph(uri, loader=loader, format=parse_format, cache=cache, min_ttl=min_ttl)
                 self.__n_derefs += 1
                 if isinstance(resource, bool):
                     return resource
@@ -18,21 +18,26 @@
   limitations under the License.
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
 """
+import base64
 import calendar
-import hashlib
+import gzip
+import heapq
+import json
 import logging
+import os
 import traceback
+from collections import OrderedDict
 from Queue import Empty, Full, Queue
 from StringIO import StringIO
 from datetime import datetime, timedelta
+from itertools import count
 from multiprocessing import cpu_count
 from threading import Event, Lock, Thread
-from time import sleep
+from time import sleep, time
 
 import networkx as nx
 import redis
 from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import wait
 from rdflib import ConjunctiveGraph, Graph
 from rdflib import Literal, RDF, RDFS, URIRef, Variable
 from rdflib.plugins.sparql.algebra import translateQuery
@@ -42,9 +47,10 @@ from rdflib.plugins.sparql.sparql import QueryContext
 from redis import ConnectionError
 from shortuuid import uuid
 
-from agora.collector import Collector, triplify
+from agora.collector import Collector, encode_quad, decode_quad, encode_quad_record, decode_quad_records
 from agora.collector.execution import StopException
 from agora.collector.plan import FilterTree
+from agora.engine.fountain.seed import seed_digest
 from agora.engine.plan.agp import TP, AGP
 from agora.engine.plan.graph import AGORA
 from agora.engine.utils import stopped, Singleton, Semaphore
@@ -56,6 +62,13 @@ __author__ = 'Fernando Serena'
 
 log = logging.getLogger('agora.collector.scholar')
 
+# Identifies the fragment state changes published by this process
+_origin = uuid()
+
+# Suffixes of the kv keys that any fragment may have, besides the ones of its filters
+_fragment_keys = ('gp', 'fc', 'plan', 'stream', 'stream:next', 'updated', 'stored', 'collecting', 'size', 'demanded',
+                  'version')
+
 
 def _remove_tp_filters(tp, filter_mapping={}, prefixes=None):
     # type: (TP, dict, dict) -> (str, dict)
@@ -98,29 +111,82 @@ class FragmentStream(object):
         self.key = key
         self.store = store
 
-    def get(self, until):
-        # type: (int) -> iter
-        if until is None:
-            until = '+inf'
-        for x in self.store.zrangebyscore(self.key, '-inf', '{}'.format(float(until))):
-            yield triplify(x)
+    def get(self, until, since=None, offset=0, limit=None):
+        # type: (int, int, int, int) -> iter
+        """
+        :param offset: Position (in stream order) of the first quad to be read
+        :param limit: Maximum number of quads to be read
+        """
+        if limit is not None and until is None and since is None:
+            # Positions are directly addressed when reading the whole stream
+            quads = self.store.zrange(self.key, offset, offset + limit - 1)
+        else:
+            until = '+inf' if until is None else '{}'.format(float(until))
+            since = '-inf' if since is None else '{}'.format(float(since))
+            if limit is None and not offset:
+                quads = self.store.zrangebyscore(self.key, since, until)
+            else:
+                num = -1 if limit is None else limit
+                quads = self.store.zrangebyscore(self.key, since, until, start=offset, num=num)
+        for x in quads:
+            yield decode_quad(x)
 
     def put(self, tp, (s, p, o), timestamp=None):
+        return bool(self.put_many([(tp, s, p, o)], timestamp=timestamp))
+
+    def put_many(self, quads, timestamp=None, chunk_size=1000):
+        # type: (list, int, int) -> int
+        """
+        Adds a batch of quads with ZADD NX, so that already streamed quads keep their original score
+        :return: Number of new quads in the stream
+        """
         try:
             if timestamp is None:
                 timestamp = calendar.timegm(datetime.utcnow().timetuple())
-            quad = (tp, s.n3(), p.n3(), o.n3())
-            not_found = not bool(self.store.zscore(self.key, quad))
-            if not_found:
-                with self.store.pipeline() as pipe:
-                    pipe.zadd(self.key, timestamp, quad)
-                    pipe.execute()
-            return not_found
+            with self.store.pipeline(transaction=False) as pipe:
+                for i in xrange(0, len(quads), chunk_size):
+                    args = []
+                    for tp, s, p, o in quads[i:i + chunk_size]:
+                        args.extend([timestamp, encode_quad(tp, s, p, o)])
+                    pipe.execute_command('ZADD', self.key, 'NX', *args)
+                return sum(pipe.execute())
         except Exception as e:
             traceback.print_exc()
             log.error(e.message)
             raise e
 
+    def remove_many(self, quads, chunk_size=1000):
+        # type: (list, int) -> int
+        """
+        :return: Number of quads that were actually removed from the stream
+        """
+        with self.store.pipeline(transaction=False) as pipe:
+            for i in xrange(0, len(quads), chunk_size):
+                pipe.zrem(self.key, *[encode_quad(tp, s, p, o) for tp, s, p, o in quads[i:i + chunk_size]])
+            return sum(pipe.execute())
+
+    def difference(self, other, chunk_size=1000):
+        # type: (FragmentStream, int) -> iter
+        """
+        Scans (without blocking) the stream for the members that are not in another one
+        :return: Encoded quads and their scores
+        """
+        chunk = []
+        for member, score in self.store.zscan_iter(self.key, count=chunk_size):
+            chunk.append((member, score))
+            if len(chunk) >= chunk_size:
+                for x in self.__missing(other, chunk):
+                    yield x
+                chunk = []
+        for x in self.__missing(other, chunk):
+            yield x
+
+    def __missing(self, other, members):
+        with self.store.pipeline(transaction=False) as pipe:
+            for member, _ in members:
+                pipe.zscore(other.key, member)
+            return [x for x, score in zip(members, pipe.execute()) if score is None]
+
     def clear(self):
         with self.store.pipeline() as pipe:
             pipe.delete(self.key)
@@ -128,6 +194,13 @@ class FragmentStream(object):
 
 
 class Fragment(object):
+    batch_size = 500
+    batch_interval = 0.5
+    # Seconds that readers of fragments collected by other processes wait for any progress
+    poll_timeout = 60
+    # Seconds for hit counts to decay by half
+    hit_half_life = 600
+
     def __init__(self, agp, kv, triples, fragments_key, fid, filters=None, follow_cycles=True):
         self.__lock = Lock()
         self.key = '{}:{}'.format(fragments_key, fid)
@@ -141,14 +214,33 @@ class Fragment(object):
         self.__plan_event = Event()
         self.__plan_event.clear()
         self.__stop_event = Semaphore()
+        # Cleared while a stored fragment is being refreshed
+        self.__refreshed = Event()
+        self.__refreshed.set()
+        # Version of the stored contents held by the local triple store
+        self.__version = None
+        # Whether other processes may collect it
+        self.shared = False
+        # Snapshot file whose contents are still to be loaded into the local triple store
+        self.__snapshot = None
+        # Usage tracking for eviction
+        self.__hits = 0.0
+        self.__last_hit = time()
+        self.__readers = 0
+        self.__size = 0
         self.__updated = False
         self.__aborted = False
         self.__tp_map = {}
         self.__seed_types = {}
         self.__observers = set([])
-        self.collecting = False
+        # Locally cached state flags, invalidated through the flags channel
+        self.__flags = None
+        self.__flags_version = 0
+        self.__flags_channel = '{}:flags'.format(fragments_key)
         self.__filters = filters if isinstance(filters, dict) else {}
         self.__follow_cycles = follow_cycles
+        # Collection priority (lower goes first)
+        self.priority = 0
 
     @property
     def lock(self):
@@ -174,16 +266,225 @@ class Fragment(object):
     def seed_digests(self):
         return self.__seed_digests
 
+    def __state(self):
+        # type: () -> dict
+        flags = self.__flags
+        if flags is None:
+            flags_version = self.__flags_version
+            with self.kv.pipeline(transaction=False) as pipe:
+                pipe.pttl('{}:updated'.format(self.key))
+                pipe.exists('{}:collecting'.format(self.key))
+                pipe.exists('{}:stored'.format(self.key))
+                pipe.exists('{}:demanded'.format(self.key))
+                pipe.get('{}:version'.format(self.key))
+                pipe.get('{}:updated'.format(self.key))
+                pttl, collecting, stored, demanded, version, ttl = pipe.execute()
+            flags = {
+                'expires_at': time() + pttl / 1000.0 if pttl is not None and pttl >= 0 else None,
+                'collecting': bool(collecting),
+                'stored': bool(stored),
+                'demanded': bool(demanded),
+                'version': int(version) if version is not None else None,
+                'ttl': int(ttl) if ttl is not None else None
+            }
+            # Do not keep what was fetched if it was invalidated meanwhile
+            if flags_version == self.__flags_version:
+                self.__flags = flags
+        return flags
+
+    def __changed(self, **flags):
+        if self.__flags is not None:
+            self.__flags = dict(self.__flags, **flags)
+        self.kv.publish(self.__flags_channel, '{}|{}'.format(_origin, self.fid))
+
+    def invalidate(self):
+        """
+        Forgets the cached state flags, so that they are fetched again on next access
+        """
+        self.__flags_version += 1
+        self.__flags = None
+
     @property
     def updated(self):
-        #     with self.lock:
-        self.__updated = False if self.kv.get('{}:updated'.format(self.key)) is None else True
+        expires_at = self.__state()['expires_at']
+        self.__updated = expires_at is not None and time() < expires_at
         return self.__updated
 
+    @property
+    def demanded(self):
+        # type: () -> bool
+        """
+        :return: Whether it was read (by any process) since the last collection
+        """
+        return self.__state()['demanded']
+
+    def __demand(self):
+        if not self.demanded:
+            self.kv.set('{}:demanded'.format(self.key), True)
+            self.__changed(demanded=True)
+
+    def __sync(self):
+        """
+        Rebuilds the local contexts from the stream when the stored contents were collected by another process
+        """
+        self.__restore()
+        version = self.__state()['version']
+        if version is None or version == self.__version:
+            return
+
+        with self.__lock:
+            plan_turtle = self.kv.get('{}:plan'.format(self.key))
+            if plan_turtle:
+                self.__set_plan(Graph().parse(StringIO(plan_turtle), format='turtle'))
+            contexts = {}
+            for c, tp in self.__tp_map.items():
+                contexts[c] = self.triples.get_context(str((self.fid, tp)))
+                self.triples.remove_context(contexts[c])
+            self.triples.addN((s, p, o, contexts[c]) for c, s, p, o in self.stream.get(None) if c in contexts)
+            self.__version = version
+            log.debug('Fragment {} synced to version {}'.format(self.fid, version))
+
+    def __restore(self):
+        """
+        Loads the contents of a pending snapshot into the local triple store (and the stream, if it is empty),
+        unless they are outdated
+        """
+        with self.__lock:
+            path = self.__snapshot
+            if path is None:
+                return
+            self.__snapshot = None
+            try:
+                with gzip.open(path, 'rb') as f:
+                    meta = json.loads(f.readline())
+                    if meta['version'] != self.__state()['version']:
+                        log.info('Snapshot of fragment {} is outdated'.format(self.fid))
+                        return
+                    contexts = {c: self.triples.get_context(str((self.fid, tp))) for c, tp in self.__tp_map.items()}
+                    quads = [q for q in decode_quad_records(iter(lambda: f.read(65536), '')) if q[0] in contexts]
+                self.triples.addN((s, p, o, contexts[c]) for c, s, p, o in quads)
+                if not self.kv.zcard(self.stream.key):
+                    self.stream.put_many(quads)
+                self.__version = meta['version']
+                log.info('Fragment {} restored from snapshot ({} triples)'.format(self.fid, len(quads)))
+            except (IOError, ValueError, KeyError) as e:
+                log.warn('Could not restore fragment {} from {}: {}'.format(self.fid, path, e))
+
+    def dump(self, path):
+        # type: (str) -> bool
+        """
+        Writes a snapshot of the stored contents, plan and metadata of the fragment to a file
+        :return: Whether the snapshot was written
+        """
+        version = self.__version
+        expires_at = self.__state()['expires_at']
+        plan_turtle = self.kv.get('{}:plan'.format(self.key))
+        if version is None or expires_at is None or plan_turtle is None or self.__snapshot is not None:
+            return False
+
+        meta = {
+            'fid': self.fid,
+            'gp': [repr(tp) for tp in self.__agp],
+            'filters': {str(v): list(fs) for v, fs in self.__filters.items()},
+            'fc': self.__follow_cycles,
+            'plan': plan_turtle,
+            'version': version,
+            'expires_at': expires_at,
+            'size': self.__size
+        }
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(json.dumps(meta) + '\n')
+            for c, tp in self.__tp_map.items():
+                for s, p, o in self.triples.get_context(str((self.fid, tp))):
+                    f.write(encode_quad_record(c, s, p, o))
+        # Contents may have been refreshed while being dumped
+        if version != self.__version:
+            os.remove(tmp_path)
+            return False
+        os.rename(tmp_path, path)
+        log.debug('Fragment {} dumped to {}'.format(self.fid, path))
+        return True
+
+    @classmethod
+    def restore(cls, kv, triples, fragments_key, path, prefixes=None):
+        # type: (redis.StrictRedis, ConjunctiveGraph, str, str, dict) -> Fragment
+        """
+        Registers again in kv a fragment from its snapshot, unless it already expired. Its contents are loaded on
+        first access
+        """
+        with gzip.open(path, 'rb') as f:
+            meta = json.loads(f.readline())
+        ttl = meta['expires_at'] - time()
+        if ttl < 1:
+            return None
+
+        fid = meta['fid']
+        key = '{}:{}'.format(fragments_key, fid)
+        agp = AGP(meta['gp'], prefixes=prefixes)
+        filters = {Variable(v): set(fs) for v, fs in meta['filters'].items()}
+        fragment = Fragment(agp, kv, triples, fragments_key, fid, filters=filters, follow_cycles=meta['fc'])
+        with kv.pipeline() as pipe:
+            fragment.save(pipe)
+            pipe.set('{}:plan'.format(key), meta['plan'])
+            pipe.set('{}:version'.format(key), meta['version'])
+            pipe.set('{}:size'.format(key), meta['size'])
+            pipe.sadd(fragments_key, fid)
+            pipe.execute()
+        fragment.updated_for(ttl)
+        return Fragment.load(kv, triples, fragments_key, fid, prefixes=prefixes, snapshot=path)
+
+    def __commit(self):
+        # Only called by the collecting process, whose local contents are already in line
+        self.__version = self.kv.incr('{}:version'.format(self.key))
+        self.__changed(version=self.__version)
+
+    def __hit(self):
+        self.__hits = self.usage + 1
+        self.__last_hit = time()
+
+    @property
+    def usage(self):
+        # type: () -> float
+        """
+        :return: Hit count, aged so that old hits weigh less than recent ones
+        """
+        return self.__hits * 0.5 ** ((time() - self.__last_hit) / Fragment.hit_half_life)
+
+    @property
+    def last_hit(self):
+        return self.__last_hit
+
+    @property
+    def readers(self):
+        return self.__readers
+
+    @property
+    def size(self):
+        # type: () -> int
+        """
+        :return: Number of stored triples
+        """
+        return self.__size
+
+    @size.setter
+    def size(self, n):
+        self.__size = n
+        self.kv.set('{}:size'.format(self.key), n)
+
     @property
     def follow_cycles(self):
         return self.__follow_cycles
 
+    @property
+    def expires_in(self):
+        # type: () -> int
+        """
+        :return: Seconds until the fragment is no longer up-to-date (None if it is not)
+        """
+        expires_at = self.__state()['expires_at']
+        return expires_at - time() if expires_at is not None and time() < expires_at else None
+
     @property
     def updated_ts(self):
         # with self.lock:
@@ -193,8 +494,15 @@ class Fragment(object):
 
     @property
     def newcomer(self):
-        # with self.lock:
-        return self.kv.get('{}:stored'.format(self.key)) is None
+        return not self.__state()['stored']
+
+    @property
+    def ttl(self):
+        # type: () -> int
+        """
+        :return: Seconds the fragment was up-to-date for after its last collection (None if it is not anymore)
+        """
+        return self.__state()['ttl']
 
     def updated_for(self, ttl):
         ttl = int(min(10000000, ttl))
@@ -209,12 +517,15 @@ class Fragment(object):
             else:
                 pipe.delete(updated_key)
             pipe.execute()
+        if self.__updated:
+            self.__changed(expires_at=time() + ttl, stored=True, ttl=ttl)
+        else:
+            self.__changed(expires_at=None, ttl=None)
         log.info('Fragment {} will be up-to-date for {}s'.format(self.fid, ttl))
 
     @property
     def collecting(self):
-        # with self.lock:
-        return False if self.kv.get('{}:collecting'.format(self.key)) is None else True
+        return self.__state()['collecting']
 
     @property
     def aborted(self):
@@ -222,8 +533,13 @@ class Fragment(object):
 
     @property
     def stored(self):
-        # with self.lock:
-        return False if self.kv.get('{}:stored'.format(self.key)) is None else True
+        return self.__state()['stored']
+
+    @stored.setter
+    def stored(self, state):
+        self.kv.set('{}:stored'.format(self.key), state)
+        # As with the kv flag, any value means stored (no longer a newcomer)
+        self.__changed(stored=True)
 
     @collecting.setter
     def collecting(self, state):
@@ -232,46 +548,90 @@ class Fragment(object):
             self.kv.set(collecting_key, state)
         else:
             self.kv.delete(collecting_key)
+        self.__changed(collecting=bool(state))
 
     @classmethod
-    def load(cls, kv, triples, fragments_key, fid, prefixes=None):
-        # type: (redis.StrictRedis, ConjunctiveGraph, str, str) -> Fragment
+    def load(cls, kv, triples, fragments_key, fid, prefixes=None, shared=False, snapshot=None):
+        # type: (redis.StrictRedis, ConjunctiveGraph, str, str, dict, bool, str) -> Fragment
+        """
+        :param shared: Whether the fragment may be collected by other processes, so that its contents are taken from
+        the stream when they are not in the local triple store
+        :param snapshot: Snapshot file to load the contents from if they are not in the local triple store
+        """
         try:
-            if not any([fid in c.identifier for c in list(triples.contexts())]):
+            missing = not shared and not any([fid in c.identifier for c in list(triples.contexts())])
+            if missing and (snapshot is None or not os.path.exists(snapshot)):
                 raise EnvironmentError('Fragment context is not present in the triple store')
 
             agp = AGP(kv.smembers('{}:{}:gp'.format(fragments_key, fid)), prefixes=prefixes)
             plan_turtle = kv.get('{}:{}:plan'.format(fragments_key, fid))
             follow_cycles = bool(int(kv.get('{}:{}:fc'.format(fragments_key, fid))))
             fragment = Fragment(agp, kv, triples, fragments_key, fid, follow_cycles=follow_cycles)
-            fragment.plan = Graph().parse(StringIO(plan_turtle), format='turtle')
-            sparql_filter_keys = kv.keys('{}:{}:filters:*'.format(fragments_key, fid))
-            for var_filter_key in sparql_filter_keys:
-                v = var_filter_key.split(':')[-1]
-                fragment.filters[Variable(v)] = set(kv.smembers(var_filter_key))
+            fragment.shared = shared
+            if plan_turtle is not None:
+                fragment.plan = Graph().parse(StringIO(plan_turtle), format='turtle')
+            elif not shared:
+                raise EnvironmentError('Fragment plan is missing')
+            if missing:
+                fragment.__snapshot = snapshot
+            elif not shared:
+                # Local contents are the ones stored
+                fragment.__version = fragment.__state()['version']
+            fragment.size = int(kv.get('{}:{}:size'.format(fragments_key, fid)) or 0)
+            filter_keys = filter(lambda k: k.startswith('filters:'),
+                                 Fragment.__registered_keys(kv, '{}:{}'.format(fragments_key, fid)))
+            for filter_key in filter_keys:
+                v = filter_key.split(':')[-1]
+                fragment.filters[Variable(v)] = set(kv.smembers('{}:{}:{}'.format(fragments_key, fid, filter_key)))
             return fragment
         except Exception, e:
-            with kv.pipeline() as pipe:
-                for fragment_key in kv.keys('{}*{}*'.format(fragments_key, fid)):
-                    pipe.delete(fragment_key)
-                pipe.execute()
+            Fragment.__purge(kv, '{}:{}'.format(fragments_key, fid))
+
+    @staticmethod
+    def __registered_keys(kv, fragment_key):
+        # type: (redis.StrictRedis, str) -> set
+        """
+        :return: Suffixes of all the kv keys of a fragment, as registered when it was saved
+        """
+        registry_key = '{}:keys'.format(fragment_key)
+        suffixes = kv.smembers(registry_key)
+        if not suffixes:
+            # Fragments saved before the registry existed: scan (without blocking) once and register
+            prefix = '{}:'.format(fragment_key)
+            suffixes = set([k[len(prefix):] for k in kv.scan_iter(match='{}*'.format(prefix), count=1000)])
+            suffixes.discard('keys')
+            if suffixes:
+                kv.sadd(registry_key, *suffixes)
+        return suffixes
+
+    @staticmethod
+    def __purge(kv, fragment_key):
+        # type: (redis.StrictRedis, str) -> None
+        suffixes = Fragment.__registered_keys(kv, fragment_key).union(_fragment_keys)
+        keys = ['{}:{}'.format(fragment_key, suffix) for suffix in suffixes]
+        kv.delete(fragment_key, '{}:keys'.format(fragment_key), *keys)
 
     def save(self, pipe):
         fragment_key = '{}:{}'.format(self.__fragments_key, self.fid)
         pipe.delete(fragment_key)
         pipe.sadd('{}:gp'.format(fragment_key), *self.__agp)
         pipe.set('{}:fc'.format(fragment_key), 1 if self.__follow_cycles else 0)
+        filter_keys = []
         for v in self.__filters.keys():
             for f in self.__filters[v]:
                 pipe.sadd('{}:filters:{}'.format(fragment_key, str(v)), f)
+            filter_keys.append('filters:{}'.format(str(v)))
+        # Registry of keys, so that they are never looked up by pattern
+        pipe.sadd('{}:keys'.format(fragment_key), *(list(_fragment_keys) + filter_keys))
 
     @property
     def generator(self):
         def w_listen(ts):
-            def listen(quad):
+            def listen(quads):
                 if datetime.utcnow() > ts:
                     try:
-                        listen_queue.put_nowait(quad)
+                        for quad in quads:
+                            listen_queue.put_nowait(quad)
                     except Full as e:
                         log.warn(e.message)
                     except Exception:
@@ -279,52 +639,162 @@ class Fragment(object):
 
             return listen
 
-        if self.stored:
-            for c in self.__tp_map:
-                for s, p, o in self.triples.get_context(str((self.fid, self.__tp_map[c]))):
-                    yield self.__tp_map[c], s, p, o
-        else:
-            until = datetime.utcnow()
-            listener = w_listen(until)
-            try:
-                until_ts = calendar.timegm(until.timetuple())
-                listen_queue = Queue(maxsize=10000)
-                with self.__lock:
-                    self.__observers.add(listener)
-
-                for c, s, p, o in self.stream.get(until_ts):
-                    yield self.__tp_map[c], s, p, o
+        self.__demand()
+        self.__hit()
+        with self.__lock:
+            self.__readers += 1
+        try:
+            if self.stored:
+                # Do not serve contents that are about to change
+                while not self.__refreshed.wait(timeout=1.0) and not stopped.isSet():
+                    pass
+                self.__sync()
+                for c in self.__tp_map:
+                    for s, p, o in self.triples.get_context(str((self.fid, self.__tp_map[c]))):
+                        yield self.__tp_map[c], s, p, o
+            elif self.shared:
+                for quad in self.__poll():
+                    yield quad
+            else:
+                until = datetime.utcnow()
+                listener = w_listen(until)
+                try:
+                    until_ts = calendar.timegm(until.timetuple())
+                    listen_queue = Queue(maxsize=10000)
+                    with self.__lock:
+                        self.__observers.add(listener)
 
-                while not self.__aborted and (not self.__updated or not listen_queue.empty()):
-                    try:
-                        c, s, p, o = listen_queue.get(timeout=0.1)
+                    for c, s, p, o in self.stream.get(until_ts):
                         yield self.__tp_map[c], s, p, o
-                    except Empty:
-                        pass
-                    except KeyboardInterrupt:
-                        stopped.set()
-                    except Exception:
-                        traceback.print_exc()
-                        break
-            finally:
-                with self.__lock:
-                    self.__observers.remove(listener)
+
+                    while not self.__aborted and (not self.__updated or not listen_queue.empty()):
+                        try:
+                            c, s, p, o = listen_queue.get(timeout=0.1)
+                            yield self.__tp_map[c], s, p, o
+                        except Empty:
+                            pass
+                        except KeyboardInterrupt:
+                            stopped.set()
+                        except Exception:
+                            traceback.print_exc()
+                            break
+                finally:
+                    with self.__lock:
+                        self.__observers.remove(listener)
+        finally:
+            with self.__lock:
+                self.__readers -= 1
+
+    def page(self, cursor=None, limit=1000):
+        # type: (str, int) -> tuple
+        """
+        Reads a bounded page of the fragment contents, once they are complete
+        :param cursor: Token of the page to be read, as returned with the previous one (None for the first page)
+        :return: The quads of the page and the cursor of the next one (None if it is the last page)
+        """
+        if limit < 1:
+            raise ValueError('Invalid limit: {}'.format(limit))
+        cursor_version, offset = _decode_cursor(cursor) if cursor is not None else (None, 0)
+        version_key = '{}:version'.format(self.key)
+        collecting_key = '{}:collecting'.format(self.key)
+        stored_key = '{}:stored'.format(self.key)
+
+        def collecting_contents():
+            # Refreshes collect aside and swap at once, so only first collections change the stream meanwhile
+            with self.kv.pipeline(transaction=False) as pipe:
+                pipe.exists(collecting_key)
+                pipe.exists(stored_key)
+                collecting, stored = pipe.execute()
+            return collecting and not stored
+
+        self.__demand()
+        self.__hit()
+        with self.__lock:
+            self.__readers += 1
+        try:
+            while not stopped.isSet():
+                if self.__aborted:
+                    raise EnvironmentError('Fragment {} was aborted'.format(self.fid))
+                # Do not serve contents that are being collected or about to change
+                self.__refreshed.wait(timeout=1.0)
+                version = self.kv.get(version_key)
+                if version is None or collecting_contents():
+                    sleep(0.1)
+                    continue
+                version = int(version)
+                if cursor_version is not None and cursor_version != version:
+                    raise ValueError('Fragment {} has changed since the cursor was issued'.format(self.fid))
+                self.__sync()
+                quads = list(self.stream.get(None, offset=offset, limit=limit + 1))
+                # The page is only valid if contents did not change meanwhile
+                if self.kv.get(version_key) == str(version) and not collecting_contents():
+                    next_cursor = _encode_cursor(version, offset + limit) if len(quads) > limit else None
+                    page = [(self.__tp_map[c], s, p, o) for c, s, p, o in quads[:limit] if c in self.__tp_map]
+                    return page, next_cursor
+            return [], None
+        finally:
+            with self.__lock:
+                self.__readers -= 1
+
+    def __poll(self, interval=0.2, timeout=None):
+        """
+        Reads the stream of a fragment that may be being collected by another process
+        :param timeout: Seconds without any progress (new quads or collection started) after which it gives up
+        """
+        timeout = Fragment.poll_timeout if timeout is None else timeout
+        # Only the quads of the previous read can be read again, as reads overlap by one second
+        seen = set([])
+        since = None
+        started = False
+        last_progress = time()
+        while not self.__aborted and not stopped.isSet():
+            updated = self.updated
+            collecting = self.collecting
+            if collecting and not started:
+                started = True
+                last_progress = time()
+            now = calendar.timegm(datetime.utcnow().timetuple())
+            read = set(self.stream.get(None, since=since))
+            new_quads = read.difference(seen)
+            for c, s, p, o in new_quads:
+                if c in self.__tp_map:
+                    yield self.__tp_map[c], s, p, o
+            if new_quads:
+                last_progress = time()
+            seen = read
+            since = now - 1
+            if updated or (started and not collecting):
+                break
+            if time() - last_progress > timeout:
+                raise EnvironmentError('Fragment {} is not being collected'.format(self.fid))
+            sleep(interval)
 
     @property
     def plan(self):
         # type: () -> Graph
-        self.__plan_event.wait()
+        while not self.__plan_event.wait(timeout=0.5):
+            # The plan may have been made by another process
+            if self.shared:
+                plan_turtle = self.kv.get('{}:plan'.format(self.key))
+                if plan_turtle:
+                    self.__set_plan(Graph().parse(StringIO(plan_turtle), format='turtle'))
+            if stopped.isSet():
+                break
         return self.__plan
 
     @plan.setter
     def plan(self, p):
         # type: (Graph) -> None
-        self.__plan = p
         with self.kv.pipeline() as pipe:
             g = Graph()
             plan_str = p.skolemize(g).serialize(format='turtle')
             pipe.set('{}:plan'.format(self.key), plan_str)
             pipe.execute()
+        self.__set_plan(p)
+
+    def __set_plan(self, p):
+        # type: (Graph) -> None
+        self.__plan = p
         self.__tp_map = extract_tps_from_plan(self.__plan)
         self.__seed_types = extract_seed_types_from_plan(self.__plan)
         self.__calculate_seed_digests()
@@ -333,22 +803,95 @@ class Fragment(object):
     def __calculate_seed_digests(self):
         self.__seed_digests = {}
         for type, seeds in self.__seed_types.items():
-            m = hashlib.md5()
-            for seed in sorted(seeds):
-                m.update(seed)
-            self.__seed_digests[type] = m.digest().encode('base64').strip()
+            self.__seed_digests[type] = seed_digest(seeds)
 
-    def __notify(self, quad):
+    def __flush(self, quads, contexts):
+        # Stream, store and notify a batch of quads at once. Readers register under the same lock, so every
+        # batch is either in the stream when they start reading or notified to them afterwards
+        if not quads:
+            return
         with self.__lock:
+            self.stream.put_many(quads)
+            self.triples.addN((s, p, o, contexts[c]) for c, s, p, o in quads)
             for observer in self.__observers:
-                observer(quad)
+                observer(quads)
 
     def shutdown(self):
         self.__stop_event.set()
 
-    def populate(self, collector):
+    def __apply_delta(self, back, prev_tp_map):
+        # type: (FragmentStream, dict) -> (int, int)
+        """
+        Swaps the stored contents for those of a refreshed collection, writing only what changed in the stream and
+        the local contexts. The stream changes and the new version are committed at once, so that readers keep
+        getting the previous contents until then
+        :param back: Stream of the refreshed collection
+        :param prev_tp_map: The tp map of the plan the stored data was collected with
+        :return: Number of added and removed quads
+        """
+        prev_ids = {tp: c for c, tp in prev_tp_map.items()}
+        relabeled = any(prev_ids.get(tp, c) != c for c, tp in self.__tp_map.items())
+        version_key = '{}:version'.format(self.key)
+        if relabeled:
+            # Stream members are bound to plan tp ids, so it is replaced as a whole
+            with self.kv.pipeline() as pipe:
+                pipe.zcard(self.stream.key)
+                pipe.zunionstore(self.stream.key, [back.key])
+                pipe.delete(back.key)
+                pipe.incr(version_key)
+                n_removed, n_added, _, version = pipe.execute()
+            removed = []
+            added = list(self.stream.get(None))
+        else:
+            removed = list(self.stream.difference(back))
+            added = list(back.difference(self.stream))
+            with self.kv.pipeline() as pipe:
+                for i in xrange(0, len(removed), 1000):
+                    pipe.zrem(self.stream.key, *[member for member, _ in removed[i:i + 1000]])
+                for i in xrange(0, len(added), 1000):
+                    args = []
+                    for member, score in added[i:i + 1000]:
+                        args.extend([score, member])
+                    pipe.execute_command('ZADD', self.stream.key, 'NX', *args)
+                pipe.delete(back.key)
+                pipe.incr(version_key)
+                version = pipe.execute()[-1]
+            n_added, n_removed = len(added), len(removed)
+            removed = [decode_quad(member) for member, _ in removed]
+            added = [decode_quad(member) for member, _ in added]
+
+        # Local readers wait while the contexts change (the fragment lock is held by the caller)
+        self.__refreshed.clear()
+        contexts = {c: self.triples.get_context(str((self.fid, tp))) for c, tp in self.__tp_map.items()}
+        if relabeled:
+            for context in contexts.values():
+                self.triples.remove_context(context)
+        for c, s, p, o in removed:
+            if c in contexts:
+                contexts[c].remove((s, p, o))
+        self.triples.addN((s, p, o, contexts[c]) for c, s, p, o in added if c in contexts)
+        self.__version = version
+        self.__changed(version=version)
+        return n_added, n_removed
+
+    def populate(self, collector, min_ttl=0):
+        """
+        :param min_ttl: Cached resources that are valid for less seconds are dereferenced again
+        """
+        # Fragments that were already stored are refreshed in place, applying only what changed
+        refresh = not self.newcomer
+        if refresh:
+            self.__sync()
+        prev_tp_map = self.__tp_map
         self.collecting = True
-        self.stream.clear()
+        self.kv.delete('{}:demanded'.format(self.key))
+        self.__changed(demanded=False)
+        # Refreshed contents are collected aside, stored ones are served meanwhile
+        back = FragmentStream(self.kv, '{}:stream:next'.format(self.key)) if refresh else None
+        if refresh:
+            back.clear()
+        else:
+            self.stream.clear()
 
         completed = False
         n_triples = 0
@@ -356,7 +899,7 @@ class Fragment(object):
         try:
             collect_dict = collector.get_fragment_generator(self.agp, filters=self.filters,
                                                             stop_event=self.__stop_event,
-                                                            follow_cycles=self.follow_cycles)
+                                                            follow_cycles=self.follow_cycles, min_ttl=min_ttl)
             generator = collect_dict['generator']
             self.plan = collect_dict['plan']
             self.__aborted = False
@@ -365,15 +908,50 @@ class Fragment(object):
             self.__aborted = True
         else:
             back_id = uuid()
+            if refresh:
+                flush = back.put_many
+            else:
+                back_contexts = {c: self.triples.get_context(str((back_id, tp))) for c, tp in
+                                 self.__tp_map.items()}
+
+                def flush(quads):
+                    self.__flush(quads, back_contexts)
+
             pre_time = datetime.utcnow()
+            batch = []
+            batch_lock = Lock()
+            last_flush = [time()]
+            generated = Event()
+
+            def flush_batch():
+                with batch_lock:
+                    if batch:
+                        flush(batch[:])
+                        del batch[:]
+                    last_flush[0] = time()
+
+            def flush_idle():
+                # Quads may stop arriving for a while (e.g. slow dereferences), batches are not kept waiting
+                while not generated.wait(Fragment.batch_interval):
+                    if time() - last_flush[0] >= Fragment.batch_interval:
+                        try:
+                            flush_batch()
+                        except Exception:
+                            traceback.print_exc()
+                            self.__aborted = True
+
+            flusher = Thread(target=flush_idle)
+            flusher.daemon = True
+            flusher.start()
             try:
                 while not completed:
                     c, s, p, o = generator.next()
-                    tp = self.__tp_map[c.id]
-                    self.stream.put(c.id, (s, p, o))
-                    self.triples.get_context(str((back_id, tp))).add((s, p, o))
-                    self.__notify((c.id, s, p, o))
+                    with batch_lock:
+                        batch.append((c.id, s, p, o))
+                        full = len(batch) >= Fragment.batch_size
                     n_triples += 1
+                    if full:
+                        flush_batch()
             except StopIteration:
                 completed = True
             except StopException:
@@ -381,16 +959,32 @@ class Fragment(object):
             except Exception:
                 traceback.print_exc()
                 self.__aborted = True
+            finally:
+                generated.set()
+                flusher.join()
+
+            try:
+                flush_batch()
+            except Exception:
+                traceback.print_exc()
+                self.__aborted = True
 
         try:
             with self.lock:
                 if not stopped.isSet() and completed and not self.aborted:
-                    # Replace graph store and update ttl
-                    for tp in self.__tp_map.values():
-                        self.triples.remove_context(self.triples.get_context(str((self.fid, tp))))
-                        self.triples.get_context(str((self.fid, tp))).__iadd__(
-                            self.triples.get_context(str((back_id, tp))))
-                        self.triples.remove_context(self.triples.get_context(str((back_id, tp))))
+                    if refresh:
+                        n_added, n_removed = self.__apply_delta(back, prev_tp_map)
+                        log.info('Refreshed fragment {}: +{} -{} triples'.format(self.fid, n_added, n_removed))
+                    else:
+                        # Replace graph store
+                        for tp in self.__tp_map.values():
+                            self.triples.remove_context(self.triples.get_context(str((self.fid, tp))))
+                            self.triples.get_context(str((self.fid, tp))).__iadd__(
+                                self.triples.get_context(str((back_id, tp))))
+                            self.triples.remove_context(self.triples.get_context(str((back_id, tp))))
+                        self.__commit()
+                    self.size = n_triples
+                    # Update ttl
                     actual_ttl = collect_dict.get('ttl')()
                     if not n_triples and actual_ttl >= 10000000:
                         actual_ttl = 0
@@ -406,6 +1000,7 @@ class Fragment(object):
             pass
         finally:
             self.collecting = False
+            self.__refreshed.set()
 
     def remove(self):
         # type: () -> None
@@ -423,10 +1018,8 @@ class Fragment(object):
 
         try:
             # Remove fragment keys in kv
-            with self.kv.pipeline() as pipe:
-                for fragment_key in self.kv.keys('{}*{}*'.format(self.__fragments_key, self.fid)):
-                    pipe.delete(fragment_key)
-                pipe.execute()
+            Fragment.__purge(self.kv, self.key)
+            self.__changed(expires_at=None, ttl=None, collecting=False, stored=False)
         except ConnectionError:
             pass
 
@@ -444,13 +1037,176 @@ class Fragment(object):
                 return agp_map
 
 
+class CollectionQueue(object):
+    """
+    Fair queue of pending fragment collections. Indexes are served in turns and, within each index,
+    fragments are taken by priority (lower first) and then by arrival order
+    """
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__queues = OrderedDict()
+        # (index key, fragment id) -> current priority
+        self.__queued = {}
+        self.__seq = count()
+
+    def put(self, index_key, fid, priority=0):
+        # type: (str, str, any) -> bool
+        """
+        Enqueues a collection, or raises the priority of an already pending one
+        """
+        with self.__lock:
+            if (index_key, fid) in self.__queued and self.__queued[(index_key, fid)] <= priority:
+                return False
+            # Entries with a former priority are skipped when popped
+            self.__queued[(index_key, fid)] = priority
+            if index_key not in self.__queues:
+                self.__queues[index_key] = []
+            heapq.heappush(self.__queues[index_key], (priority, next(self.__seq), fid))
+            return True
+
+    def get(self):
+        # type: () -> tuple
+        with self.__lock:
+            while self.__queues:
+                # Serve the index in turn and move it to the end of the line
+                index_key, queue = self.__queues.popitem(last=False)
+                priority, _, fid = heapq.heappop(queue)
+                if queue:
+                    self.__queues[index_key] = queue
+                if self.__queued.get((index_key, fid), None) == priority:
+                    del self.__queued[(index_key, fid)]
+                    return index_key, fid
+            return None
+
+    def __contains__(self, item):
+        return item in self.__queued
+
+    def __len__(self):
+        return len(self.__queued)
+
+
+class CollectionJobs(object):
+    """
+    Redis-backed queue of fragment collections for indexes shared by several processes. Jobs are taken by
+    priority and arrival order, and claiming one grants an expiring lease that the worker has to renew
+    while collecting
+    """
+    # Number of pending jobs looked at when claiming, leased ones stay queued until their collection ends
+    claim_window = 10
+
+    __put_script = """
+    if redis.call('EXISTS', KEYS[2]) == 0 then
+        local score = redis.call('ZSCORE', KEYS[1], ARGV[2])
+        if not score or tonumber(ARGV[1]) < tonumber(score) then
+            redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+            return 1
+        end
+    end
+    return 0
+    """
+
+    __claim_script = """
+    local fids = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[4]) - 1)
+    for _, fid in ipairs(fids) do
+        if redis.call('SET', ARGV[1] .. fid, ARGV[2], 'EX', ARGV[3], 'NX') then
+            redis.call('ZREM', KEYS[1], fid)
+            return fid
+        end
+    end
+    return false
+    """
+
+    __renew_script = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    __release_script = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, kv, key, lease_ttl=30):
+        # type: (redis.StrictRedis, str, int) -> None
+        self.__kv = kv
+        self.__key = key
+        self.__lease_ttl = lease_ttl
+        self.__put = kv.register_script(CollectionJobs.__put_script)
+        self.__claim = kv.register_script(CollectionJobs.__claim_script)
+        self.__renew = kv.register_script(CollectionJobs.__renew_script)
+        self.__release = kv.register_script(CollectionJobs.__release_script)
+
+    def __lease_key(self, fid):
+        return '{}:lease:{}'.format(self.__key, fid)
+
+    @property
+    def lease_ttl(self):
+        return self.__lease_ttl
+
+    def put(self, fid, priority=0):
+        # type: (str, int) -> bool
+        """
+        Enqueues a collection unless it is leased, or raises the priority of an already pending one
+        """
+        # Arrival time breaks ties within the same priority
+        score = priority * 10 ** 10 + time()
+        return bool(self.__put(keys=[self.__key, self.__lease_key(fid)], args=[score, fid]))
+
+    def claim(self, worker):
+        # type: (str) -> str
+        """
+        :return: The id of the next fragment to be collected by the given worker, if any
+        """
+        return self.__claim(keys=[self.__key],
+                            args=['{}:lease:'.format(self.__key), worker, self.__lease_ttl, self.claim_window])
+
+    def renew(self, fid, worker):
+        # type: (str, str) -> bool
+        return bool(self.__renew(keys=[self.__lease_key(fid)], args=[worker, self.__lease_ttl]))
+
+    def release(self, fid, worker):
+        # type: (str, str) -> bool
+        return bool(self.__release(keys=[self.__lease_key(fid)], args=[worker]))
+
+    def leased(self, fid):
+        # type: (str) -> bool
+        return bool(self.__kv.exists(self.__lease_key(fid)))
+
+    def __len__(self):
+        return self.__kv.zcard(self.__key)
+
+
 class FragmentIndex(object):
     __metaclass__ = Singleton
     instances = {}
     daemon_event = Event()
     daemon_event.clear()
     daemon_th = None
-    tpool = ThreadPoolExecutor(max_workers=cpu_count())
+    # Maximum number of concurrent fragment collections
+    max_collections = cpu_count()
+    # Maximum seconds between daemon wake-ups (lease renewals)
+    check_interval = 1
+    # Seconds between checks of all fragments (seed digests, orphans), otherwise only the due ones are checked
+    sweep_interval = 30
+    # Aged hit count from which fragments are refreshed before colder ones
+    hot_usage = 5.0
+    # Seconds before expiring that hot fragments start being refreshed, so that they are never outdated
+    refresh_ahead = 5
+    tpool = ThreadPoolExecutor(max_workers=max_collections)
+    # Fragment snapshots are written one at a time, in the background
+    snapshot_pool = ThreadPoolExecutor(max_workers=1)
+    pending = CollectionQueue()
+    # Per-fragment wake-up timers: heap of (due, index key, fragment id)
+    timers = []
+    timer_dues = {}
+    timers_lock = Lock()
+    # Fragments to be checked on the next daemon iteration: set of (index key, fragment id)
+    due_checks = set([])
 
     def __init__(self, id='', **kwargs):
         # type: (any, str) -> FragmentIndex
@@ -458,9 +1214,24 @@ class FragmentIndex(object):
         self.__key_prefix = id
         self.__fragments_key = '{}:fragments'.format(id)
         self.lock = Lock()
+        self.__jobs = CollectionJobs(self.kv, '{}:jobs'.format(self.__fragments_key),
+                                     lease_ttl=kwargs.get('lease_ttl', 30)) if self.distributed else None
         # Load fragments from kv
-        self.__fragments = dict(self.__load_fragments())
+        self.__fragments = {} if self.distributed else dict(self.__load_fragments())
+        # Fragment ids by canonical agp signature
+        self.__signatures = {}
+        for fragment in self.__fragments.values():
+            self.__index_fragment(fragment)
         self.__id = id
+        # Keep cached fragment flags in line with changes made by other processes
+        self.__watching = Event()
+        self.__watching.set()
+        watcher = Thread(target=self.__watch_flags)
+        watcher.daemon = True
+        watcher.start()
+        if self.distributed:
+            with self.lock:
+                self.sync()
 
     def __new__(cls, id='', force_seed=None, **kwargs):
         index = super(FragmentIndex, cls).__new__(cls)
@@ -471,6 +1242,14 @@ class FragmentIndex(object):
         cache = kwargs.get('cache', None)
         index.cache = cache
         index.force_seed = force_seed
+        # Whether to answer from up-to-date fragments that contain the requested graph pattern
+        index.containment = kwargs.get('containment', False)
+        # Budget of stored triples for all fragments (None for no limit)
+        index.max_triples = kwargs.get('max_triples', None)
+        # Whether fragments are shared with (and collected by) other processes through the kv
+        index.distributed = kwargs.get('distributed', False)
+        # Directory where fragments are snapshotted after being collected (None for no snapshots)
+        index.snapshot_dir = kwargs.get('snapshot_dir', None)
         triples = get_triple_store(**kwargs)
         if cache is not None:
             kv = cache.r
@@ -488,8 +1267,9 @@ class FragmentIndex(object):
     def clear(self):
         with self.lock:
             for fragment in self.fragments.values():
-                fragment.remove()
+                self.__remove_fragment(fragment)
             self.__fragments.clear()
+            self.__signatures.clear()
 
     def shutdown(self):
         with self.lock:
@@ -508,6 +1288,8 @@ class FragmentIndex(object):
             #         pass
 
             self.__fragments.clear()
+            self.__signatures.clear()
+            self.__watching.clear()
 
             del FragmentIndex.instances[self.id]
             try:
@@ -515,9 +1297,48 @@ class FragmentIndex(object):
             except Exception:
                 pass
 
-    def notify(self):
+    def notify(self, fid=None):
+        """
+        Wakes up the daemon, to check the given fragment if any
+        """
+        if fid is not None:
+            with FragmentIndex.timers_lock:
+                FragmentIndex.due_checks.add((self.id, fid))
         FragmentIndex.daemon_event.set()
 
+    def __invalidate_all(self):
+        for fragment in self.__fragments.values():
+            fragment.invalidate()
+
+    def __watch_flags(self):
+        channel = '{}:flags'.format(self.__fragments_key)
+        while self.__watching.isSet() and not stopped.isSet():
+            pubsub = None
+            try:
+                pubsub = self.kv.pubsub()
+                pubsub.subscribe(channel)
+                # Changes may have been missed while not subscribed
+                self.__invalidate_all()
+                while self.__watching.isSet() and not stopped.isSet():
+                    message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None or message['type'] != 'message':
+                        continue
+                    origin, fid = message['data'].split('|', 1)
+                    if origin != _origin:
+                        fragment = self.__fragments.get(fid, None)
+                        if fragment is not None:
+                            fragment.invalidate()
+            except Exception as e:
+                log.warn('Fragment flags subscription failed: {}'.format(e.message))
+                self.__invalidate_all()
+                sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
     @property
     def id(self):
         return self.__id
@@ -566,6 +1387,74 @@ class FragmentIndex(object):
     def force_seed(self):
         return self.__force_seed
 
+    @property
+    def containment(self):
+        return self.__containment
+
+    @property
+    def snapshot_dir(self):
+        return self.__snapshot_dir
+
+    @snapshot_dir.setter
+    def snapshot_dir(self, d):
+        if d is not None and not os.path.exists(d):
+            os.makedirs(d)
+        self.__snapshot_dir = d
+
+    def __snapshot_file(self, fid):
+        # type: (str) -> str
+        if self.__snapshot_dir is not None:
+            return os.path.join(self.__snapshot_dir, '{}.snap.gz'.format(fid))
+
+    def __remove_fragment(self, fragment):
+        # type: (Fragment) -> None
+        # A snapshot left behind would bring the fragment back on the next load
+        fragment.remove()
+        snapshot_file = self.__snapshot_file(fragment.fid)
+        if snapshot_file is not None and os.path.exists(snapshot_file):
+            os.remove(snapshot_file)
+
+    def snapshot(self, fid):
+        # type: (str) -> Future
+        """
+        Dumps a fragment to its snapshot file in the background
+        """
+        path = self.__snapshot_file(fid)
+        fragment = self.__fragments.get(fid, None)
+        if path is not None and fragment is not None:
+            def dump():
+                try:
+                    fragment.dump(path)
+                except Exception as e:
+                    log.warn('Could not snapshot fragment {}: {}'.format(fid, e))
+
+            return FragmentIndex.snapshot_pool.submit(dump)
+
+    @property
+    def distributed(self):
+        return self.__distributed
+
+    @distributed.setter
+    def distributed(self, d):
+        self.__distributed = d
+
+    @property
+    def jobs(self):
+        # type: () -> CollectionJobs
+        return self.__jobs
+
+    @property
+    def max_triples(self):
+        return self.__max_triples
+
+    @max_triples.setter
+    def max_triples(self, n):
+        self.__max_triples = n
+
+    @containment.setter
+    def containment(self, c):
+        self.__containment = c
+
     @force_seed.setter
     def force_seed(self, s):
         self.__force_seed = s
@@ -574,77 +1463,206 @@ class FragmentIndex(object):
         if not self.force_seed:
             return self.planner.fountain.get_seed_type_digest(ty)
         else:
-            m = hashlib.md5()
-            for seed in sorted(self.force_seed[ty]):
-                m.update(seed)
-            current_digest = m.digest().encode('base64').strip()
-            return current_digest
+            return seed_digest(self.force_seed[ty])
 
     def __load_fragments(self):
         fids = self.kv.smembers(self.__fragments_key)
         orph_fids = self.kv.smembers('{}:orph'.format(self.__fragments_key))
+        # Fragments whose kv entries could not be loaded may still be restored from their snapshots
+        unloaded = set([])
 
         for fragment_id in fids:
             fragment = Fragment.load(self.kv, self.triples, self.__fragments_key, fragment_id,
-                                     prefixes=self.planner.fountain.prefixes)
+                                     prefixes=self.planner.fountain.prefixes,
+                                     snapshot=self.__snapshot_file(fragment_id))
 
             if fragment_id in orph_fids:
                 self.kv.srem(self.__fragments_key, fragment_id)
                 self.kv.srem('{}:orph'.format(self.__fragments_key), fragment_id)
                 if fragment is not None:
-                    fragment.remove()
+                    self.__remove_fragment(fragment)
                 continue
 
             if fragment is not None:
                 with fragment.lock:
+                    # Collections of a previous run are not resumed
+                    fragment.collecting = False
                     # All those fragments that were not fully collected are marked here to be orphaned
                     if not fragment.updated and not fragment.collecting:
-                        self.kv.set('{}:stored'.format(fragment.key), False)
+                        fragment.stored = False
                     else:
                         yield (fragment_id, fragment)
             else:
                 self.kv.srem(self.__fragments_key, fragment_id)
                 self.kv.srem('{}:orph'.format(self.__fragments_key), fragment_id)
+                unloaded.add(fragment_id)
+
+        # Fragments that are not in kv (e.g. it was lost or this is a new host) are taken from their snapshots
+        if self.__snapshot_dir is not None:
+            for snapshot_file in os.listdir(self.__snapshot_dir):
+                fragment_id = snapshot_file.split('.')[0]
+                if not snapshot_file.endswith('.snap.gz') or (fragment_id in fids and fragment_id not in unloaded):
+                    continue
+                path = os.path.join(self.__snapshot_dir, snapshot_file)
+                try:
+                    fragment = Fragment.restore(self.kv, self.triples, self.__fragments_key, path,
+                                                prefixes=self.planner.fountain.prefixes)
+                except (IOError, ValueError, KeyError) as e:
+                    log.warn('Could not restore {}: {}'.format(path, e))
+                    fragment = None
+                if fragment is not None:
+                    yield (fragment_id, fragment)
+                else:
+                    os.remove(path)
+
+    def sync(self):
+        # type: () -> set
+        """
+        Updates a distributed index with the fragments registered, orphaned and removed by other processes
+        :return: Ids of the fragments that were not known yet
+        """
+        with self.kv.pipeline(transaction=False) as pipe:
+            pipe.smembers(self.__fragments_key)
+            pipe.smembers('{}:orph'.format(self.__fragments_key))
+            fids, orph_fids = pipe.execute()
+
+        new_fids = set([])
+        for fid in fids.difference(self.__fragments):
+            fragment = Fragment.load(self.kv, self.triples, self.__fragments_key, fid,
+                                     prefixes=self.planner.fountain.prefixes, shared=True)
+            if fragment is not None:
+                self.__fragments[fid] = fragment
+                self.__index_fragment(fragment)
+                new_fids.add(fid)
+
+        for fid in orph_fids.intersection(self.__fragments):
+            if fid not in self.__orphaned:
+                self.add_orphaned(fid)
+
+        for fid in set(self.__fragments).difference(fids):
+            fragment = self.__fragments.pop(fid)
+            self.__orphaned.pop(fid, None)
+            self.__unindex_fragment(fragment)
+        return new_fids
+
+    def __index_fragment(self, fragment):
+        # type: (Fragment) -> None
+        signature = fragment.agp.signature
+        if signature not in self.__signatures:
+            self.__signatures[signature] = set()
+        self.__signatures[signature].add(fragment.fid)
+
+    def __unindex_fragment(self, fragment):
+        # type: (Fragment) -> None
+        signature = fragment.agp.signature
+        fids = self.__signatures.get(signature, set())
+        fids.discard(fragment.fid)
+        if not fids and signature in self.__signatures:
+            del self.__signatures[signature]
+
+    def __candidates(self, agp):
+        # type: (AGP) -> list
+        """
+        :return: Active fragment ids whose agp may be isomorphic to the given one
+        """
+        return [fid for fid in self.__signatures.get(agp.signature, ()) if
+                fid not in self.__orphaned and fid in self.__fragments]
 
     def get(self, agp, general=False, filters=None):
         # type: (AGP, bool) -> dict
+        filters = filters or {}
         mapping = None
         fragment = None
         filter_mapping = {}
         with self.lock:
-            active_fragments = filter(lambda x: x not in self.__orphaned, self.__fragments.keys())
-            for fragment_id in sorted(active_fragments, key=lambda x: abs(
+            candidates = self.__candidates(agp)
+            for fragment_id in sorted(candidates, key=lambda x: abs(
                     len(self.__fragments[x].filters) - len(filters)), reverse=False):
                 fragment = self.__fragments[fragment_id]
                 mapping = fragment.mapping(agp, filters)
                 if mapping:
                     break
 
-            if general and mapping is None:
+            if general and not mapping:
                 general, filter_mapping = _generalize_agp(agp, prefixes=self.__planner.fountain.prefixes)
-                for fragment_id in active_fragments:
-                    mapping = self.__fragments[fragment_id].mapping(general, {})
+                for fragment_id in self.__candidates(general):
+                    fragment = self.__fragments[fragment_id]
+                    mapping = fragment.mapping(general, {})
                     if mapping:
                         break
 
-            if mapping is not None:
+            if mapping:
                 return {'fragment': fragment, 'vars': mapping, 'filters': filter_mapping}
 
+            if not self.__containment or not self.__containing(agp):
+                return None
+
+        # Planning and seed digests are read outside the lock; only the comparison happens under it
+        seed_digests = self.__plan_seed_digests(agp)
+        if seed_digests:
+            with self.lock:
+                return self.__contained(agp, seed_digests)
+
+    def __containing(self, agp):
+        # type: (AGP) -> list
+        """
+        :return: Up-to-date and unfiltered fragments whose graph pattern contains the given one, smallest first
+        """
+        predicates = set([tp.p for tp in agp])
+        active = [f for fid, f in self.__fragments.items() if fid not in self.__orphaned and
+                  not f.filters and len(f.agp) > len(agp) and predicates.issubset(set([tp.p for tp in f.agp]))]
+        containing = []
+        for fragment in sorted(active, key=lambda f: len(f.agp)):
+            containment = fragment.agp.containment(agp)
+            if containment is not None and fragment.updated:
+                containing.append((fragment, containment))
+        return containing
+
+    def __contained(self, agp, seed_digests):
+        # type: (AGP, dict) -> dict
+        """
+        Looks for the smallest containing fragment. Its bindings are those that also satisfy the rest of the
+        fragment pattern. It has to have been collected from (at least) the same seeds, given by their digests,
+        that the given pattern would be planned from
+        """
+        for fragment, (mapping, tps) in self.__containing(agp):
+            if self.__seeded_from(fragment, seed_digests):
+                return {'fragment': fragment, 'vars': mapping, 'filters': {}, 'tps': tps}
+
+    def __plan_seed_digests(self, agp):
+        # type: (AGP) -> dict
+        """
+        :return: Current seed digests of the types whose seeds the given graph pattern would be collected from
+        """
+        force_seed = [(URIRef('http://{}'.format(uuid())), ty) for ty in self.force_seed or {}]
+        plan = self.__planner.make_plan(agp, force_seed=force_seed)
+        namespace_manager = agp.graph.namespace_manager
+        return {t: self.seed_type_digest(t.n3(namespace_manager)) for t in extract_seed_types_from_plan(plan)}
+
+    @staticmethod
+    def __seeded_from(fragment, seed_digests):
+        # type: (Fragment, dict) -> bool
+        # Seeds may have changed since the fragment was collected
+        return all(fragment.seed_digests.get(t) == digest for t, digest in seed_digests.items())
+
     @property
     def fragments(self):
         return self.__fragments
 
-    def register(self, agp, filters=None, follow_cycles=True):
-        # type: (AGP, dict) -> Fragment
+    def register(self, agp, filters=None, follow_cycles=True, priority=0):
+        # type: (AGP, dict, bool, int) -> Fragment
         with self.lock:
             fragment_id = str(uuid())
             fragment = Fragment(agp, self.kv, self.triples, self.__fragments_key, fragment_id, filters=filters,
                                 follow_cycles=follow_cycles)
+            fragment.priority = priority
+            fragment.shared = self.__distributed
             with self.kv.pipeline() as pipe:
                 pipe.sadd(self.__fragments_key, fragment_id)
                 fragment.save(pipe)
                 pipe.execute()
             self.__fragments[fragment_id] = fragment
+            self.__index_fragment(fragment)
 
             return fragment
 
@@ -653,6 +1671,7 @@ class FragmentIndex(object):
 
     def add_orphaned(self, fid):
         self.__orphaned[fid] = datetime.utcnow() + timedelta(seconds=1000)
+        FragmentIndex._set_timer(self.id, fid, 1000)
 
     @property
     def orphaned(self):
@@ -667,79 +1686,358 @@ class FragmentIndex(object):
         else:
             now = datetime.utcnow()
             if now > self.__orphaned[fid]:
-                log.info('Removing fragment: {}'.format(fragment.fid))
-                self.kv.srem(self.__fragments_key, fid)
-                self.kv.srem('{}:orph'.format(self.__fragments_key), fid)
-                fragment.remove()
-                del self.__fragments[fid]
+                self.__discard(fid)
+
+    def __discard(self, fid):
+        fragment = self.__fragments[fid]
+        log.info('Removing fragment: {}'.format(fragment.fid))
+        self.kv.srem(self.__fragments_key, fid)
+        self.kv.srem('{}:orph'.format(self.__fragments_key), fid)
+        self.__remove_fragment(fragment)
+        del self.__fragments[fid]
+        self.__orphaned.pop(fid, None)
+        self.__unindex_fragment(fragment)
+
+    def shrink(self):
+        # type: () -> int
+        """
+        Removes fragments until the stored triples fit in the budget: first orphaned ones, then the least used
+        (aged hit count) and least recently used ones. Fragments that are being collected, read or demanded, the
+        ones that were never stored and the empty ones (nothing to free) are kept
+        :return: Number of removed fragments
+        """
+        if self.__max_triples is None:
+            return 0
+
+        total = sum([f.size for f in self.__fragments.values()])
+        if total <= self.__max_triples:
+            return 0
+
+        removed = 0
+        candidates = filter(lambda f: f.size and not (f.readers or f.collecting or f.newcomer or f.demanded),
+                            self.__fragments.values())
+        for fragment in sorted(candidates,
+                               key=lambda f: (f.fid not in self.__orphaned, f.usage, f.last_hit)):
+            if total <= self.__max_triples:
+                break
+            if fragment.fid not in self.__orphaned:
+                log.info('Evicting fragment: {} ({} triples)'.format(fragment.fid, fragment.size))
+            total -= fragment.size
+            self.__discard(fragment.fid)
+            removed += 1
+        return removed
+
+    @staticmethod
+    def _set_timer(index_key, fid, seconds):
+        # type: (str, str, float) -> None
+        """
+        Wakes up the daemon to check a fragment again after some seconds
+        """
+        with FragmentIndex.timers_lock:
+            # A bit later, so that the expiration is already visible when checked
+            due = time() + max(seconds, 0) + 0.05
+            current = FragmentIndex.timer_dues.get((index_key, fid))
+            if current is None or due < current:
+                FragmentIndex.timer_dues[(index_key, fid)] = due
+                heapq.heappush(FragmentIndex.timers, (due, index_key, fid))
+        FragmentIndex.daemon_event.set()
+
+    @staticmethod
+    def _next_timeout(next_sweep):
+        # type: (float) -> float
+        with FragmentIndex.timers_lock:
+            now = time()
+            timers = FragmentIndex.timers
+            while timers and timers[0][0] <= now:
+                due, index_key, fid = heapq.heappop(timers)
+                if FragmentIndex.timer_dues.get((index_key, fid)) == due:
+                    del FragmentIndex.timer_dues[(index_key, fid)]
+                    FragmentIndex.due_checks.add((index_key, fid))
+            if FragmentIndex.due_checks:
+                return 0
+            timeout = min(FragmentIndex.check_interval, next_sweep - now)
+            if timers:
+                timeout = min(timeout, timers[0][0] - now)
+            return max(timeout, 0)
+
+    @staticmethod
+    def _take_due_checks():
+        # type: () -> dict
+        """
+        :return: The ids of the fragments to be checked, by index key
+        """
+        with FragmentIndex.timers_lock:
+            due_checks = FragmentIndex.due_checks
+            FragmentIndex.due_checks = set([])
+        checks = {}
+        for index_key, fid in due_checks:
+            checks.setdefault(index_key, set([])).add(fid)
+        return checks
+
+    @staticmethod
+    def _collect(index, fragment):
+        # type: (FragmentIndex, Fragment) -> Future
+        collector = Collector()
+        collector.planner = index.planner
+        collector.cache = index.cache
+        collector.loader = index.loader
+        collector.force_seed = index.force_seed
+        log.info('Starting fragment collection: {}'.format(fragment.fid))
+        # Early refreshes must not take resources from the cache that are about to expire
+        min_ttl = 2 * FragmentIndex.refresh_ahead if fragment.updated else 0
+        future = FragmentIndex.tpool.submit(fragment.populate, collector, min_ttl)
+        # Completions just wake up the daemon, which is the only one that handles them
+        future.add_done_callback(lambda _: FragmentIndex.daemon_event.set())
+        return future
+
+    @staticmethod
+    def _priority(fragment):
+        # type: (Fragment) -> tuple
+        """
+        Collections with the same requested priority go in tiers: first those that have consumers waiting
+        (the more the sooner), then newcomers and hot fragments (the most used first), and then cold ones
+        :return: A priority, lower goes first
+        """
+        waiting = fragment.readers
+        if waiting:
+            return fragment.priority, 0, -waiting
+        usage = fragment.usage
+        if fragment.newcomer or usage >= FragmentIndex.hot_usage:
+            return fragment.priority, 1, -usage
+        return fragment.priority, 2, -usage
+
+    @staticmethod
+    def _refreshes_ahead(fragment):
+        # type: (Fragment) -> bool
+        """
+        Hot fragments are refreshed before they expire, unless they do not last much longer than that (they would
+        be refreshed all the time)
+        """
+        ttl = fragment.ttl
+        return (ttl is not None and ttl > 2 * FragmentIndex.refresh_ahead and
+                fragment.usage >= FragmentIndex.hot_usage)
+
+    @staticmethod
+    def _due(fragment):
+        # type: (Fragment) -> bool
+        """
+        :return: Whether a fragment has to be collected (again)
+        """
+        if not fragment.updated:
+            return True
+        expires_in = fragment.expires_in
+        return (expires_in is not None and expires_in <= FragmentIndex.refresh_ahead and
+                FragmentIndex._refreshes_ahead(fragment))
+
+    @staticmethod
+    def _is_collecting(index, fragment):
+        # type: (FragmentIndex, Fragment) -> bool
+        # In distributed indexes, the collecting flag of a dead worker is not trusted once its lease expires
+        return fragment.collecting and (not index.distributed or index.jobs.leased(fragment.fid))
+
+    @staticmethod
+    def _check(index_key, index, fragment, running):
+        # type: (str, FragmentIndex, Fragment, dict) -> None
+        with fragment.lock:
+            if fragment.aborted:
+                index.remove(fragment.fid)
+            elif not fragment.updated and not FragmentIndex._is_collecting(index, fragment):
+                if fragment.fid in index.orphaned or not (fragment.newcomer or fragment.demanded):
+                    index.remove(fragment.fid)
+                elif (index_key, fragment.fid) not in running:
+                    FragmentIndex._enqueue(index_key, index, fragment)
+            elif fragment.updated:
+                expires_in = fragment.expires_in
+                wake_in = expires_in
+                if FragmentIndex._due(fragment):
+                    if (fragment.fid not in index.orphaned and (index_key, fragment.fid) not in running and
+                            not FragmentIndex._is_collecting(index, fragment)):
+                        FragmentIndex._enqueue(index_key, index, fragment)
+                elif expires_in is not None and FragmentIndex._refreshes_ahead(fragment):
+                    wake_in = expires_in - FragmentIndex.refresh_ahead
+                # Timers can only be brought forward
+                current_due = FragmentIndex.timer_dues.get((index_key, fragment.fid))
+                if wake_in is not None and (current_due is None or time() + wake_in < current_due - 0.05):
+                    FragmentIndex._set_timer(index_key, fragment.fid, wake_in)
+                if not index.force_seed:
+                    for t, digest in fragment.seed_digests.items():
+                        t_n3 = t.n3(fragment.agp.graph.namespace_manager)
+                        current_digest = index.seed_type_digest(t_n3)
+                        if digest != current_digest:
+                            index.remove(fragment.fid)
+                            break
+
+    @staticmethod
+    def _enqueue(index_key, index, fragment):
+        # type: (str, FragmentIndex, Fragment) -> None
+        priority = FragmentIndex._priority(fragment)
+        if index.distributed:
+            # Shared queues only keep the priority tiers, arrival order comes next
+            index.jobs.put(fragment.fid, priority[0] * 3 + priority[1])
+        else:
+            FragmentIndex.pending.put(index_key, fragment.fid, priority)
+
+    @staticmethod
+    def _complete(running):
+        # type: (dict) -> None
+        for (index_key, fid), future in running.items():
+            if not future.done():
+                continue
+            del running[(index_key, fid)]
+            index = FragmentIndex.instances.get(index_key, None)
+            if index is None:
+                continue
+            if index.distributed:
+                index.jobs.release(fid, _origin)
+            with FragmentIndex.timers_lock:
+                FragmentIndex.due_checks.add((index_key, fid))
+            exception = future.exception()
+            with index.lock:
+                fragment = index.fragments.get(fid, None)
+                if fragment is None:
+                    continue
+                try:
+                    if exception is not None:
+                        log.warn(exception.message)
+                        index.remove(fid)
+                    elif fragment.expires_in is not None:
+                        # Its wake-up timer is set when checked
+                        index.snapshot(fid)
+                except Exception:
+                    traceback.print_exc()
+
+    @staticmethod
+    def _dispatch(running):
+        # type: (dict) -> None
+        while len(running) < FragmentIndex.max_collections:
+            item = FragmentIndex.pending.get()
+            if item is None:
+                break
+            index_key, fid = item
+            index = FragmentIndex.instances.get(index_key, None)
+            if index is None:
+                continue
+            with index.lock:
+                fragment = index.fragments.get(fid, None)
+                if fragment is None or fid in index.orphaned:
+                    continue
+                try:
+                    with fragment.lock:
+                        if FragmentIndex._due(fragment) and not fragment.collecting:
+                            running[(index_key, fid)] = FragmentIndex._collect(index, fragment)
+                except RuntimeError as e:
+                    traceback.print_exc()
+                    log.warn(e.message)
+
+        # Jobs of distributed indexes are claimed in turns, one per index
+        claiming = [k for k, i in FragmentIndex.instances.items() if i.distributed]
+        while claiming and len(running) < FragmentIndex.max_collections:
+            for index_key in claiming[:]:
+                if len(running) >= FragmentIndex.max_collections:
+                    break
+                index = FragmentIndex.instances.get(index_key, None)
+                fid = index.jobs.claim(_origin) if index is not None else None
+                if fid is None:
+                    claiming.remove(index_key)
+                    continue
+                with index.lock:
+                    fragment = index.fragments.get(fid, None)
+                    if fragment is None:
+                        # Not known yet here, it may be claimed again after the next sync
+                        index.sync()
+                        fragment = index.fragments.get(fid, None)
+                    try:
+                        if fragment is None or fid in index.orphaned or not FragmentIndex._due(fragment):
+                            index.jobs.release(fid, _origin)
+                            continue
+                        with fragment.lock:
+                            running[(index_key, fid)] = FragmentIndex._collect(index, fragment)
+                    except RuntimeError as e:
+                        index.jobs.release(fid, _origin)
+                        traceback.print_exc()
+                        log.warn(e.message)
+
+    @staticmethod
+    def _heartbeat(running):
+        # type: (dict) -> None
+        """
+        Renews the leases of the distributed collections that are running here
+        """
+        for index_key, fid in running.keys():
+            index = FragmentIndex.instances.get(index_key, None)
+            if index is not None and index.distributed:
+                index.jobs.renew(fid, _origin)
 
     @staticmethod
     def _daemon():
-        futures = {}
+        # (index key, fragment id) -> running collection
+        running = {}
+        # Indexes whose fragments were all checked at least once, by index key
+        swept = {}
+        next_sweep = time()
         while not stopped.isSet():
             FragmentIndex.daemon_event.clear()
+            FragmentIndex._complete(running)
+            FragmentIndex._heartbeat(running)
+            # Only the fragments that are due (timers, requests, completions) are checked, but for periodic sweeps
+            sweep = time() >= next_sweep
+            if sweep:
+                next_sweep = time() + FragmentIndex.sweep_interval
+            due_checks = FragmentIndex._take_due_checks()
             for index_key in FragmentIndex.instances.keys()[:]:
-                index = FragmentIndex.instances[index_key]
+                index = FragmentIndex.instances.get(index_key, None)
+                if index is None:
+                    continue
                 try:
                     with index.lock:
-                        for fid in index.fragments.keys()[:]:
+                        fids = due_checks.get(index_key, set([]))
+                        if index.distributed:
+                            fids.update(index.sync())
+                        if sweep or swept.get(index_key) is not index:
+                            # New indexes come with the fragments they loaded
+                            swept[index_key] = index
+                            fids = index.fragments.keys()
+                        for fid in fids:
+                            if fid not in index.fragments:
+                                continue
                             try:
-                                fragment = index.fragments[fid]
-                                with fragment.lock:
-                                    if fragment.aborted:
-                                        index.remove(fragment.fid)
-                                    elif not fragment.updated and not fragment.collecting:
-                                        if not fragment.newcomer:
-                                            index.remove(fragment.fid)
-                                        else:
-                                            collector = Collector()
-                                            collector.planner = index.planner
-                                            collector.cache = index.cache
-                                            collector.loader = index.loader
-                                            collector.force_seed = index.force_seed
-                                            log.info('Starting fragment collection: {}'.format(fragment.fid))
-                                            try:
-                                                futures[fragment.fid] = FragmentIndex.tpool.submit(fragment.populate,
-                                                                                                   collector)
-                                            except RuntimeError as e:
-                                                traceback.print_exc()
-                                                log.warn(e.message)
-                                    elif fragment.updated and not index.force_seed:
-                                        for t, digest in fragment.seed_digests.items():
-                                            t_n3 = t.n3(fragment.agp.graph.namespace_manager)
-                                            current_digest = index.seed_type_digest(t_n3)
-                                            if digest != current_digest:
-                                                index.remove(fragment.fid)
-                                                break
+                                FragmentIndex._check(index_key, index, index.fragments[fid], running)
                             except Exception as e:
                                 if index_key in FragmentIndex.instances:
                                     del FragmentIndex.instances[index_key]
                                     # traceback.print_exc()
-
-                    if futures:
-                        log.info('Waiting for: {} collections'.format(len(futures)))
-                        wait(futures.values())
-                        for fragment_id, future in futures.items():
-                            exception = future.exception()
-                            if exception is not None:
-                                log.warn(exception.message)
-                                with index.lock:
-                                    try:
-                                        index.remove(fragment_id)
-                                    except Exception, e:
-                                        # traceback.print_exc()
-                                        break
-
-                        futures.clear()
+                        if fids:
+                            index.shrink()
                 except AttributeError:
                     pass
 
+            FragmentIndex._dispatch(running)
+            if running:
+                log.debug('Running {} collections, {} pending'.format(len(running), len(FragmentIndex.pending)))
+
             try:
-                FragmentIndex.daemon_event.wait(timeout=1)
+                FragmentIndex.daemon_event.wait(timeout=FragmentIndex._next_timeout(next_sweep))
             except Exception:
                 pass
 
 
+def _encode_cursor(version, offset):
+    # type: (int, int) -> str
+    return base64.urlsafe_b64encode('{}:{}'.format(version, offset))
+
+
+def _decode_cursor(cursor):
+    # type: (str) -> tuple
+    try:
+        version, offset = base64.urlsafe_b64decode(str(cursor)).split(':')
+        version, offset = int(version), int(offset)
+        if offset < 0:
+            raise ValueError
+        return version, offset
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor: {}'.format(cursor))
+
+
 def _map_tp(tp, vars):
     s, p, o = tp
     return TP(vars.get(s, s), vars.get(p, p), vars.get(o, o))
@@ -810,6 +2108,24 @@ class Scholar(Collector):
 
         return result
 
+    @staticmethod
+    def __project_plan(plan, tps):
+        # type: (Graph, set) -> None
+        """
+        Removes from a search plan all triple patterns (and the steps that only lead to them) not in tps
+        """
+        for tp_label, tp in extract_tps_from_plan(plan).items():
+            if tp in tps:
+                continue
+            tp_node = list(plan.subjects(RDFS.label, Literal(tp_label))).pop()
+            for step in list(plan.subjects(AGORA.byPattern, tp_node)):
+                plan.remove((step, AGORA.byPattern, tp_node))
+                if (step, AGORA.byPattern, None) not in plan and (step, AGORA.onProperty, None) not in plan:
+                    plan.remove((step, None, None))
+                    plan.remove((None, None, step))
+            plan.remove((tp_node, None, None))
+            plan.remove((None, None, tp_node))
+
     def mapped_plan(self, mapping):
         source_plan = mapping['fragment'].plan
         if source_plan:
@@ -817,6 +2133,8 @@ class Scholar(Collector):
             for prefix, uri in source_plan.namespaces():
                 mapped_plan.bind(prefix, uri)
             mapped_plan.__iadd__(source_plan)
+            if 'tps' in mapping:
+                self.__project_plan(mapped_plan, mapping['tps'])
             v_nodes = list(mapped_plan.subjects(RDF.type, AGORA.Variable))
             for v_node in v_nodes:
                 v_source_label = list(mapped_plan.objects(v_node, RDFS.label)).pop()
@@ -835,35 +2153,68 @@ class Scholar(Collector):
 
             return mapped_plan
 
-    def __follow_filter(self, candidates, tp, s, o, trace=None, prev=None):
-        def seek_join(tps, f):
-            for t in tps:
-                for (ss, oo) in filter(lambda x: f(x), candidates[t]):
-                    if (ss, t.p, oo) not in trace:
-                        yield (t, ss, t.p, oo)
-                        trace.add((ss, t.p, oo))
-                        for q in self.__follow_filter(candidates, t, ss, oo, trace, prev=tp):
-                            yield q
-
-        if trace is None:
-            trace = set([])
-        trace.add((s, tp.p, o))
-        valid_tps = filter(lambda x: x != prev, candidates.keys())
-        up_tps = filter(lambda x: x != prev and x.o == tp.s, valid_tps)
-        for q in seek_join(up_tps, lambda (ss, oo): oo == s):
-            yield q
-        down_tps = filter(lambda x: x.s == tp.o, valid_tps)
-        for q in seek_join(down_tps, lambda (ss, oo): ss == o):
-            yield q
-        sib_tps = filter(lambda x: x.s == tp.s and x.o != tp.o, valid_tps)
-        for q in seek_join(sib_tps, lambda (ss, oo): ss == s):
-            yield q
-
-    def mapped_gen(self, mapping, filters):
-        generator = mapping['fragment'].generator
+    @staticmethod
+    def __reach(candidates, root):
+        # type: (dict, TP) -> dict
+        """
+        Propagates the candidate pairs of a root triple pattern to the rest through their shared variables, as
+        iterative semi-joins over subject and object hash indexes. Pairs are never joined back with the pattern
+        they were reached from
+        :return: Reached pairs by triple pattern
+        """
+        by_s = {}
+        by_o = {}
+        for tp, pairs in candidates.items():
+            by_s[tp] = {}
+            by_o[tp] = {}
+            for pair in pairs:
+                s, o = pair
+                if s not in by_s[tp]:
+                    by_s[tp][s] = []
+                by_s[tp][s].append(pair)
+                if o not in by_o[tp]:
+                    by_o[tp][o] = []
+                by_o[tp][o].append(pair)
+
+        # Joins of each pattern: (joined pattern, whether it is keyed by our subject, index to look up)
+        joins = {}
+        for tp in candidates:
+            joins[tp] = []
+            for t in candidates:
+                if t.o == tp.s:
+                    joins[tp].append((t, True, by_o))
+                if t.s == tp.o:
+                    joins[tp].append((t, False, by_s))
+                if t.s == tp.s and t.o != tp.o:
+                    joins[tp].append((t, True, by_s))
+
+        reached = {}
+        pending = [(root, pair, None) for pair in candidates.get(root, [])]
+        if pending:
+            reached[root] = set(candidates[root])
+        visited = set(pending)
+        while pending:
+            tp, (s, o), prev = pending.pop()
+            for t, by_subject, index in joins[tp]:
+                if t == prev:
+                    continue
+                for pair in index[t].get(s if by_subject else o, []):
+                    state = (t, pair, tp)
+                    if state not in visited:
+                        visited.add(state)
+                        if t not in reached:
+                            reached[t] = set()
+                        reached[t].add(pair)
+                        pending.append(state)
+        return reached
+
+    def mapped_gen(self, mapping, filters, quads=None):
+        generator = mapping['fragment'].generator if quads is None else iter(quads)
         m_vars = mapping.get('vars', {})
         m_filters = mapping.get('filters', {})
-        agp = mapping['fragment'].agp
+        # Contained mappings only project some of the fragment triple patterns
+        tps = mapping.get('tps', None)
+        agp = mapping['fragment'].agp if tps is None else tps
         if filters == mapping['fragment'].filters:
             filters = {}
 
@@ -903,6 +2254,8 @@ class Scholar(Collector):
                             pass
 
         for c, s, p, o in generator:
+            if tps is not None and c not in tps:
+                continue
             tp = _map_tp(c, m_vars)
 
             if not in_filter_path.get(tp.s, False):
@@ -922,24 +2275,14 @@ class Scholar(Collector):
                     candidates[tp].add((s, o))
 
         tp_filter_roots = filter(lambda x: x.s in ft.variables or x.o in ft.variables, candidates.keys())
-        tp_filter_roots = sorted(tp_filter_roots, key=lambda x: len(ft.graph.successors(x.o)), reverse=True)
+        tp_filter_roots = sorted(tp_filter_roots, key=lambda x: ft.graph.out_degree(x.o), reverse=True)
         for tp in tp_filter_roots:
-            pairs = {}
-            for (s, o) in candidates.get(tp, set([])).copy():
-                if tp not in pairs:
-                    pairs[tp] = set([])
-                pairs[tp].add((s, o))
-                for ftp, fs, fp, fo in self.__follow_filter(candidates, tp, s, o):
-                    if ftp not in pairs:
-                        pairs[ftp] = set([])
-                    pairs[ftp].add((fs, fo))
-                    candidates[ftp].remove((fs, fo))
-
+            pairs = self.__reach(candidates, tp)
             if len(candidates) != len(pairs):
                 candidates = {}
                 break
             else:
-                candidates = pairs.copy()
+                candidates = pairs
 
         for tp, pairs in candidates.items():
             for s, o in pairs:
@@ -950,12 +2293,23 @@ class Scholar(Collector):
         mapping = self.index.get(agp, general=True, filters=filters)
         if not mapping:
             # Register fragment
-            fragment = self.index.register(agp, filters=filters, follow_cycles=kwargs.get('follow_cycles', True))
+            fragment = self.index.register(agp, filters=filters, follow_cycles=kwargs.get('follow_cycles', True),
+                                           priority=kwargs.get('priority', 0))
             mapping = {'fragment': fragment}
 
-        self.index.notify()
+        self.index.notify(mapping['fragment'].fid)
         plan = self.mapped_plan(mapping)
         if plan:
+            if 'limit' in kwargs or kwargs.get('cursor', None) is not None:
+                # Filters that are not the fragment ones need all its contents to be evaluated
+                if filters and filters != mapping['fragment'].filters:
+                    raise ValueError('Fragments with additional filters cannot be paged')
+                limit = kwargs.get('limit', None)
+                quads, cursor = mapping['fragment'].page(cursor=kwargs.get('cursor', None),
+                                                         limit=1000 if limit is None else limit)
+                return {'plan': plan, 'generator': self.mapped_gen(mapping, filters, quads=quads),
+                        'prefixes': self.index.planner.fountain.prefixes.items(), 'cursor': cursor}
+
             return {'plan': plan, 'generator': self.mapped_gen(mapping, filters),
                     'prefixes': self.index.planner.fountain.prefixes.items()}
         else:
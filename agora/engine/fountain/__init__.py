@@ -18,7 +18,6 @@
   limitations under the License.
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
 """
-import hashlib
 import logging
 from abc import abstractmethod
 from multiprocessing import Lock
@@ -96,6 +95,11 @@ class AbstractFountain(object):
         # type: (str, str) -> str
         raise NotImplementedError
 
+    @abstractmethod
+    def add_seeds(self, seeds):
+        # type: (iter) -> dict
+        raise NotImplementedError
+
     @property
     @abstractmethod
     def prefixes(self):
@@ -197,13 +201,14 @@ class Fountain(AbstractFountain):
     def add_vocabulary(self, owl):
         # type: (str) -> iter
         with self.__lock:
+            snapshot = self.__index.snapshot
             added_vocs_iter = manager.add_vocabulary(self.__schema, owl)
             if self.__schema.cache is not None:
                 self.__schema.cache.stable = 0
             for vid in reversed(added_vocs_iter):
                 self.__index.index_vocabulary(vid)
             self.__pm.calculate()
-            self.__sm.validate()
+            self.__sm.validate(snapshot)
             if self.__schema.cache is not None:
                 self.__schema.cache.stable = 1
             return added_vocs_iter
@@ -211,30 +216,37 @@ class Fountain(AbstractFountain):
     def update_vocabulary(self, vid, owl):
         # type: (str, str) -> None
         with self.__lock:
+            snapshot = self.__index.snapshot
+            old_triples = self.__vocabulary_triples(vid)
             manager.update_vocabulary(self.__schema, vid, owl)
             if self.__schema.cache is not None:
                 self.__schema.cache.stable = 0
-            for v in manager.get_vocabularies(self.__schema):
-                self.__index.index_vocabulary(v)
+            self.__index.update_vocabulary(vid, old_triples)
             self.__pm.calculate()
-            self.__sm.validate()
+            self.__sm.validate(snapshot)
             if self.__schema.cache is not None:
                 self.__schema.cache.stable = 1
 
     def delete_vocabulary(self, vid):
         # type: (str) -> None
         with self.__lock:
+            snapshot = self.__index.snapshot
+            old_triples = self.__vocabulary_triples(vid)
             manager.delete_vocabulary(self.__schema, vid)
             if self.__schema.cache is not None:
                 self.__schema.cache.stable = 0
-            self.__index.delete_vocabulary(vid)
-            for v in manager.get_vocabularies(self.__schema):
-                self.__index.index_vocabulary(v)
+            self.__index.update_vocabulary(vid, old_triples)
             self.__pm.calculate()
-            self.__sm.validate()
+            self.__sm.validate(snapshot)
             if self.__schema.cache is not None:
                 self.__schema.cache.stable = 1
 
+    def __vocabulary_triples(self, vid):
+        # type: (str) -> set
+        if vid not in self.__schema.contexts:
+            return set([])
+        return set(self.__schema.get_context(vid).triples((None, None, None)))
+
     def get_vocabulary(self, vid):
         # type: (str) -> str
         with self.__lock:
@@ -272,16 +284,24 @@ class Fountain(AbstractFountain):
         # type: (str, str) -> str
         return self.__sm.add_seed(uri, type)
 
+    def add_seeds(self, seeds):
+        # type: (iter) -> dict
+        return self.__sm.add_seeds(seeds)
+
     @property
     def prefixes(self):
         return self.__index.schema.prefixes
 
     def add_prefixes(self, prefixes):
-        current_ns = dict(self.__schema.graph.namespaces()).values()
+        current_prefixes = self.__schema.prefixes
+        current_ns = current_prefixes.values()
         for prefix, ns in prefixes.items():
             if not (prefix.startswith('ns') and ns in current_ns):
                 self.__schema.graph.namespace_manager.bind(prefix, URIRef(ns), replace=True, override=True)
         self.__schema.update_ns_dicts()
+        if self.__schema.prefixes == current_prefixes:
+            # Indexed names would not change
+            return
         if self.__schema.cache is not None:
             self.__schema.cache.stable = 0
         for vid in self.vocabularies:
@@ -311,7 +331,4 @@ class Fountain(AbstractFountain):
         return self.__sm.delete_type_seeds(type)
 
     def get_seed_type_digest(self, type):
-        m = hashlib.md5()
-        for seed in sorted(self.__sm.get_type_seeds(type)):
-            m.update(seed)
-        return m.digest().encode('base64').strip()
+        return self.__sm.get_type_seed_digest(type)
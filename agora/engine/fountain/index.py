@@ -19,54 +19,248 @@
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
 """
 import calendar
+import json
 import logging
 import traceback
 from datetime import datetime as dt
+from threading import Lock
+from time import time
 
 import redis
 from concurrent.futures import wait
+from rdflib import BNode, RDF, RDFS, URIRef
+from rdflib.namespace import OWL
 
 from agora.engine.fountain.schema import Schema
-from agora.engine.utils.cache import cached
 from agora.engine.utils.kv import close_kv
 
 __author__ = 'Fernando Serena'
 
 log = logging.getLogger('agora.engine.fountain.index')
 
+# Per-vocabulary facet sets are the source of truth (vocabs:{vid}:types:{t}:{facet}, ...). Lookups are served
+# from a merged hash per type/property (types:{t}, properties:{p}) and the global membership sets below.
+VOCABS_KEY = 'vocabs'
+TYPES_KEY = 'types'
+PROPERTIES_KEY = 'properties'
+# Hash of property -> merged properties that declare it as inverse (the reverse of their inverse facet)
+INVERSE_OF_KEY = 'inverse_of'
+LAYOUT_KEY = 'layout'
+LAYOUT_VERSION = 3
+
+_type_facets = [('super', 'super'), ('sub', 'sub'), ('props', 'properties'), ('s-props', 'spec_properties'),
+                ('refs', 'refs'), ('s-refs', 'spec_refs')]
+_property_facets = [('_domain', 'domain'), ('_range', 'range'), ('_inverse', 'inverse'), ('_cons', 'constraints')]
+
+# Predicates whose triples can change any facet of the index; other triples (labels, comments...) are ignored
+_schema_predicates = {RDF.type, RDFS.subClassOf, RDFS.domain, RDFS.range, OWL.inverseOf, OWL.onProperty,
+                      OWL.allValuesFrom, OWL.someValuesFrom, OWL.onClass, OWL.onDataRange}
+
+
+def __read_vocab_items(r, vids, items, kind, facets):
+    # type: (redis.StrictRedis, list, iter, str, list) -> dict
+    """
+    Reads the facets that every vocabulary holds for the given types or properties in a single pipeline
+    :return: A dict of item -> (vocabularies that include it, facet -> set of values, type)
+    """
+    items = list(items)
+    with r.pipeline(transaction=False) as pipe:
+        for item in items:
+            for vid in vids:
+                pipe.sismember('vocabs:{}:{}'.format(vid, kind), item)
+                for facet, _ in facets:
+                    pipe.smembers('vocabs:{}:{}:{}:{}'.format(vid, kind, item, facet))
+                if kind == 'properties':
+                    pipe.get('vocabs:{}:properties:{}:_type'.format(vid, item))
+        results = iter(pipe.execute())
+
+    read = {}
+    for item in items:
+        item_vids = []
+        values = {field: set([]) for _, field in facets}
+        ty = None
+        for vid in vids:
+            if next(results):
+                item_vids.append(vid)
+            for _, field in facets:
+                values[field].update(next(results))
+            if kind == 'properties':
+                ty = next(results) or ty
+        read[item] = (item_vids, values, ty)
+    return read
+
+
+def __merge_types(r, types):
+    # type: (redis.StrictRedis, iter) -> None
+    vids = sorted(r.smembers(VOCABS_KEY))
+    read = __read_vocab_items(r, vids, types, 'types', _type_facets)
+    with r.pipeline() as pipe:
+        pipe.multi()
+        for t, (t_vids, values, _) in read.items():
+            pipe.delete('types:{}'.format(t))
+            if t_vids:
+                record = {field: json.dumps(sorted(v)) for field, v in values.items()}
+                record['vocabs'] = json.dumps(t_vids)
+                pipe.hmset('types:{}'.format(t), record)
+                pipe.sadd(TYPES_KEY, t)
+            else:
+                pipe.srem(TYPES_KEY, t)
+        pipe.execute()
 
-def __get_by_pattern(r, pattern, func):
-    # type: (redis.StrictRedis, str, callable) -> list
-
-    def get_all():
-        for k in pkeys:
-            yield func(k)
 
-    pkeys = r.keys(pattern)
-    return list(get_all())
+def __merge_properties(r, properties):
+    # type: (redis.StrictRedis, iter) -> None
+    vids = sorted(r.smembers(VOCABS_KEY))
+    read = __read_vocab_items(r, vids, properties, 'properties', _property_facets)
+    # Domain and range are extended with those of the inverse properties
+    inverses = set.union(set([]), *[values['inverse'] for _, values, _ in read.values()])
+    inverses.difference_update(read.keys())
+    read_inverses = __read_vocab_items(r, vids, inverses, 'properties', _property_facets)
+    read_inverses.update(read)
+
+    # The reverse index is moved from the inverses each property had to those it has now
+    merged = list(read)
+    with r.pipeline(transaction=False) as pipe:
+        for p in merged:
+            pipe.hget('properties:{}'.format(p), 'inverse')
+        old_inverses = [set(json.loads(inv or '[]')) for inv in pipe.execute()]
+    inverse_of = {}
+    for p, old in zip(merged, old_inverses):
+        p_vids, values, _ = read[p]
+        new = values['inverse'] if p_vids else set([])
+        for i in set.union(old, new):
+            removed, added = inverse_of.setdefault(i, (set([]), set([])))
+            (added if i in new else removed).add(p)
+    targets = list(inverse_of)
+    reverse = {}
+    for i, declared in zip(targets, r.hmget(INVERSE_OF_KEY, targets) if targets else []):
+        removed, added = inverse_of[i]
+        reverse[i] = set(json.loads(declared or '[]')).difference(removed).union(added)
 
+    with r.pipeline() as pipe:
+        pipe.multi()
+        for i, declared in reverse.items():
+            if declared:
+                pipe.hset(INVERSE_OF_KEY, i, json.dumps(sorted(declared)))
+            else:
+                pipe.hdel(INVERSE_OF_KEY, i)
+        for p, (p_vids, values, ty) in read.items():
+            pipe.delete('properties:{}'.format(p))
+            if p_vids:
+                domain = set(values['domain'])
+                rang = set(values['range'])
+                for i in values['inverse']:
+                    _, i_values, _ = read_inverses[i]
+                    domain.update(i_values['range'])
+                    rang.update(i_values['domain'])
+                pipe.hmset('properties:{}'.format(p), {
+                    'domain': json.dumps(sorted(domain)),
+                    'range': json.dumps(sorted(rang)),
+                    'inverse': json.dumps(sorted(values['inverse'])),
+                    'constraints': json.dumps(sorted(values['constraints'])),
+                    'type': ty or 'object',
+                    'vocabs': json.dumps(p_vids)
+                })
+                pipe.sadd(PROPERTIES_KEY, p)
+            else:
+                pipe.srem(PROPERTIES_KEY, p)
+        pipe.execute()
 
-def __remove_from_sets(r, values, *args):
-    # type: (redis.StrictRedis, iter, iter) -> None
 
-    for pattern in args:
-        keys = r.keys(pattern)
-        for dk in keys:
-            key_parts = dk.split(':')
-            ef_values = values
-            if len(key_parts) > 1:
-                ef_values = filter(lambda x: x.split(':')[0] != key_parts[1], values)
+def __inverse_dependents(r, properties):
+    # type: (redis.StrictRedis, set) -> set
+    """
+    :return: The indexed properties that declare any of the given ones as inverse
+    """
+    properties = list(properties)
+    if not properties:
+        return set([])
+    declared = r.hmget(INVERSE_OF_KEY, properties)
+    return set.union(set([]), *[set(json.loads(d)) for d in declared if d])
+
+
+def __merge(r, items):
+    # type: (redis.StrictRedis, set) -> None
+    items = set(items)
+    __merge_types(r, items)
+    __merge_properties(r, items.union(__inverse_dependents(r, items)))
+
+
+def __remove_from_sets(r, values, vids, kind, *facets):
+    # type: (redis.StrictRedis, iter, iter, str, iter) -> set
+    """
+    Removes values from the given facet sets of every vocabulary, except from those of the vocabulary
+    the values belong to
+    :return: The types or properties whose facets were modified
+    """
+    vids = list(vids)
+    with r.pipeline(transaction=False) as pipe:
+        for vid in vids:
+            pipe.smembers('vocabs:{}:{}'.format(vid, kind))
+        vid_items = pipe.execute()
+
+    keys = []
+    with r.pipeline(transaction=False) as pipe:
+        for vid, items in zip(vids, vid_items):
+            ef_values = filter(lambda x: x.split(':')[0] != vid, values)
             if len(ef_values):
-                r.srem(dk, *ef_values)
+                for item in items:
+                    for facet in facets:
+                        pipe.srem('vocabs:{}:{}:{}:{}'.format(vid, kind, item, facet), *ef_values)
+                        keys.append(item)
+        removed = pipe.execute()
+
+    return set([item for item, n in zip(keys, removed) if n])
 
 
-def __get_vocab_set(r, pattern, vid=None):
+def __get_vocab_set(r, kind, vid=None):
     # type: (redis.StrictRedis, str, str) -> list
 
-    if vid is not None:
-        pattern = pattern.replace(':*:', ':%s:' % vid)
-    all_sets = map(lambda x: r.smembers(x), r.keys(pattern))
-    return list(reduce(set.union, all_sets, set([])))
+    if vid is None:
+        return list(r.smembers(kind))
+
+    vid_items = list(r.smembers('vocabs:{}:{}'.format(vid, kind)))
+    with r.pipeline(transaction=False) as pipe:
+        for item in vid_items:
+            pipe.hget('{}:{}'.format(kind, item), 'vocabs')
+        item_vocabs = pipe.execute()
+
+    def not_shared(vocabs):
+        return not set(json.loads(vocabs or '[]')).difference([vid])
+
+    return [item for item, vocabs in zip(vid_items, item_vocabs) if not_shared(vocabs)]
+
+
+def __touch(r):
+    # type: (redis.StrictRedis) -> None
+    """
+    Moves the index ts forward, even if it was already moved within the current second
+    """
+    ts = r.get('ts')
+    r.set('ts', max(calendar.timegm(dt.now().timetuple()), 0 if ts is None else int(ts) + 1))
+
+
+def _migrate(r):
+    # type: (redis.StrictRedis) -> None
+    """
+    Builds the merged type and property hashes, the membership sets and the reverse inverse index of stores
+    created with a former layout (which could only be queried by scanning the keyspace)
+    """
+    layout = r.get(LAYOUT_KEY)
+    if layout is not None and int(layout) >= LAYOUT_VERSION:
+        return
+
+    vocab_keys = r.keys('vocabs:*:types') + r.keys('vocabs:*:properties')
+    vids = set([k.split(':')[1] for k in vocab_keys])
+    if vids:
+        log.info('Migrating index layout of {} vocabularies...'.format(len(vids)))
+        r.sadd(VOCABS_KEY, *vids)
+        types = reduce(set.union, [r.smembers('vocabs:{}:types'.format(vid)) for vid in vids], set([]))
+        properties = reduce(set.union, [r.smembers('vocabs:{}:properties'.format(vid)) for vid in vids], set([]))
+        __merge_types(r, types)
+        __merge_properties(r, properties)
+        __touch(r)
+    r.set(LAYOUT_KEY, LAYOUT_VERSION)
 
 
 def __extract_type(schema, r, t, vid):
@@ -185,19 +379,44 @@ def __extract_properties(schema, r, vid, trace=None):
     return properties, futures
 
 
+def __type_keys(vid, t):
+    # type: (str, str) -> list
+    return ['vocabs:{}:types:{}:{}'.format(vid, t, facet) for facet, _ in _type_facets]
+
+
+def __property_keys(vid, p):
+    # type: (str, str) -> list
+    return ['vocabs:{}:properties:{}'.format(vid, p), 'vocabs:{}:properties:{}:_type'.format(vid, p)] + [
+        'vocabs:{}:properties:{}:{}'.format(vid, p, facet) for facet, _ in _property_facets]
+
+
 def _delete_vocabulary(r, vid):
     # type: (redis.StrictRedis, str) -> None
 
+    vids = r.smembers(VOCABS_KEY)
+    all_v_types = r.smembers('vocabs:{}:types'.format(vid))
+    all_v_props = r.smembers('vocabs:{}:properties'.format(vid))
+    modified = set.union(all_v_types, all_v_props)
+
     v_types = _get_types(r, vid)
     if len(v_types):
-        __remove_from_sets(r, v_types, '*:_domain', '*:_range', '*:sub', '*:super')
+        modified.update(__remove_from_sets(r, v_types, vids, 'properties', '_domain', '_range'))
+        modified.update(__remove_from_sets(r, v_types, vids, 'types', 'sub', 'super'))
     v_props = _get_properties(r, vid)
     if len(v_props):
-        __remove_from_sets(r, v_props, '*:refs', '*:props')
+        modified.update(__remove_from_sets(r, v_props, vids, 'types', 'refs', 'props'))
+
+    v_keys = ['vocabs:{}:types'.format(vid), 'vocabs:{}:properties'.format(vid)]
+    for t in all_v_types:
+        v_keys.extend(__type_keys(vid, t))
+    for p in all_v_props:
+        v_keys.extend(__property_keys(vid, p))
+    r.delete(*v_keys)
+    r.srem(VOCABS_KEY, vid)
 
-    v_keys = r.keys('vocabs:{}:*'.format(vid))
-    if len(v_keys):
-        r.delete(*v_keys)
+    if modified:
+        __merge(r, modified)
+    __touch(r)
 
 
 def _extract_vocabulary(schema, r, vid):
@@ -206,130 +425,308 @@ def _extract_vocabulary(schema, r, vid):
     log.info('Extracting vocabulary {}...'.format(vid))
     _delete_vocabulary(r, vid)
     start_time = dt.now()
-    r.set('ts', calendar.timegm(start_time.timetuple()))
+    r.sadd(VOCABS_KEY, vid)
     extracted = set([])
     types, t_futures = __extract_types(schema, r, vid, trace=extracted)
     properties, p_futures = __extract_properties(schema, r, vid, trace=extracted)
     wait(p_futures + t_futures)
+    __merge(r, extracted)
+    # Only once everything is written, so that no snapshot of a partial index gets the final ts
+    __touch(r)
     log.info('Done (in {}ms)'.format((dt.now() - start_time).total_seconds() * 1000))
     return types, properties
 
 
-def _get_types(r, vid=None):
-    # type: (redis.StrictRedis, str) -> iter
-
-    def shared_type(t):
-        return any(filter(lambda k: r.sismember(k, t), all_type_keys))
+def __changed_elements(schema, old_triples, new_triples):
+    # type: (Schema, set, set) -> set
+    """
+    :return: The names of the resources in schema triples that were added or removed, including
+    the classes that own a changed restriction
+    """
+    old_triples = set(filter(lambda (s, p, o): p in _schema_predicates, old_triples))
+    new_triples = set(filter(lambda (s, p, o): p in _schema_predicates, new_triples))
+
+    owners = {}
+    for s, p, o in set.union(old_triples, new_triples):
+        if isinstance(o, BNode):
+            owners.setdefault(o, set()).add(s)
+
+    ns = schema.graph.namespace_manager
+    elms = set([])
+    pending = set([])
+    for triple in set.symmetric_difference(old_triples, new_triples):
+        for term in triple:
+            if isinstance(term, URIRef):
+                elms.add(term.n3(ns))
+            elif isinstance(term, BNode):
+                pending.add(term)
+
+    visited = set([])
+    while pending:
+        b_node = pending.pop()
+        visited.add(b_node)
+        for owner in owners.get(b_node, []):
+            if isinstance(owner, URIRef):
+                elms.add(owner.n3(ns))
+            elif owner not in visited:
+                pending.add(owner)
+
+    return elms
+
+
+def __neighbours(schema, snapshot, elm, types, properties):
+    # type: (Schema, IndexSnapshot, str, set, set) -> set
+    """
+    :return: The types and properties whose facets may refer to elm, both before (snapshot) and after
+    (schema) the change
+    """
+    neighbours = set([])
+    if snapshot.is_type(elm):
+        t_dict = snapshot.get_type(elm)
+        for facet in ['super', 'sub', 'properties', 'refs']:
+            neighbours.update(t_dict[facet])
+    if snapshot.is_property(elm):
+        p_dict = snapshot.get_property(elm)
+        for facet in ['domain', 'range', 'inverse']:
+            neighbours.update(p_dict[facet])
+    if elm in types:
+        neighbours.update(schema.get_supertypes(elm), schema.get_subtypes(elm),
+                          schema.get_type_properties(elm), schema.get_type_references(elm))
+    if elm in properties:
+        neighbours.update(schema.get_property_domain(elm), schema.get_property_range(elm),
+                          schema.get_property_inverses(elm))
+    return neighbours
+
+
+def _update_vocabulary(schema, r, vid, old_triples, snapshot):
+    # type: (Schema, redis.StrictRedis, str, set, IndexSnapshot) -> set
+    """
+    Re-extracts only the types and properties affected by the change of a vocabulary (or by its deletion,
+    if it is not in the schema anymore): those mentioned by any added or removed schema triple and those
+    whose facets refer to them
+    :return: The affected types and properties
+    """
+    log.info('Updating vocabulary {}...'.format(vid))
+    start_time = dt.now()
+    if vid in schema.contexts:
+        new_triples = set(schema.get_context(vid).triples((None, None, None)))
+        v_types = set(schema.get_types(context=vid))
+        v_props = set(schema.get_properties(context=vid))
+    else:
+        new_triples = set([])
+        v_types = v_props = set([])
+        _delete_vocabulary(r, vid)
+
+    types = set(schema.get_types())
+    properties = set(schema.get_properties())
+    known = set.union(types, properties, snapshot.types, snapshot.properties)
+
+    changed = set.intersection(__changed_elements(schema, old_triples, new_triples), known)
+    # Elements that joined or left the vocabulary
+    changed.update(set.symmetric_difference(v_types, r.smembers('vocabs:{}:types'.format(vid))))
+    changed.update(set.symmetric_difference(v_props, r.smembers('vocabs:{}:properties'.format(vid))))
+    affected = set(changed)
+    for elm in changed:
+        affected.update(__neighbours(schema, snapshot, elm, types, properties))
+    affected.intersection_update(known)
+
+    if vid in schema.contexts:
+        with r.pipeline() as pipe:
+            pipe.multi()
+            pipe.sadd(VOCABS_KEY, vid)
+            for kind, elms in [('types', v_types), ('properties', v_props)]:
+                pipe.delete('vocabs:{}:{}'.format(vid, kind))
+                if elms:
+                    pipe.sadd('vocabs:{}:{}'.format(vid, kind), *elms)
+            pipe.execute()
 
-    vid_types = __get_vocab_set(r, 'vocabs:*:types', vid)
+    # Every vocabulary that includes an affected element holds its own copy of its facets
+    vids = list(r.smembers(VOCABS_KEY))
+    affected = list(affected)
+    with r.pipeline(transaction=False) as pipe:
+        for elm in affected:
+            for v in vids:
+                pipe.sismember('vocabs:{}:types'.format(v), elm)
+                pipe.sismember('vocabs:{}:properties'.format(v), elm)
+        members = iter(pipe.execute())
+
+    type_owners = {}
+    property_owners = {}
+    with r.pipeline() as pipe:
+        pipe.multi()
+        for elm in affected:
+            for v in vids:
+                pipe.delete(*(__type_keys(v, elm) + __property_keys(v, elm)))
+                if next(members):
+                    type_owners.setdefault(elm, []).append(v)
+                if next(members):
+                    property_owners.setdefault(elm, []).append(v)
+        pipe.execute()
 
-    if vid is not None:
-        all_type_keys = filter(lambda k: k != 'vocabs:{}:types'.format(vid), r.keys("vocabs:*:types"))
-        vid_types = filter(lambda t: not shared_type(t), vid_types)
+    for t, owners in type_owners.items():
+        for v in owners:
+            __extract_type(schema, r, t, v)
+    for p, owners in property_owners.items():
+        for v in owners:
+            __extract_property(schema, r, p, v)
 
-    return vid_types
+    __merge(r, affected)
+    # Only once everything is written, so that no snapshot of a partial index gets the final ts
+    __touch(r)
+    log.info('Done ({} affected elements in {}ms)'.format(len(affected),
+                                                           (dt.now() - start_time).total_seconds() * 1000))
+    return set(affected)
 
 
-def _get_properties(r, vid=None):
+def _get_types(r, vid=None):
     # type: (redis.StrictRedis, str) -> iter
+    return __get_vocab_set(r, 'types', vid)
 
-    def shared_property(t):
-        return any(filter(lambda k: r.sismember(k, t), all_prop_keys))
-
-    vid_props = __get_vocab_set(r, 'vocabs:*:properties', vid)
-
-    if vid is not None:
-        all_prop_keys = filter(lambda k: k != 'vocabs:{}:properties'.format(vid), r.keys("vocabs:*:properties"))
-        vid_props = filter(lambda t: not shared_property(t), vid_props)
 
-    return vid_props
+def _get_properties(r, vid=None):
+    # type: (redis.StrictRedis, str) -> iter
+    return __get_vocab_set(r, 'properties', vid)
 
 
 def _get_property(r, prop):
     # type: (redis.StrictRedis, str) -> dict
 
-    def get_inverse_domain(ip):
-        return reduce(set.union, __get_by_pattern(r, '*:properties:{}:_domain'.format(ip), r.smembers), set([]))
-
-    def get_inverse_range(ip):
-        return reduce(set.union, __get_by_pattern(r, '*:properties:{}:_range'.format(ip), r.smembers), set([]))
-
-    all_prop_keys = r.keys('*:properties')
-    if not filter(lambda k: r.sismember(k, prop), all_prop_keys):
+    record = r.hgetall('properties:{}'.format(prop))
+    if not record:
         raise TypeError('Unknown property')
 
-    domain = reduce(set.union, __get_by_pattern(r, '*:properties:{}:_domain'.format(prop), r.smembers), set([]))
-    rang = reduce(set.union, __get_by_pattern(r, '*:properties:{}:_range'.format(prop), r.smembers), set([]))
-    inv = reduce(set.union, __get_by_pattern(r, '*:properties:{}:_inverse'.format(prop), r.smembers), set([]))
-    cons = reduce(set.union, __get_by_pattern(r, '*:properties:{}:_cons'.format(prop), r.smembers), set([]))
-    cons = map(lambda x: eval(x), cons)
-    if len(inv):
-        inverse_dr = [(get_inverse_domain(i), get_inverse_range(i)) for i in inv]
-        for dom, ra in inverse_dr:
-            domain.update(ra)
-            rang.update(dom)
-
-    ty = __get_by_pattern(r, '*:properties:{}:_type'.format(prop), r.get)
-    try:
-        ty = ty.pop()
-    except IndexError:
-        ty = 'object'
-
-    return {'domain': list(domain),
-            'range': list(rang),
-            'inverse': list(inv),
+    cons = map(lambda x: eval(x), json.loads(record['constraints']))
+    return {'domain': json.loads(record['domain']),
+            'range': json.loads(record['range']),
+            'inverse': json.loads(record['inverse']),
             'constraints': dict(cons),
-            'type': ty}
+            'type': record['type']}
 
 
 def _is_property(r, prop):
     # type: (redis.StrictRedis, str) -> bool
-    all_prop_keys = r.keys('*:properties')
-    return bool(filter(lambda k: r.sismember(k, prop), all_prop_keys))
+    return r.sismember(PROPERTIES_KEY, prop)
 
 
 def _is_type(r, ty):
     # type: (redis.StrictRedis, str) -> bool
-    all_type_keys = r.keys('*:types')
-    return bool(filter(lambda k: r.sismember(k, ty), all_type_keys))
+    return r.sismember(TYPES_KEY, ty)
 
 
 def _get_type(r, ty):
     # type: (redis.StrictRedis, str) -> dict
-    all_type_keys = r.keys('*:types')
-    if not filter(lambda k: r.sismember(k, ty), all_type_keys):
+
+    record = r.hgetall('types:{}'.format(ty))
+    if not record:
         raise TypeError('Unknown type: {}'.format(ty))
 
-    super_types = reduce(set.union, __get_by_pattern(r, '*:types:{}:super'.format(ty), r.smembers), set([]))
-    sub_types = reduce(set.union, __get_by_pattern(r, '*:types:{}:sub'.format(ty), r.smembers), set([]))
-    type_props = reduce(set.union, __get_by_pattern(r, '*:types:{}:props'.format(ty), r.smembers), set([]))
-    type_s_props = reduce(set.union, __get_by_pattern(r, '*:types:{}:s-props'.format(ty), r.smembers), set([]))
-    type_refs = reduce(set.union, __get_by_pattern(r, '*:types:{}:refs'.format(ty), r.smembers), set([]))
-    type_s_refs = reduce(set.union, __get_by_pattern(r, '*:types:{}:s-refs'.format(ty), r.smembers), set([]))
-
-    return {'super': list(super_types),
-            'sub': list(sub_types),
-            'properties': list(type_props),
-            'spec_properties': list(type_s_props),
-            'refs': list(type_refs),
-            'spec_refs': list(type_s_refs)}
-
-
-def _cached(f):
-    # type: (callable) -> callable
-    def wrap(self=None, *args, **kwargs):
-        if self.schema.cache is not None:
-            return cached(self.schema.cache, ref_ts=self.ts)(f)(self, *args, **kwargs)
-        else:
-            return f(self, *args, **kwargs)
+    return {field: json.loads(record[field]) for _, field in _type_facets}
+
+
+class IndexSnapshot(object):
+    """
+    Immutable, in-process copy of all indexed types and properties at a given index ts
+    """
+
+    def __init__(self, ts, types, properties):
+        # type: (int, dict, dict) -> None
+        self.__ts = ts
+        self.__types = types
+        self.__properties = properties
+        self.__type_set = frozenset(types)
+        self.__property_set = frozenset(properties)
+
+    @staticmethod
+    def build(r):
+        # type: (redis.StrictRedis) -> IndexSnapshot
+        while True:
+            with r.pipeline() as pipe:
+                pipe.get('ts').smembers(TYPES_KEY).smembers(PROPERTIES_KEY)
+                ts, types, properties = pipe.execute()
+            types = list(types)
+            properties = list(properties)
+            with r.pipeline() as pipe:
+                for t in types:
+                    pipe.hgetall('types:{}'.format(t))
+                for p in properties:
+                    pipe.hgetall('properties:{}'.format(p))
+                pipe.get('ts')
+                records = pipe.execute()
+
+            # Rebuild if any vocabulary was indexed in the meantime
+            if records.pop() == ts:
+                break
+
+        type_dicts = {}
+        for t, record in zip(types, records):
+            if record:
+                type_dicts[t] = {field: frozenset(json.loads(record[field])) for _, field in _type_facets}
+        property_dicts = {}
+        for p, record in zip(properties, records[len(types):]):
+            if record:
+                property_dicts[p] = {
+                    'domain': frozenset(json.loads(record['domain'])),
+                    'range': frozenset(json.loads(record['range'])),
+                    'inverse': frozenset(json.loads(record['inverse'])),
+                    'constraints': dict(map(lambda x: eval(x), json.loads(record['constraints']))),
+                    'type': record['type']
+                }
+
+        return IndexSnapshot(0 if ts is None else int(ts), type_dicts, property_dicts)
+
+    @property
+    def ts(self):
+        # type: () -> int
+        return self.__ts
+
+    @property
+    def types(self):
+        # type: () -> frozenset
+        return self.__type_set
 
-    return wrap
+    @property
+    def properties(self):
+        # type: () -> frozenset
+        return self.__property_set
+
+    def get_type(self, t):
+        # type: (str) -> dict
+        try:
+            return {facet: list(values) for facet, values in self.__types[t].items()}
+        except KeyError:
+            raise TypeError('Unknown type: {}'.format(t))
+
+    def get_property(self, p):
+        # type: (str) -> dict
+        try:
+            p_dict = self.__properties[p]
+        except KeyError:
+            raise TypeError('Unknown property')
+        return {'domain': list(p_dict['domain']),
+                'range': list(p_dict['range']),
+                'inverse': list(p_dict['inverse']),
+                'constraints': dict(p_dict['constraints']),
+                'type': p_dict['type']}
+
+    def is_type(self, t):
+        # type: (str) -> bool
+        return t in self.__type_set
+
+    def is_property(self, p):
+        # type: (str) -> bool
+        return p in self.__property_set
 
 
 class Index(object):
+    # Seconds a snapshot is served before checking whether another process moved the index ts
+    snapshot_ttl = 1.0
+
     def __init__(self):
         self.__schema = None
         self.__r = None
+        self.__snapshot = None
+        self.__snapshot_checked = 0
+        self.__snapshot_lock = Lock()
 
     @property
     def schema(self):
@@ -357,38 +754,74 @@ class Index(object):
     def r(self, r):
         # type: (redis.StrictRedis) -> None
         self.__r = r
+        self.__snapshot = None
+        _migrate(r)
+
+    @property
+    def snapshot(self):
+        # type: () -> IndexSnapshot
+        """
+        :return: The snapshot of the current index ts. Readers keep using the one they got while
+        a new one is being built, which replaces it in a single assignment
+        """
+        snapshot = self.__snapshot
+        if snapshot is not None and time() - self.__snapshot_checked < self.snapshot_ttl:
+            return snapshot
+
+        with self.__snapshot_lock:
+            snapshot = self.__snapshot
+            if snapshot is None or snapshot.ts != self.ts:
+                snapshot = IndexSnapshot.build(self.__r)
+                self.__snapshot = snapshot
+            self.__snapshot_checked = time()
+            return snapshot
 
     @property
     def types(self):
-        return _get_types(self.r)
+        return list(self.snapshot.types)
 
     @property
     def properties(self):
-        return _get_properties(self.r)
+        return list(self.snapshot.properties)
 
-    @_cached
     def get_type(self, t):
         # type: (str) -> dict
-        return _get_type(self.r, t)
+        return self.snapshot.get_type(t)
 
-    @_cached
     def get_property(self, p):
         # type: (str) -> dict
-        return _get_property(self.r, p)
+        return self.snapshot.get_property(p)
 
-    @_cached
     def is_type(self, t):
-        return _is_type(self.r, t)
+        return self.snapshot.is_type(t)
 
-    @_cached
     def is_property(self, p):
-        return _is_property(self.r, p)
+        return self.snapshot.is_property(p)
 
     def index_vocabulary(self, vid):
-        return _extract_vocabulary(self.__schema, self.__r, vid)
+        try:
+            return _extract_vocabulary(self.__schema, self.__r, vid)
+        finally:
+            self.__snapshot = None
+
+    def update_vocabulary(self, vid, old_triples):
+        # type: (str, set) -> set
+        """
+        Updates the index after vid was changed or deleted from the schema
+        :param old_triples: The triples of the vocabulary before the change
+        :return: The affected types and properties
+        """
+        snapshot = self.snapshot
+        try:
+            return _update_vocabulary(self.__schema, self.__r, vid, old_triples, snapshot)
+        finally:
+            self.__snapshot = None
 
     def delete_vocabulary(self, vid):
-        return _delete_vocabulary(self.__r, vid)
+        try:
+            return _delete_vocabulary(self.__r, vid)
+        finally:
+            self.__snapshot = None
 
     def close(self):
         close_kv(self.r)
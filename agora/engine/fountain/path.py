@@ -19,9 +19,15 @@
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
 """
 
+import hashlib
+import json
 import logging
+from collections import OrderedDict
+from itertools import islice
+from threading import Lock
 
 import networkx as nx
+import redis
 from networkx import Graph
 
 from agora.engine.fountain.index import Index
@@ -32,7 +38,68 @@ __author__ = 'Fernando Serena'
 log = logging.getLogger('agora.engine.fountain.path')
 
 match_elm_cycles = {}
-paths_cache = {}
+
+
+class PathCache(object):
+    """
+    Bounded (least recently used) cache of path enumerations
+    """
+
+    def __init__(self, max_size=10000):
+        # type: (int) -> None
+        self.__max_size = max_size
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key):
+        # type: (tuple) -> any
+        with self.__lock:
+            value = self.__entries.pop(key, None)
+            if value is not None:
+                self.__entries[key] = value
+            return value
+
+    def put(self, key, value):
+        # type: (tuple, any) -> None
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = value
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+def _build_reachability(graph):
+    # type: (nx.DiGraph) -> dict
+    """
+    Condenses the graph into its DAG of strongly connected components and computes, for each of them,
+    the (bit)set of components it reaches
+    :return: A dict of node -> (component, reached components)
+    """
+    condensed = nx.condensation(graph)
+    reached = {}
+    for c in reversed(list(nx.topological_sort(condensed))):
+        bits = 1 << c
+        for succ in condensed.successors(c):
+            bits |= reached[succ]
+        reached[c] = bits
+    return dict((n, (c, reached[c])) for n, c in condensed.graph['mapping'].items())
+
+
+def _reachable(graph, source, target):
+    # type: (nx.DiGraph, str, str) -> bool
+    """
+    :return: Whether there may be a simple path from source to target (unknown nodes are left for
+    the path enumeration to deal with)
+    """
+    if source == target:
+        return False
+    reach = graph.graph.get('reach', {})
+    if source not in reach or target not in reach:
+        return True
+    return bool(reach[source][1] >> reach[target][0] & 1)
 
 
 def _build_directed_graph(index, generic=False, graph=None):
@@ -50,8 +117,6 @@ def _build_directed_graph(index, generic=False, graph=None):
     else:
         graph.clear()
 
-    paths_cache.clear()
-
     graph.add_nodes_from(index.types, ty='type')
     for node in index.properties:
         p_dict = index.get_property(node)
@@ -74,59 +139,170 @@ def _build_directed_graph(index, generic=False, graph=None):
         graph.add_node(node, ty='prop', object=p_dict.get('type') == 'object', range=ran,
                        constraints=p_dict['constraints'])
 
+    graph.graph['reach'] = _build_reachability(graph)
     log.debug('Link graph edges: {}'.format(len(graph.edges())))
     return graph
 
 
-def _find_cycles(index):
-    # type: (Index) -> iter
+def __cycle_steps(index, graph, cy):
+    # type: (Index, nx.DiGraph, list) -> (list, set)
+    cycle = []
+    t_cycle = None
+    cycle_types = set()
+    for j, elm in enumerate(cy):
+        if index.is_type(elm):
+            t_cycle = elm
+        elif t_cycle is not None:
+            cons = graph.get_edge_data(t_cycle, elm)['c']
+            if cons:
+                next_type = cy[(j + 1) % len(cy)]
+                if next_type not in cons:
+                    t_cycle = None
+                    cycle = []
+                    cycle_types.clear()
+                    break
 
-    g_graph = _build_directed_graph(index, generic=True)
-    cycle_keys = index.r.keys('*cycles*')
-    for ck in cycle_keys:
-        index.r.delete(ck)
-    g_cycles = list(nx.simple_cycles(g_graph))
-    with index.r.pipeline() as pipe:
-        pipe.multi()
-        for i, cy in enumerate(g_cycles):
-            cycle = []
+            cycle.append({'property': elm, 'type': t_cycle})
+            cycle_types.add(t_cycle)
             t_cycle = None
-            cycle_types = set()
-            for j, elm in enumerate(cy):
-                if index.is_type(elm):
-                    t_cycle = elm
-                elif t_cycle is not None:
-                    cons = g_graph.get_edge_data(t_cycle, elm)['c']
-                    if cons:
-                        next_type = cy[(j + 1) % len(cy)]
-                        if next_type not in cons:
-                            t_cycle = None
-                            cycle = []
-                            cycle_types.clear()
-                            break
-
-                    cycle.append({'property': elm, 'type': t_cycle})
-                    cycle_types.add(t_cycle)
-                    t_cycle = None
-            if t_cycle is not None:
-                cons = g_graph.get_edge_data(t_cycle, cy[0])['c']
-                if cons:
-                    next_type = cy[1]
-                    if next_type not in cons:
-                        t_cycle = None
-                        cycle = []
-                        cycle_types.clear()
-
-                if t_cycle:
-                    cycle.append({'property': cy[0], 'type': t_cycle})
-                    cycle_types.add(t_cycle)
+    if t_cycle is not None:
+        cons = graph.get_edge_data(t_cycle, cy[0])['c']
+        if cons:
+            next_type = cy[1]
+            if next_type not in cons:
+                t_cycle = None
+                cycle = []
+                cycle_types.clear()
+
+        if t_cycle:
+            cycle.append({'property': cy[0], 'type': t_cycle})
+            cycle_types.add(t_cycle)
+    return cycle, cycle_types
+
+
+def __component_signature(index, component):
+    # type: (Index, nx.DiGraph) -> str
+    nodes = sorted([(n, index.is_type(n)) for n in component.nodes()])
+    edges = sorted([(u, v, sorted(data.get('c', []))) for u, v, data in component.edges(data=True)])
+    return hashlib.sha1(json.dumps([nodes, edges])).hexdigest()
+
+
+def _bounded_cycles(component, max_length, max_cycles):
+    # type: (nx.DiGraph, int, int) -> (list, bool)
+    """
+    Enumerates the simple cycles of a strongly connected component, each one starting from its lowest node
+    :return: The cycles (node lists) of at most max_length nodes and whether max_cycles was reached
+    """
+    order = dict((n, i) for i, n in enumerate(sorted(component.nodes())))
+    cycles = []
+    for start in sorted(component.nodes()):
+        path = [start]
+        on_path = set(path)
+        stack = [iter(component.successors(start))]
+        while stack:
+            advanced = False
+            for nxt in stack[-1]:
+                if nxt == start:
+                    cycles.append(list(path))
+                    if len(cycles) >= max_cycles:
+                        return cycles, True
+                elif order[nxt] > order[start] and nxt not in on_path and len(path) < max_length:
+                    path.append(nxt)
+                    on_path.add(nxt)
+                    stack.append(iter(component.successors(nxt)))
+                    advanced = True
+                    break
+            if not advanced:
+                stack.pop()
+                on_path.discard(path.pop())
+    return cycles, False
+
+
+def _cycles_prefix(r):
+    # type: (redis.StrictRedis) -> str
+    return 'cycles:v{}'.format(r.get('cycles:current') or 0)
+
+
+def _find_cycles(index, graph=None, max_length=12, max_cycles=10000):
+    # type: (Index, nx.DiGraph, int, int) -> list
+    """
+    Finds the cycles of each strongly connected component of the link graph, reusing those already found
+    for unchanged components, and publishes them under a new version of the cycle keys
+    :return: All cycles (as lists of steps)
+    """
+    r = index.r
+    if graph is None:
+        graph = _build_directed_graph(index, generic=True)
+
+    # Keys of the former layout ('cycles' zset and 'cycles:<type>' sets)
+    if r.type('cycles') != 'none':
+        legacy_keys = list(r.scan_iter('cycles:*')) + ['cycles']
+        r.delete(*legacy_keys)
+
+    components = {}
+    for nodes in nx.strongly_connected_components(graph):
+        if len(nodes) > 1:
+            component = graph.subgraph(nodes)
+            components[__component_signature(index, component)] = component
+
+    signatures = sorted(components)
+    with r.pipeline(transaction=False) as pipe:
+        for sig in signatures:
+            pipe.get('cycles:scc:{}'.format(sig))
+        stored = dict(zip(signatures, pipe.execute()))
+
+    component_cycles = {}
+    for sig in signatures:
+        if stored[sig] is not None:
+            component_cycles[sig] = json.loads(stored[sig])
+            continue
+        node_cycles, truncated = _bounded_cycles(components[sig], max_length, max_cycles)
+        if truncated:
+            log.warning('Stopped looking for cycles in a component of {} nodes after {}'.format(
+                len(components[sig]), max_cycles))
+        cycles = []
+        for cy in node_cycles:
+            cycle, cycle_types = __cycle_steps(index, graph, cy)
             if cycle:
-                pipe.zadd('cycles', i, cycle)
-            cycle_types = reduce(lambda x, y: x.union(set(index.get_type(y)['sub'] + [y])), cycle_types, set())
-            for ct in cycle_types:
-                pipe.sadd('cycles:{}'.format(ct), i)
+                cycles.append([cycle, sorted(cycle_types)])
+        component_cycles[sig] = cycles
+        r.set('cycles:scc:{}'.format(sig), json.dumps(cycles))
+
+    old_prefix = _cycles_prefix(r)
+    old_keys = r.smembers('{}:keys'.format(old_prefix))
+    prefix = 'cycles:v{}'.format(r.incr('cycles:version'))
+    keys = set([prefix])
+    all_cycles = []
+    with r.pipeline() as pipe:
+        pipe.multi()
+        for sig in signatures:
+            for cycle, cycle_types in component_cycles[sig]:
+                cid = len(all_cycles)
+                all_cycles.append(cycle)
+                pipe.zadd(prefix, cid, json.dumps(cycle, sort_keys=True))
+                cycle_types = reduce(lambda x, y: x.union(set(index.get_type(y)['sub'] + [y])), cycle_types, set())
+                for ct in cycle_types:
+                    ct_key = '{}:types:{}'.format(prefix, ct)
+                    pipe.sadd(ct_key, cid)
+                    keys.add(ct_key)
+        pipe.sadd('{}:keys'.format(prefix), *keys)
+        pipe.set('cycles:current', prefix.split(':v')[-1])
+        pipe.execute()
+
+    # Readers switched to the new version; drop the previous one and the cycles of vanished components
+    old_signatures = r.smembers('cycles:sccs')
+    with r.pipeline() as pipe:
+        pipe.multi()
+        if old_keys:
+            pipe.delete(*(list(old_keys) + ['{}:keys'.format(old_prefix)]))
+        for sig in set(old_signatures).difference(signatures):
+            pipe.delete('cycles:scc:{}'.format(sig))
+        pipe.delete('cycles:sccs')
+        if signatures:
+            pipe.sadd('cycles:sccs', *signatures)
         pipe.execute()
-    return g_cycles
+
+    return all_cycles
 
 
 def chunks(l, n):
@@ -135,14 +311,45 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
+def __cached(graph, key, f):
+    # type: (nx.DiGraph, tuple, callable) -> list
+    cache = graph.graph.get('paths', None)
+    if cache is None:
+        return f()
+    key = (graph.graph.get('version', None),) + key
+    value = cache.get(key)
+    if value is None:
+        value = f()
+        cache.put(key, value)
+    return value
+
+
 def _all_simple_paths(graph, source, target):
-    if (graph, source, target) not in paths_cache:
-        paths_cache[(graph, source, target)] = list(nx.all_simple_paths(graph, source, target))
-    return paths_cache.get((graph, source, target), [])
+    # type: (nx.DiGraph, str, str) -> list
+
+    def enumerate_paths():
+        max_length = graph.graph.get('max_length', None)
+        max_paths = graph.graph.get('max_paths', None)
+        if max_paths is None:
+            return list(nx.all_simple_paths(graph, source, target, cutoff=max_length))
+
+        # Top-k mode: the max_paths shortest ones
+        paths = []
+        for path in islice(nx.shortest_simple_paths(graph, source, target), max_paths):
+            if max_length is not None and len(path) - 1 > max_length:
+                break
+            paths.append(path)
+        return paths
+
+    if not _reachable(graph, source, target):
+        return []
+    return list(__cached(graph, ('all', source, target), enumerate_paths))
 
 
 def _get_simple_paths(index, graph, source, target):
-    if (graph, source, target) not in paths_cache:
+    # type: (Index, nx.DiGraph, str, str) -> list
+
+    def find_paths():
         paths = _all_simple_paths(graph, source, target)
         source_type_dict = index.get_type(source)
         target_type_dict = index.get_type(target)
@@ -162,10 +369,30 @@ def _get_simple_paths(index, graph, source, target):
         for p in paths:
             if p not in final_paths:
                 final_paths.append(p)
-        if not final_paths:
-            raise nx.NetworkXNoPath
-        paths_cache[(graph, source, target)] = final_paths
-    return paths_cache[(graph, source, target)]
+        return final_paths
+
+    final_paths = __cached(graph, ('seed', source, target), find_paths)
+    if not final_paths:
+        raise nx.NetworkXNoPath
+    return list(final_paths)
+
+
+def _connected(index, graph, source, target):
+    # type: (Index, nx.DiGraph, str, str) -> bool
+    """
+    Answers with the reachability index the same pairs (including supertypes) that _get_simple_paths
+    would look paths for, regardless of any path length bound
+    """
+    source_super = index.get_type(source)['super']
+    target_super = index.get_type(target)['super']
+    if not source_super and not _reachable(graph, source, target):
+        source_super = [source]
+    pairs = [(source, target)]
+    for ss_ty in source_super:
+        pairs.append((ss_ty, target))
+        for ts_ty in target_super:
+            pairs.extend([(source, ts_ty), (ss_ty, ts_ty)])
+    return any(_reachable(graph, s, t) for s, t in pairs)
 
 
 def _find_seed_paths(index, sm, graph, elm, force_seed=None):
@@ -197,11 +424,8 @@ def _find_seed_paths(index, sm, graph, elm, force_seed=None):
             try:
                 ty_paths = _get_simple_paths(index, graph, ty, target)
             except nx.NetworkXNoPath:
-                if ty == target:
-                    yield ty, []
-                    continue
-                else:
-                    ty_paths = None
+                # Seeds of the target type itself are a (step-less) path
+                ty_paths = [] if ty == target else None
 
             if ty_paths is not None:
                 if ty == target or target in index.get_type(ty)['super']:
@@ -265,39 +489,43 @@ def _find_path(index, sm, graph, elm, force_seed=None):
     paths = find_property_paths(elm)
     seed_paths = filter(lambda x: x is not None, map(lambda (ty, path): build_seed_path(ty, path), paths))
 
-    cycle_ids = set([int(c) for c in index.r.smembers('cycles:{}'.format(elm))])
+    cycles_prefix = _cycles_prefix(index.r)
+    cycle_ids = set([int(c) for c in index.r.smembers('{}:types:{}'.format(cycles_prefix, elm))])
 
     for path in seed_paths:
         path['cycles'] = cycle_ids.copy()
         for step in path['steps']:
-            cycles = set([int(c) for c in index.r.smembers('cycles:{}'.format(step.get('type')))])
+            cycles = set([int(c) for c in index.r.smembers('{}:types:{}'.format(cycles_prefix, step.get('type')))])
             path['cycles'].update(set(path['cycles']).union(cycles))
             cycle_ids.update(cycles)
         path['cycles'] = list(path['cycles'])
 
-    applying_cycles = set(cycle_ids)
-
-    new_applying_cycles = {}
-    for cid in applying_cycles:
+    applying_cycles = {}
+    for cid in cycle_ids:
         try:
-            eval_cycle = eval(index.r.zrange('cycles', cid, cid).pop())
-            new_applying_cycles[int(cid)] = eval_cycle
-        except:
+            applying_cycles[cid] = json.loads(index.r.zrangebyscore(cycles_prefix, cid, cid).pop())
+        except IndexError:
             pass
 
-    applying_cycles = new_applying_cycles
-
-    # applying_cycles = {int(cid): eval(index.r.zrange('cycles', cid, cid).pop()) for cid in applying_cycles}
     return seed_paths, [{'cycle': cid, 'steps': applying_cycles[cid]} for cid in
                         applying_cycles]
 
 
 class PathManager(object):
+    # Bounds of the cycle search: nodes (types and properties) per cycle and cycles per connected component
+    max_cycle_length = 12
+    max_component_cycles = 10000
+    # Bounds of the path search: links per path and, if given, only the shortest max_paths paths per pair
+    max_path_length = None
+    max_paths = None
+    paths_cache_size = 10000
+
     def __init__(self):
         self.__index = None
         self.__sm = None
         self.__pgraph = nx.DiGraph()
         self.__last_ts = -1
+        self.__paths = PathCache(self.paths_cache_size)
 
     @property
     def index(self):
@@ -306,7 +534,13 @@ class PathManager(object):
     @index.setter
     def index(self, i):
         self.__index = i
-        _build_directed_graph(self.index, graph=self.__pgraph)
+        self.__build_graph()
+
+    def __build_graph(self):
+        _build_directed_graph(self.__index, graph=self.__pgraph)
+        # Enumerated paths are cached by index version, so those of former versions just age out
+        self.__pgraph.graph.update(version=self.__index.ts, paths=self.__paths, max_length=self.max_path_length,
+                                   max_paths=self.max_paths)
 
     @property
     def seed_manager(self):
@@ -317,8 +551,9 @@ class PathManager(object):
         self.__sm = s
 
     def calculate(self):
-        _build_directed_graph(self.__index, graph=self.__pgraph)
-        _find_cycles(self.__index)
+        self.__build_graph()
+        _find_cycles(self.__index, graph=self.__pgraph, max_length=self.max_cycle_length,
+                     max_cycles=self.max_component_cycles)
 
     def __check_graph(self):
         current_ts = self.__index.ts
@@ -338,7 +573,4 @@ class PathManager(object):
 
     def are_connected(self, source, target):
         self.__check_graph()
-        try:
-            return bool(_get_simple_paths(self.index, self.path_graph, source, target))
-        except nx.NetworkXNoPath:
-            return False
+        return _connected(self.index, self.__pgraph, source, target)
@@ -19,9 +19,10 @@
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
 """
 import logging
+from collections import defaultdict
 
-from rdflib import URIRef, BNode, Graph
-from rdflib.namespace import RDFS, OWL, NamespaceManager
+from rdflib import URIRef, BNode, Graph, RDF
+from rdflib.namespace import RDFS, OWL
 
 from agora.engine.utils.cache import Cache, ContextGraph, cached
 
@@ -30,50 +31,6 @@ __author__ = 'Fernando Serena'
 log = logging.getLogger('agora.engine.fountain.path')
 
 
-def __flat_slice(iterable):
-    # type: (iter) -> set
-    lst = filter(lambda x: x, list(iterable))
-    for i, _ in enumerate(lst):
-        while hasattr(lst[i], "__iter__") and not isinstance(lst[i], basestring):
-            lst[i:i + 1] = lst[i]
-    return set(filter(lambda x: x is not None, lst))
-
-
-def __q_name(ns, term):
-    # type: (NamespaceManager, any) -> any
-    n3_method = getattr(term, "n3", None)
-    if callable(n3_method):
-        return term.n3(ns)
-    return term
-
-
-def __query(graph, q):
-    # type: (Graph, str) -> set
-    graph.namespace_manager.bind('rdfs', RDFS, replace=True, override=True)
-    graph.namespace_manager.bind('owl', OWL, replace=True, override=True)
-    result = graph.query(q)
-    return set([__q_name(graph.namespace_manager, x) for x in __flat_slice(result)])
-
-
-def __extend_prefixed(ns, pu):
-    # type: (dict, str) -> URIRef
-
-    parts = pu.split(':')
-    if len(parts) == 1:
-        parts = ('', parts[0])
-    try:
-        return URIRef(ns[parts[0]] + parts[1])
-    except KeyError:
-        return BNode(pu)
-
-
-def __extend_with(f, graph, *args):
-    # type: (callable, Graph, iter) -> iter
-    args = __flat_slice(args)
-    extension = __flat_slice([f(graph, t) for t in args])
-    return set.union(args, extension)
-
-
 def _contexts(graph):
     # type: (ContextGraph) -> list
     return [str(x.identifier) for x in graph.contexts()]
@@ -126,291 +83,230 @@ def _prefixes(graph):
     return dict(graph.namespaces())
 
 
-def _get_types(graph):
-    # type: (Graph) -> set
-    return __query(graph,
-                   """SELECT DISTINCT ?c WHERE {
-                        {
-                            ?p a owl:ObjectProperty .
-                            {
-                                { ?p rdfs:range ?c }
-                                UNION
-                                { ?p rdfs:domain ?c }
-                            }
-                        }
-                        UNION
-                        {
-                            ?p a owl:DatatypeProperty .
-                            ?p rdfs:domain ?c .
-                        }
-                        UNION
-                        { ?c a owl:Class }
-                        UNION
-                        { ?c a rdfs:Class }
-                        UNION
-                        { [] rdfs:subClassOf ?c }
-                        UNION
-                        { ?c rdfs:subClassOf [] }
-                        UNION
-                        {
-                            ?r a owl:Restriction ;
-                               owl:onProperty ?p .
-                            {
-                                ?p a owl:ObjectProperty .
-                                { ?r owl:allValuesFrom ?c }
-                                UNION
-                                { ?r owl:someValuesFrom ?c }
-                            }
-                            UNION
-                            { ?r owl:onClass ?c }
-                        }
-                        FILTER(isURI(?c))
-                      }""")
-
-
-def _get_properties(graph):
-    # type: (Graph) -> set
-    return __query(graph, """SELECT DISTINCT ?p WHERE {
-                                { ?p a rdf:Property }
-                                UNION
-                                { ?p a owl:ObjectProperty }
-                                UNION
-                                { ?p a owl:DatatypeProperty }
-                                UNION
-                                {
-                                    [] a owl:Restriction ;
-                                       owl:onProperty ?p .
-                                }
-                                FILTER(isURI(?p))
-                              }""")
-
-
-def _is_object_property(graph, prop):
-    # type: (Graph, str) -> bool
-    evidence = __query(graph, """ASK {
-                                    { %s a owl:ObjectProperty }
-                                    UNION
-                                    {
-                                        ?r owl:onProperty %s .
-                                        {
-                                            { ?c a owl:Class }
-                                            UNION
-                                            { ?c rdfs:subClassOf ?r }
-                                        }
-                                        {
-                                            {
-                                               ?r owl:onClass ?c .
-                                            }
-                                            UNION
-                                            {
-                                                ?r owl:someValuesFrom ?c .
-                                            }
-                                            UNION
-                                            {
-                                                ?r owl:allValuesFrom ?c .
-                                            }
-                                        }
-                                    }
-                                   }""" % (prop, prop))
-
-    return False if not evidence else bool(evidence.pop())
-
-
-def _get_property_domain(graph, prop):
-    # type: (Graph, str) -> set
-    all_property_domains = graph.query("""
-                          PREFIX owl: <http://www.w3.org/2002/07/owl#>
-                          PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-                          SELECT DISTINCT ?p ?c WHERE {
-                             { ?p rdfs:domain ?c }
-                             UNION
-                             { ?c rdfs:subClassOf [ owl:onProperty ?p ] }
-                             FILTER (isURI(?p) && isURI(?c))
-                           }""")
-
-    dom = map(lambda x: __q_name(graph.namespace_manager, x.c),
-              filter(lambda x: __q_name(graph.namespace_manager, x.p) == prop, all_property_domains))
-    return __extend_with(_get_subtypes, graph, dom)
-
-
-def _get_property_range(graph, prop):
-    # type: (Graph, str) -> set
-    all_property_ranges = graph.query("""
-                                        PREFIX owl: <http://www.w3.org/2002/07/owl#>
-                                        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-                                        SELECT DISTINCT ?p ?r WHERE {
-                                              {?p rdfs:range ?r}
-                                              UNION
-                                              {
-                                                    ?d owl:onProperty ?p.
-                                                    { ?d owl:allValuesFrom ?r }
-                                                    UNION
-                                                    { ?d owl:someValuesFrom ?r }
-                                                    UNION
-                                                    { ?d owl:onClass ?r }
-                                                    UNION
-                                                    { ?d owl:onDataRange ?r }
-                                              }
-                                              FILTER(isURI(?p) && isURI(?r))
-                                            }""")
-
-    rang = map(lambda x: __q_name(graph.namespace_manager, x.r),
-               filter(lambda x: __q_name(graph.namespace_manager, x.p) == prop, all_property_ranges))
-    return __extend_with(_get_subtypes, graph, rang)
-
-
-def _get_property_inverses(graph, prop):
-    # type: (Graph, str) -> set
-    return __query(graph, """SELECT DISTINCT ?i WHERE {
-                                 {%s owl:inverseOf ?i}
-                                 UNION
-                                 {?i owl:inverseOf %s}
-                                 FILTER(isURI(?i))
-                               }""" % (prop, prop))
-
-
-def _get_property_constraints(graph, prop):
-    # type: (Graph, str) -> set
-    all_property_domains = graph.query("""
-                               PREFIX owl: <http://www.w3.org/2002/07/owl#>
-                               PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-                               SELECT DISTINCT ?p ?c WHERE {
-                                 { ?p rdfs:domain ?c }
-                                 UNION
-                                 { ?c rdfs:subClassOf [ owl:onProperty ?p ] }
-                                 FILTER (isURI(?p) && isURI(?c))
-                               }""")
-
-    dom = map(lambda x: __q_name(graph.namespace_manager, x.c),
-              filter(lambda x: __q_name(graph.namespace_manager, x.p) == prop, all_property_domains))
-    dom_supertypes = [_get_supertypes(graph, d) for d in dom]
-    for d, s in zip(dom, dom_supertypes):
-        if set.intersection(set(s), set(dom)):
-            cons_range = __query(graph, """SELECT DISTINCT ?r WHERE {
-                                              {
-                                                    %s rdfs:subClassOf ?d .
-                                                    ?d owl:onProperty %s .
-                                                    { ?d owl:allValuesFrom ?r }
-                                                    UNION
-                                                    { ?d owl:someValuesFrom ?r }
-                                                    UNION
-                                                    { ?d owl:onClass ?r }
-                                                    UNION
-                                                    { ?d owl:onDataRange ?r }
-                                              }
-                                              FILTER(isURI(?r))
-                                            }""" % (d, prop))
-            cons_range = __extend_with(_get_subtypes, graph, cons_range)
-            if cons_range:
-                try:
-                    is_strong_constraint = __query(graph, """ASK {                                                          
-                                                                %s rdfs:subClassOf ?d .
-                                                                ?d owl:onProperty %s .
-                                                                ?d owl:allValuesFrom []                                                               
-                                                            }""" % (d, prop)).pop()
-                except KeyError:
-                    is_strong_constraint = True
-
-                if is_strong_constraint:
-                    yield (d, list(cons_range))
-
-
-def _get_supertypes(graph, ty):
-    # type: (Graph, str) -> set
-    res = map(lambda x: __q_name(graph.namespace_manager, x), filter(lambda y: isinstance(y, URIRef),
-                                                                     graph.transitive_objects(
-                                                                         __extend_prefixed(_prefixes(graph), ty),
-                                                                         RDFS.subClassOf)))
-    return set(filter(lambda x: str(x) != ty, res))
-
-
-def _get_subtypes(graph, ty):
-    # type: (Graph, str) -> set
-    res = map(lambda x: __q_name(graph.namespace_manager, x), filter(lambda y: isinstance(y, URIRef),
-                                                                     graph.transitive_subjects(RDFS.subClassOf,
-                                                                                               __extend_prefixed(
-                                                                                                   _prefixes(graph),
-                                                                                                   ty))))
-
-    return set(filter(lambda x: str(x) != ty, res))
-
-
-def _get_type_properties(graph, ty):
-    # type: (Graph, str) -> set
-    all_class_props = graph.query("""
-                                    PREFIX owl: <http://www.w3.org/2002/07/owl#>
-                                    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-                                    SELECT DISTINCT ?c ?p WHERE {
-                                        {?c rdfs:subClassOf [ owl:onProperty ?p ] }
-                                        UNION
-                                        {?p rdfs:domain ?c}
-                                        FILTER (isURI(?p) && isURI(?c))
-                                      }""")
-
-    all_types = __extend_with(_get_supertypes, graph, ty)
-    return set([__q_name(graph.namespace_manager, r.p) for r in all_class_props if
-                __q_name(graph.namespace_manager, r.c) in all_types])
-
-
-def _get_type_specific_properties(graph, ty):
-    # type: (Graph, str) -> set
-    all_class_props = graph.query("""
-                                        PREFIX owl: <http://www.w3.org/2002/07/owl#>
-                                        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-                                        SELECT DISTINCT ?c ?p WHERE {
-                                            {?c rdfs:subClassOf [ owl:onProperty ?p ] }
-                                            UNION
-                                            {?p rdfs:domain ?c}
-                                            FILTER (isURI(?p) && isURI(?c))
-                                          }""")
-
-    return set([__q_name(graph.namespace_manager, r.p) for r in all_class_props if
-                __q_name(graph.namespace_manager, r.c) == ty])
-
-
-def _get_type_references(graph, ty):
-    # type: (Graph, str) -> set
-    all_class_props = graph.query("""
-                                    PREFIX owl: <http://www.w3.org/2002/07/owl#>
-                                    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-                                    SELECT ?c ?p WHERE {
-                                        { ?r owl:onProperty ?p .
-                                          {?r owl:someValuesFrom ?c}
-                                          UNION
-                                          {?r owl:allValuesFrom ?c}
-                                          UNION
-                                          {?r owl:onClass ?c}
-                                        }
-                                        UNION
-                                        {?p rdfs:range ?c}
-                                        FILTER (isURI(?p) && isURI(?c))
-                                       }""")
-
-    all_types = __extend_with(_get_supertypes, graph, ty)
-    return set([__q_name(graph.namespace_manager, r.p) for r in all_class_props if
-                __q_name(graph.namespace_manager, r.c) in all_types])
-
-
-def _get_type_specific_references(graph, ty):
-    # type: (Graph, str) -> set
-    all_class_props = graph.query("""
-                                    PREFIX owl: <http://www.w3.org/2002/07/owl#>
-                                    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-                                    SELECT ?c ?p WHERE {
-                                        { ?r owl:onProperty ?p .
-                                          {?r owl:someValuesFrom ?c}
-                                          UNION
-                                          {?r owl:allValuesFrom ?c}
-                                          UNION
-                                          {?r owl:onClass ?c}
-                                        }
-                                        UNION
-                                        {?p rdfs:range ?c}
-                                        FILTER (isURI(?p) && isURI(?c))
-                                       }""")
-
-    return set([__q_name(graph.namespace_manager, r.p) for r in all_class_props if
-                __q_name(graph.namespace_manager, r.c) == ty])
+_value_predicates = (OWL.allValuesFrom, OWL.someValuesFrom, OWL.onClass, OWL.onDataRange)
+_class_value_predicates = (OWL.allValuesFrom, OWL.someValuesFrom, OWL.onClass)
+
+
+class SchemaClosure(object):
+    """
+    Everything the index extracts from a schema graph, gathered in a single pass over its triples:
+    declarations, domains, ranges, restrictions, inverses and the subclass closures
+    """
+
+    def __init__(self, graph):
+        # type: (Graph) -> None
+        ns = graph.namespace_manager
+        ns.bind('rdfs', RDFS, replace=True, override=True)
+        ns.bind('owl', OWL, replace=True, override=True)
+        self.__ns = ns
+        self.__prefixes = _prefixes(graph)
+        self.__names = {}
+
+        rdf_types = defaultdict(set)
+        self.__supers = defaultdict(set)
+        self.__subs = defaultdict(set)
+        on_property = defaultdict(set)
+        values = defaultdict(set)
+        domains = set([])
+        ranges = set([])
+        inverses = set([])
+        for s, p, o in graph.triples((None, None, None)):
+            if p == RDF.type:
+                rdf_types[s].add(o)
+            elif p == RDFS.subClassOf:
+                self.__supers[s].add(o)
+                self.__subs[o].add(s)
+            elif p == RDFS.domain:
+                domains.add((s, o))
+            elif p == RDFS.range:
+                ranges.add((s, o))
+            elif p == OWL.onProperty:
+                on_property[s].add(o)
+            elif p in _value_predicates:
+                values[s].add((p, o))
+            elif p == OWL.inverseOf:
+                inverses.add((s, o))
+
+        def is_a(node, *types):
+            return bool(rdf_types[node].intersection(types))
+
+        restrictions = [r for r in on_property if is_a(r, OWL.Restriction)]
+        object_props = set([p for p in rdf_types if is_a(p, OWL.ObjectProperty)])
+
+        # Types
+        types = set([c for p, c in domains if is_a(p, OWL.ObjectProperty, OWL.DatatypeProperty)])
+        types.update([c for p, c in ranges if p in object_props])
+        types.update([c for c in rdf_types if is_a(c, OWL.Class, RDFS.Class)])
+        types.update(self.__supers.keys())
+        types.update(self.__subs.keys())
+        for r in restrictions:
+            for vp, c in values[r]:
+                if vp == OWL.onClass or (vp != OWL.onDataRange and on_property[r].intersection(object_props)):
+                    types.add(c)
+        self.__types = self.__uri_names(types)
+
+        # Properties
+        props = set([p for p in rdf_types if is_a(p, RDF.Property, OWL.ObjectProperty, OWL.DatatypeProperty)])
+        for r in restrictions:
+            props.update(on_property[r])
+        self.__properties = self.__uri_names(props)
+
+        # (class, property) pairs: declared domains and restrictions of a class' superclasses
+        class_props = set([(c, p) for p, c in domains])
+        class_refs = set([(c, p) for p, c in ranges])
+        prop_ranges = set(ranges)
+        for c, supers in self.__supers.items():
+            for d in supers:
+                class_props.update([(c, p) for p in on_property.get(d, [])])
+        for d, d_props in on_property.items():
+            for vp, c in values.get(d, []):
+                prop_ranges.update([(p, c) for p in d_props])
+                if vp in _class_value_predicates:
+                    class_refs.update([(c, p) for p in d_props])
+
+        self.__class_props = self.__pairs(class_props)
+        self.__class_refs = self.__pairs(class_refs)
+        self.__prop_domains = self.__pairs([(p, c) for c, p in class_props])
+        self.__prop_ranges = self.__pairs(prop_ranges)
+
+        self.__inverses = defaultdict(set)
+        for p, i in inverses:
+            if isinstance(i, URIRef):
+                self.__inverses[self.__name(p)].add(self.__name(i))
+            if isinstance(p, URIRef):
+                self.__inverses[self.__name(i)].add(self.__name(p))
+
+        self.__object_props = set([self.__name(p) for p in object_props])
+        for r, r_props in on_property.items():
+            for vp, c in values.get(r, []):
+                if vp in _class_value_predicates and (is_a(c, OWL.Class) or r in self.__supers.get(c, [])):
+                    self.__object_props.update([self.__name(p) for p in r_props])
+
+        # Values of the restrictions of each class, by property
+        self.__restricted = defaultdict(set)
+        for c, supers in self.__supers.items():
+            for d in supers:
+                for p in on_property.get(d, []):
+                    self.__restricted[(self.__name(c), self.__name(p))].update(
+                        [self.__name(r) for _, r in values.get(d, []) if isinstance(r, URIRef)])
+
+        self.__closures = {}
+
+    def __name(self, term):
+        # type: (any) -> str
+        try:
+            return self.__names[term]
+        except KeyError:
+            name = term.n3(self.__ns)
+            self.__names[term] = name
+            return name
+
+    def __uri_names(self, terms):
+        # type: (iter) -> set
+        return set([self.__name(t) for t in terms if isinstance(t, URIRef)])
+
+    def __pairs(self, pairs):
+        # type: (iter) -> dict
+        index = defaultdict(set)
+        for a, b in pairs:
+            if isinstance(a, URIRef) and isinstance(b, URIRef):
+                index[self.__name(a)].add(self.__name(b))
+        return index
+
+    def __closure(self, graph, t):
+        # type: (dict, str) -> set
+        key = (id(graph), t)
+        if key not in self.__closures:
+            parts = t.split(':')
+            if len(parts) == 1:
+                parts = ('', parts[0])
+            try:
+                node = URIRef(self.__prefixes[parts[0]] + parts[1])
+            except KeyError:
+                node = BNode(t)
+            visited = set([node])
+            pending = [node]
+            while pending:
+                for n in graph.get(pending.pop(), []):
+                    if n not in visited:
+                        visited.add(n)
+                        pending.append(n)
+            self.__closures[key] = set(filter(lambda x: x != t, self.__uri_names(visited)))
+        return self.__closures[key]
+
+    @property
+    def types(self):
+        # type: () -> set
+        return set(self.__types)
+
+    @property
+    def properties(self):
+        # type: () -> set
+        return set(self.__properties)
+
+    def is_object_property(self, p):
+        # type: (str) -> bool
+        return p in self.__object_props
+
+    def get_supertypes(self, t):
+        # type: (str) -> set
+        return set(self.__closure(self.__supers, t))
+
+    def get_subtypes(self, t):
+        # type: (str) -> set
+        return set(self.__closure(self.__subs, t))
+
+    def __with_subtypes(self, types):
+        # type: (iter) -> set
+        return reduce(lambda x, y: x.union(self.__closure(self.__subs, y)), types, set(types))
+
+    def get_property_domain(self, p):
+        # type: (str) -> set
+        return self.__with_subtypes(self.__prop_domains.get(p, []))
+
+    def get_property_range(self, p):
+        # type: (str) -> set
+        return self.__with_subtypes(self.__prop_ranges.get(p, []))
+
+    def get_property_inverses(self, p):
+        # type: (str) -> set
+        return set(self.__inverses.get(p, []))
+
+    def get_property_constraints(self, p):
+        # type: (str) -> list
+        """
+        :return: (class, range) pairs for each domain class that narrows the values of p through
+        a restriction, when any of its superclasses is also in the domain of p
+        """
+        dom = self.__prop_domains.get(p, set([]))
+        constraints = []
+        for d in dom:
+            if self.__closure(self.__supers, d).intersection(dom):
+                cons_range = self.__with_subtypes(self.__restricted.get((d, p), []))
+                if cons_range:
+                    constraints.append((d, list(cons_range)))
+        return constraints
+
+    def __type_pairs(self, pairs, t):
+        # type: (dict, str) -> set
+        all_types = self.__closure(self.__supers, t).union([t])
+        return reduce(lambda x, y: x.union(pairs.get(y, [])), all_types, set([]))
+
+    def get_type_properties(self, t):
+        # type: (str) -> set
+        return self.__type_pairs(self.__class_props, t)
+
+    def get_type_specific_properties(self, t):
+        # type: (str) -> set
+        return set(self.__class_props.get(t, []))
+
+    def get_type_references(self, t):
+        # type: (str) -> set
+        return self.__type_pairs(self.__class_refs, t)
+
+    def get_type_specific_references(self, t):
+        # type: (str) -> set
+        return set(self.__class_refs.get(t, []))
 
 
 def _context(f):
@@ -453,6 +349,7 @@ class Schema(object):
         self.__graph = None
         self.__namespaces = {}
         self.__prefixes = {}
+        self.__closures = {}
 
     @property
     def cache(self):
@@ -492,9 +389,23 @@ class Schema(object):
         self.__clear_cache()
 
     def __clear_cache(self):
+        self.__closures = {}
         if self.__cache is not None:
             self.__cache.clear()
 
+    def closure(self, context=None):
+        # type: (object) -> SchemaClosure
+        """
+        :return: The closure of the whole schema or of one of its contexts (built once until the schema changes)
+        """
+        if isinstance(context, ContextGraph):
+            return SchemaClosure(context)
+
+        closures = self.__closures
+        if context not in closures:
+            closures[context] = SchemaClosure(self.graph.get_context(context) if context is not None else self.graph)
+        return closures[context]
+
     @property
     def contexts(self):
         # type: () -> iter
@@ -509,82 +420,69 @@ class Schema(object):
         # type: () -> dict
         return dict([(prefix, uri) for (prefix, uri) in self.__graph.namespaces()])
 
-    @_context
     def get_types(self, context=None):
         # type: (object) -> iter
-        if not isinstance(context, ContextGraph):
-            context = self.graph.get_context(context) if context is not None else self.graph
-        return _get_types(context)
+        return self.closure(context).types
 
-    @_context
     def get_properties(self, context=None):
         # type: (object) -> iter
-        if not isinstance(context, ContextGraph):
-            context = self.graph.get_context(context) if context is not None else self.graph
-        return _get_properties(context)
+        return self.closure(context).properties
 
-    @_context
     def is_object_property(self, p):
-        # type: (str, Graph) -> bool
-        return _is_object_property(self.graph, p)
+        # type: (str) -> bool
+        return self.closure().is_object_property(p)
 
-    @_context
     def get_property_domain(self, p):
-        # type: (str, Graph) -> iter
-        return _get_property_domain(self.graph, p)
+        # type: (str) -> iter
+        return self.closure().get_property_domain(p)
 
-    @_context
     def get_property_range(self, p):
-        # type: (str, Graph) -> iter
-        return _get_property_range(self.graph, p)
+        # type: (str) -> iter
+        return self.closure().get_property_range(p)
 
-    @_context
     def get_property_inverses(self, p):
-        # type: (str, Graph) -> iter
-        return _get_property_inverses(self.graph, p)
+        # type: (str) -> iter
+        return self.closure().get_property_inverses(p)
 
-    @_context
     def get_property_constraints(self, p):
-        # type: (str, Graph) -> iter
-        return _get_property_constraints(self.graph, p)
+        # type: (str) -> iter
+        return self.closure().get_property_constraints(p)
 
-    @_context
     def get_supertypes(self, t):
-        # type: (str, Graph) -> iter
-        return _get_supertypes(self.graph, t)
+        # type: (str) -> iter
+        return self.closure().get_supertypes(t)
 
-    @_context
     def get_subtypes(self, t):
-        # type: (str, Graph) -> iter
-        return _get_subtypes(self.graph, t)
+        # type: (str) -> iter
+        return self.closure().get_subtypes(t)
 
-    @_context
     def get_type_properties(self, t):
-        # type: (str, Graph) -> iter
-        refs = _get_type_references(self.graph, t)
-        ref_invs = reduce(lambda x, y: x.union(set(_get_property_inverses(self.graph, y))), refs, set())
-        return _get_type_properties(self.graph, t).union(ref_invs)
+        # type: (str) -> iter
+        closure = self.closure()
+        refs = closure.get_type_references(t)
+        ref_invs = reduce(lambda x, y: x.union(closure.get_property_inverses(y)), refs, set())
+        return closure.get_type_properties(t).union(ref_invs)
 
-    @_context
     def get_type_specific_properties(self, t):
-        # type: (str, Graph) -> iter
-        spec_refs = _get_type_specific_references(self.graph, t)
-        ref_invs = reduce(lambda x, y: x.union(set(_get_property_inverses(self.graph, y))), spec_refs, set())
-        return _get_type_specific_properties(self.graph, t).union(ref_invs)
+        # type: (str) -> iter
+        closure = self.closure()
+        spec_refs = closure.get_type_specific_references(t)
+        ref_invs = reduce(lambda x, y: x.union(closure.get_property_inverses(y)), spec_refs, set())
+        return closure.get_type_specific_properties(t).union(ref_invs)
 
-    @_context
     def get_type_references(self, t):
-        # type: (str, Graph) -> iter
-        props = _get_type_properties(self.graph, t)
-        prop_invs = reduce(lambda x, y: x.union(set(_get_property_inverses(self.graph, y))), props, set())
-        return _get_type_references(self.graph, t).union(prop_invs)
+        # type: (str) -> iter
+        closure = self.closure()
+        props = closure.get_type_properties(t)
+        prop_invs = reduce(lambda x, y: x.union(closure.get_property_inverses(y)), props, set())
+        return closure.get_type_references(t).union(prop_invs)
 
-    @_context
     def get_type_specific_references(self, t):
-        # type: (str, Graph) -> iter
-        spec_props = _get_type_specific_properties(self.graph, t)
-        prop_invs = reduce(lambda x, y: x.union(set(_get_property_inverses(self.graph, y))), spec_props, set())
-        return _get_type_specific_references(self.graph, t).union(prop_invs)
+        # type: (str) -> iter
+        closure = self.closure()
+        spec_props = closure.get_type_specific_properties(t)
+        prop_invs = reduce(lambda x, y: x.union(closure.get_property_inverses(y)), spec_props, set())
+        return closure.get_type_specific_references(t).union(prop_invs)
 
     @_context
     def __query(self, g, q):
@@ -21,12 +21,15 @@
 
 import base64
 import collections
+import hashlib
+import json
 import logging
+import re
 
 import redis
 from rfc3987 import parse
 
-from agora.engine.fountain.index import Index
+from agora.engine.fountain.index import Index, IndexSnapshot, _is_type
 from agora.engine.utils.cache import Cache
 
 __author__ = 'Fernando Serena'
@@ -48,16 +51,44 @@ class SeedManager(object):
     def index(self, i):
         self.__index = i
         self.__cache.watch(self.__index.schema.cache)
+        if not self.__index.r.exists(SEED_DIGESTS_KEY):
+            _rebuild_seed_digests(self.__index)
+
+    def __supers(self, ty):
+        # type: (str) -> list
+        try:
+            return self.__index.get_type(ty)['super']
+        except TypeError:
+            return []
 
     def add_seed(self, uri, type):
         # type: (str, str) -> str
-        sid = _add_seed(self.__index.r, uri, type)
+        sid = _add_seed(self.__index.r, uri, type, supers=self.__supers(type))
         self.__cache.clear()
         return sid
 
+    def add_seeds(self, seeds):
+        # type: (iter) -> dict
+        types = set(self.__index.types)
+        supers = {}
+
+        def type_supers(ty):
+            if ty not in supers:
+                supers[ty] = [t for t in self.__supers(ty) if t != ty]
+            return supers[ty]
+
+        try:
+            return _add_seeds(self.__index.r, seeds, types, type_supers)
+        finally:
+            self.__cache.clear()
+
     def delete_seed(self, sid):
         # type: (str) -> None
-        _delete_seed(self.__index.r, sid)
+        try:
+            ty = base64.b64decode(sid).split('|')[0]
+        except TypeError as e:
+            raise InvalidSeedError(e.message)
+        _delete_seed(self.__index.r, sid, supers=self.__supers(ty))
         self.__cache.clear()
 
     def get_seed(self, sid):
@@ -66,7 +97,7 @@ class SeedManager(object):
 
     def delete_type_seeds(self, type):
         # type: (str) -> None
-        _delete_type_seeds(self.__index.r, type)
+        _delete_type_seeds(self.__index.r, type, supers=self.__supers(type))
         self.__cache.clear()
 
     @property
@@ -78,12 +109,28 @@ class SeedManager(object):
         # type: (str) -> iter
         return _get_type_seeds(self.__index, type)
 
-    def validate(self):
-        seed_dict = self.seeds
-        types = self.__index.types
-        obsolete_types = set.difference(set(seed_dict.keys()), set(types))
-        for t in obsolete_types:
-            self.delete_type_seeds(t)
+    def get_type_seed_digest(self, type):
+        # type: (str) -> str
+        return _get_type_seed_digest(self.__index.r, type)
+
+    def validate(self, snapshot=None):
+        # type: (IndexSnapshot) -> None
+        """
+        Drops the seeds of types that are gone and rebuilds the digests of those whose hierarchy changed
+        :param snapshot: The index snapshot before the change (if not given, every type is revised)
+        """
+        if snapshot is None:
+            types = None
+            seed_types = set([st.replace('seeds:', '', 1) for st in self.__index.r.scan_iter('seeds:*')])
+        else:
+            types = _hierarchy_changes(snapshot, self.__index.snapshot)
+            seed_types = types
+        current_types = set(self.__index.types)
+        for t in seed_types:
+            if t not in current_types:
+                self.delete_type_seeds(t)
+        _rebuild_seed_digests(self.__index, types)
+        self.__cache.clear()
 
 
 class DuplicateSeedError(Exception):
@@ -94,26 +141,260 @@ class InvalidSeedError(Exception):
     pass
 
 
-def _add_seed(r, uri, ty):
-    # type: (redis.StrictRedis, str, str) -> str
+# Hash of type -> digest of the seeds of the type and its subtypes
+SEED_DIGESTS_KEY = 'seed_digests'
+
+# Hashes of seed -> number of types (the given one and its subtypes) that have it
+SEED_REFS_PREFIX = 'seed_refs:'
+
+# Adds (ARGV[3] = 1) or removes (ARGV[3] = -1) a seed of the type in KEYS[1], keeping the digests of the type and
+# its supertypes (ARGV[4..]) in line. A seed counts once per type, no matter how many subtypes have it
+_update_seed_script = """
+local changed
+if ARGV[3] == '1' then
+    changed = redis.call('SADD', KEYS[1], ARGV[1])
+else
+    changed = redis.call('SREM', KEYS[1], ARGV[1])
+end
+if changed == 0 then
+    return 0
+end
+local h = redis.sha1hex(ARGV[1])
+for i = 4, #ARGV do
+    local refs = redis.call('HINCRBY', ARGV[2] .. ARGV[i], ARGV[1], ARGV[3])
+    if refs <= 0 then
+        redis.call('HDEL', ARGV[2] .. ARGV[i], ARGV[1])
+    end
+    if (ARGV[3] == '1' and refs == 1) or (ARGV[3] ~= '1' and refs == 0) then
+        local digest = redis.call('HGET', KEYS[2], ARGV[i]) or string.rep('0', 40)
+        local words = {}
+        for j = 1, 40, 8 do
+            local w = bit.bxor(tonumber(string.sub(digest, j, j + 7), 16), tonumber(string.sub(h, j, j + 7), 16))
+            table.insert(words, bit.tohex(w, 8))
+        end
+        redis.call('HSET', KEYS[2], ARGV[i], table.concat(words))
+    end
+end
+return 1
+"""
+
+
+# Bulk version of the script above for the seeds of a type: adds the seeds in ARGV[3 + ARGV[2]..] to the type in
+# KEYS[1] and keeps the digests of the type and its supertypes (ARGV[3..2 + ARGV[2]]) in line, writing each once
+_add_seeds_script = """
+local n = tonumber(ARGV[2])
+local acc = {}
+for i = 1, n do
+    acc[i] = {0, 0, 0, 0, 0}
+end
+local changed = {}
+local added = 0
+for k = n + 3, #ARGV do
+    if redis.call('SADD', KEYS[1], ARGV[k]) == 1 then
+        added = added + 1
+        local h
+        for i = 1, n do
+            if redis.call('HINCRBY', ARGV[1] .. ARGV[i + 2], ARGV[k], 1) == 1 then
+                h = h or redis.sha1hex(ARGV[k])
+                for w = 1, 5 do
+                    acc[i][w] = bit.bxor(acc[i][w], tonumber(string.sub(h, w * 8 - 7, w * 8), 16))
+                end
+                changed[i] = true
+            end
+        end
+    end
+end
+for i = 1, n do
+    if changed[i] then
+        local digest = redis.call('HGET', KEYS[2], ARGV[i + 2]) or string.rep('0', 40)
+        local words = {}
+        for w = 1, 5 do
+            local x = bit.bxor(tonumber(string.sub(digest, w * 8 - 7, w * 8), 16), acc[i][w])
+            table.insert(words, bit.tohex(x, 8))
+        end
+        redis.call('HSET', KEYS[2], ARGV[i + 2], table.concat(words))
+    end
+end
+return added
+"""
+
+# Bulk removal of all the seeds of the type in KEYS[1], the counterpart of the script above: the digests of the
+# type and its supertypes (ARGV[3..2 + ARGV[2]]) are written once (dropped when empty) and the seed set is
+# deleted in the same call
+_delete_type_seeds_script = """
+local n = tonumber(ARGV[2])
+local acc = {}
+for i = 1, n do
+    acc[i] = {0, 0, 0, 0, 0}
+end
+local changed = {}
+local seeds = redis.call('SMEMBERS', KEYS[1])
+for _, seed in ipairs(seeds) do
+    local h
+    for i = 1, n do
+        local refs = redis.call('HINCRBY', ARGV[1] .. ARGV[i + 2], seed, -1)
+        if refs <= 0 then
+            redis.call('HDEL', ARGV[1] .. ARGV[i + 2], seed)
+        end
+        if refs == 0 then
+            h = h or redis.sha1hex(seed)
+            for w = 1, 5 do
+                acc[i][w] = bit.bxor(acc[i][w], tonumber(string.sub(h, w * 8 - 7, w * 8), 16))
+            end
+            changed[i] = true
+        end
+    end
+end
+for i = 1, n do
+    if changed[i] then
+        local digest = redis.call('HGET', KEYS[2], ARGV[i + 2]) or string.rep('0', 40)
+        local words = {}
+        for w = 1, 5 do
+            local x = bit.bxor(tonumber(string.sub(digest, w * 8 - 7, w * 8), 16), acc[i][w])
+            table.insert(words, bit.tohex(x, 8))
+        end
+        digest = table.concat(words)
+        if digest == string.rep('0', 40) then
+            redis.call('HDEL', KEYS[2], ARGV[i + 2])
+        else
+            redis.call('HSET', KEYS[2], ARGV[i + 2], digest)
+        end
+    end
+end
+redis.call('DEL', KEYS[1])
+return #seeds
+"""
+
+# Media types of seed streams: one JSON object ({"uri": ..., "type": ...}) or one rdf:type triple per line
+NDJSON = 'application/x-ndjson'
+NTRIPLES = 'application/n-triples'
+
+_rdf_type = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+_triple_pattern = re.compile(r'^<([^>]*)>\s+<([^>]*)>\s+(.*?)\s*\.$')
+
+
+def seed_digest(seeds):
+    # type: (iter) -> str
+    """
+    Order-independent digest of a set of seeds (XOR of the SHA-1 of each encoded seed), the same that is
+    incrementally kept for each type
+    """
+    digest = 0
+    for seed in set(seeds):
+        if isinstance(seed, unicode):
+            seed = seed.encode('utf-8')
+        digest ^= int(hashlib.sha1(base64.b64encode(seed)).hexdigest(), 16)
+    return '{:040x}'.format(digest)
+
+
+def _update_seed(r, ty, encoded_uri, delta, supers):
+    # type: (redis.StrictRedis, str, str, int, iter) -> bool
+    types = [ty] + [t for t in supers if t != ty]
+    update = r.register_script(_update_seed_script)
+    return bool(update(keys=['seeds:{}'.format(ty), SEED_DIGESTS_KEY],
+                       args=[encoded_uri, SEED_REFS_PREFIX, delta] + types))
+
+
+def _add_seed(r, uri, ty, supers=()):
+    # type: (redis.StrictRedis, str, str, iter) -> str
     parse(uri, rule='URI')
-    type_found = False
-    type_keys = r.keys('*:types')
-    for tk in type_keys:
-        if r.sismember(tk, ty):
-            type_found = True
-            encoded_uri = base64.b64encode(uri)
-            if r.sismember('seeds:{}'.format(ty), encoded_uri):
-                raise DuplicateSeedError('{} is already registered as a seed of type {}'.format(uri, ty))
-            r.sadd('seeds:{}'.format(ty), base64.b64encode(uri))
-            break
-
-    if not type_found:
+    if not _is_type(r, ty):
         raise TypeError("{} is not a valid type".format(ty))
 
+    encoded_uri = base64.b64encode(uri)
+    if not _update_seed(r, ty, encoded_uri, 1, supers):
+        raise DuplicateSeedError('{} is already registered as a seed of type {}'.format(uri, ty))
+
     return base64.b64encode('{}|{}'.format(ty, uri))
 
 
+def _add_seeds(r, seeds, types, supers, batch_size=10000):
+    # type: (redis.StrictRedis, iter, set, callable, int) -> dict
+    """
+    Bulk version of _add_seed: seeds are checked against the given set of types and written in pipelined
+    batches, each one atomically (with its counters and digests) as in _update_seed
+    :param supers: Function that gives the supertypes of a type
+    :return: The number of added, duplicated and invalid seeds, and the first errors
+    """
+    result = {'added': 0, 'duplicated': 0, 'invalid': 0, 'errors': []}
+    add = r.register_script(_add_seeds_script)
+
+    def flush(batch):
+        with r.pipeline(transaction=False) as pipe:
+            for ty, encoded_uris in batch.items():
+                types = [ty] + supers(ty)
+                add(keys=['seeds:{}'.format(ty), SEED_DIGESTS_KEY],
+                    args=[SEED_REFS_PREFIX, len(types)] + types + encoded_uris, client=pipe)
+            added = sum(pipe.execute())
+        result['added'] += added
+        result['duplicated'] += sum(map(len, batch.values())) - added
+
+    batch = collections.defaultdict(list)
+    n_batch = 0
+    for seed in seeds:
+        try:
+            if isinstance(seed, InvalidSeedError):
+                raise seed
+            uri, ty = seed
+            parse(uri, rule='URI')
+            if ty not in types:
+                raise TypeError("{} is not a valid type".format(ty))
+        except (ValueError, TypeError, InvalidSeedError) as e:
+            result['invalid'] += 1
+            if len(result['errors']) < 100:
+                result['errors'].append(e.message)
+            continue
+
+        if isinstance(uri, unicode):
+            uri = uri.encode('utf-8')
+        batch[ty].append(base64.b64encode(uri))
+        n_batch += 1
+        if n_batch == batch_size:
+            flush(batch)
+            batch = collections.defaultdict(list)
+            n_batch = 0
+    if batch:
+        flush(batch)
+
+    return result
+
+
+def read_seeds(lines, format=NDJSON, prefixes=None):
+    # type: (iter, str, dict) -> iter
+    """
+    Reads (uri, type) seed pairs from a stream of lines. Types of N-Triples seeds are given back as prefixed
+    names when any of the prefixes matches. Malformed lines are given back as InvalidSeedError instances, so
+    that they are reported (and skipped) along with the rest of invalid seeds
+    """
+
+    def type_name(uri):
+        for prefix, ns in (prefixes or {}).items():
+            local = uri[len(ns):]
+            if ns and uri.startswith(ns) and local and '/' not in local and '#' not in local:
+                return '{}:{}'.format(prefix, local)
+        return '<{}>'.format(uri)
+
+    def read(line):
+        if format == NTRIPLES:
+            s, p, o = _triple_pattern.match(line).groups()
+            if p == _rdf_type:
+                return s, type_name(o.lstrip('<').rstrip('>'))
+        else:
+            seed = json.loads(line)
+            return seed['uri'], seed['type']
+
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            seed = read(line)
+        except (AttributeError, ValueError, KeyError, TypeError):
+            seed = InvalidSeedError('Malformed seed at line {}'.format(n))
+        if seed is not None:
+            yield seed
+
+
 def _get_seed(r, sid):
     # type: (redis.StrictRedis, str) -> dict
     try:
@@ -126,21 +407,75 @@ def _get_seed(r, sid):
     raise InvalidSeedError(sid)
 
 
-def _delete_seed(r, sid):
-    # type: (redis.StrictRedis, str) -> None
+def _delete_seed(r, sid, supers=()):
+    # type: (redis.StrictRedis, str, iter) -> None
     try:
         ty, uri = base64.b64decode(sid).split('|')
-        set_key = 'seeds:{}'.format(ty)
         encoded_uri = base64.b64encode(uri)
-        if not r.srem(set_key, encoded_uri):
+        if not _update_seed(r, ty, encoded_uri, -1, supers):
             raise InvalidSeedError(sid)
-    except TypeError as e:
+    except (ValueError, TypeError) as e:
         raise InvalidSeedError(e.message)
 
 
-def _delete_type_seeds(r, ty):
-    # type: (redis.StrictRedis, str) -> None
-    r.delete('seeds:{}'.format(ty))
+def _delete_type_seeds(r, ty, supers=()):
+    # type: (redis.StrictRedis, str, iter) -> int
+    types = [ty] + [t for t in supers if t != ty]
+    delete = r.register_script(_delete_type_seeds_script)
+    return delete(keys=['seeds:{}'.format(ty), SEED_DIGESTS_KEY], args=[SEED_REFS_PREFIX, len(types)] + types)
+
+
+def _get_type_seed_digest(r, ty):
+    # type: (redis.StrictRedis, str) -> str
+    return r.hget(SEED_DIGESTS_KEY, ty) or seed_digest([])
+
+
+def _hierarchy_changes(old, new):
+    # type: (IndexSnapshot, IndexSnapshot) -> set
+    """
+    :return: The types that were added or removed between two index snapshots, or whose subtypes changed
+    """
+    changed = set.symmetric_difference(set(old.types), set(new.types))
+    for t in set.intersection(set(old.types), set(new.types)):
+        if set(old.get_type(t)['sub']) != set(new.get_type(t)['sub']):
+            changed.add(t)
+    return changed
+
+
+def _rebuild_seed_digests(index, types=None):
+    # type: (Index, iter) -> None
+    """
+    Calculates again the seed digests and counters of the given types (all of them by default) from the seeds
+    of each type and its subtypes
+    """
+    r = index.r
+    current_types = set(index.types)
+    if types is None:
+        types = current_types
+        stale = set(r.hkeys(SEED_DIGESTS_KEY))
+    else:
+        types = set(types)
+        stale = types
+    hierarchy = {ty: [ty] + index.get_type(ty)['sub'] for ty in types.intersection(current_types)}
+    seed_types = list(reduce(set.union, map(set, hierarchy.values()), set([])))
+    with r.pipeline(transaction=False) as pipe:
+        for ty in seed_types:
+            pipe.smembers('seeds:{}'.format(ty))
+        type_seeds = dict(zip(seed_types, pipe.execute()))
+
+    with r.pipeline() as pipe:
+        for ty in stale:
+            pipe.delete(SEED_REFS_PREFIX + ty)
+            pipe.hdel(SEED_DIGESTS_KEY, ty)
+        for ty, hierarchy_types in hierarchy.items():
+            refs = collections.Counter()
+            for t in hierarchy_types:
+                refs.update(type_seeds[t])
+            if refs:
+                pipe.delete(SEED_REFS_PREFIX + ty)
+                pipe.hmset(SEED_REFS_PREFIX + ty, refs)
+                pipe.hset(SEED_DIGESTS_KEY, ty, seed_digest([base64.b64decode(s) for s in refs]))
+        pipe.execute()
 
 
 def _get_seeds(r):
@@ -19,6 +19,7 @@
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
 """
 
+import hashlib
 import logging
 import re
 import traceback
@@ -237,6 +238,89 @@ class AGP(set):
         else:
             return dict()
 
+    def containment(self, other):
+        # type: (AGP) -> tuple
+        """
+        Looks for a one-to-one correspondence of the triple patterns of another graph pattern with a subset
+        of the ones in this graph pattern (same predicates and constants, consistent variables)
+        :return: If there is any, a tuple with the variable mapping (ours to theirs) and our matching triple patterns
+        """
+        if not isinstance(other, AGP) or len(other) > len(self):
+            return None
+
+        mine = list(self)
+        # Most constrained patterns first
+        theirs = sorted(other, key=lambda tp: len(filter(lambda x: not isinstance(x, Variable), tp)), reverse=True)
+
+        def bind(mapping, a, b):
+            if isinstance(a, Variable) != isinstance(b, Variable):
+                return None
+            if not isinstance(a, Variable):
+                return mapping if a == b else None
+            if a in mapping:
+                return mapping if mapping[a] == b else None
+            if b in mapping.values():
+                return None
+            mapping = mapping.copy()
+            mapping[a] = b
+            return mapping
+
+        def search(i, mapping, used):
+            if i == len(theirs):
+                return mapping, used
+            for j, my_tp in enumerate(mine):
+                if j in used:
+                    continue
+                tp_mapping = mapping
+                for a, b in zip(my_tp, theirs[i]):
+                    tp_mapping = bind(tp_mapping, a, b)
+                    if tp_mapping is None:
+                        break
+                if tp_mapping is not None:
+                    found = search(i + 1, tp_mapping, used.union([j]))
+                    if found is not None:
+                        return found
+            return None
+
+        result = search(0, {}, frozenset())
+        if result is not None:
+            mapping, used = result
+            return mapping, set([mine[j] for j in used])
+
+    @property
+    def signature(self):
+        # type: () -> str
+        """
+        Canonical signature of the wire graph (Weisfeiler-Lehman refinement of node and edge labels).
+        It does not depend on variable names, so isomorphic graph patterns always share it
+        :return: A hex digest
+        """
+        w = self.wire
+
+        def digest(parts):
+            return hashlib.md5(u'|'.join(parts).encode('utf-8')).hexdigest()
+
+        def edge_label(data):
+            return u' '.join([data['link'].n3()] + ([data['to'].n3()] if 'to' in data else []))
+
+        labels = {n: data['filter'].n3() if 'filter' in data else u'' for n, data in w.nodes(data=True)}
+        n_classes = len(set(labels.values()))
+        for _ in range(len(labels)):
+            new_labels = {}
+            for n in labels:
+                out_edges = sorted(u'>{} {}'.format(edge_label(data), labels[o])
+                                   for _, o, data in w.out_edges(n, data=True))
+                in_edges = sorted(u'<{} {}'.format(edge_label(data), labels[sn])
+                                  for sn, _, data in w.in_edges(n, data=True))
+                new_labels[n] = digest([labels[n]] + out_edges + in_edges)
+            labels = new_labels
+            new_n_classes = len(set(labels.values()))
+            if new_n_classes == n_classes:
+                break
+            n_classes = new_n_classes
+
+        return digest(sorted(labels.values()))
+
     def __eq__(self, other):
         # type: (AGP) ->  bool
         """
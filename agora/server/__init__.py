@@ -215,7 +215,7 @@ class Client(object):
 
     def _get_request(self, path, accept='application/json'):
         try:
-            stream = accept == 'application/agora-quad'
+            stream = accept.startswith('application/agora-quad')
             response = requests.get(urlparse.urljoin(self.host, path, allow_fragments=True).replace('#', '%23'),
                                     headers={'Accept': accept},
                                     stream=stream)
@@ -226,6 +226,8 @@ class Client(object):
                     message = response.content
                 raise IOError({'code': response.status_code, 'text': message})
             if stream:
+                if accept == 'application/agora-quad-bin':
+                    return response.iter_content(chunk_size=4096)
                 return response.iter_lines()
             if accept == 'application/json':
                 return response.json()
@@ -18,16 +18,18 @@
   limitations under the License.
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
 """
+import json
 import logging
 from threading import Lock
 
 from flask import request
+from flask_negotiate import consumes
 from rdflib import URIRef
 from shortuuid import uuid
 
 from agora.engine.fountain import AbstractFountain
 from agora.engine.fountain.onto import VocabularyNotFound, DuplicateVocabulary, VocabularyError
-from agora.engine.fountain.seed import InvalidSeedError, DuplicateSeedError
+from agora.engine.fountain.seed import InvalidSeedError, DuplicateSeedError, read_seeds, NDJSON, NTRIPLES
 from agora.server import Server, APIError, Conflict, TURTLE, NotFound, Client, HTML, tuples_force_seed, JSON, \
     dict_force_seed
 
@@ -96,6 +98,13 @@ def build(fountain, server=None, import_name=__name__):
         except DuplicateSeedError as e:
             raise Conflict(e.message)
 
+    @server.route('/seeds/bulk', methods=['POST'])
+    @consumes(NDJSON, NTRIPLES)
+    def add_seeds():
+        # The request body is streamed, not loaded at once
+        seeds = read_seeds(request.stream, format=request.mimetype, prefixes=fountain.prefixes)
+        return server.response(fountain.add_seeds(seeds))
+
     @server.get('/paths/<string:elm>')
     def get_paths(elm):
         force_seed = request.args.getlist('force_seed', None)
@@ -262,6 +271,10 @@ class FountainClient(Client, AbstractFountain):
                                       content_type='application/json')
         return response
 
+    def add_seeds(self, seeds):
+        data = '\n'.join(json.dumps({'uri': uri, 'type': type}) for uri, type in seeds)
+        return self._post_request('seeds/bulk', data, content_type=NDJSON)
+
     def connected(self, source, target):
         url = 'paths/{}'.format(target)
         url += '?force_seed={}'.format(source)
@@ -27,10 +27,10 @@ from contextlib import closing
 from datetime import datetime
 from threading import Thread
 
-from flask import request
+from flask import request, url_for
 
 from agora import Agora
-from agora.collector import triplify
+from agora.collector import encode_quad_record, decode_quad_records
 from agora.engine.plan import AGP
 from agora.engine.plan.agp import TP
 from agora.engine.utils import Semaphore
@@ -50,13 +50,17 @@ def build(agora, server=None, import_name=__name__, fragment_function=None):
     fragment_function = agora.fragment_generator if fragment_function is None else fragment_function
 
     @server.get('/fragment',
-                produce_types=('text/n3', 'application/agora-quad', 'application/agora-quad-min', 'text/html'))
+                produce_types=('text/n3', 'application/agora-quad', 'application/agora-quad-min',
+                               'application/agora-quad-bin', 'text/html'))
     def get_fragment():
         def gen_thread(status):
             try:
                 first = True
                 min_quads = '-min' in best_mime
-                if best_mime.startswith('application/agora-quad'):
+                if best_mime == 'application/agora-quad-bin':
+                    for c, s, p, o in generator:
+                        queue.put(encode_quad_record(c, s, p, o))
+                elif best_mime.startswith('application/agora-quad'):
                     for c, s, p, o in generator:
                         if min_quads:
                             quad = u'{}·{}·{}·{}\n'.format(c, s.n3(plan.namespace_manager),
@@ -97,6 +101,14 @@ def build(agora, server=None, import_name=__name__, fragment_function=None):
             stop_event = Semaphore()
             query = request.args.get('query', None)
             kwargs = dict(request.args.items())
+            paged = 'cursor' in kwargs or 'limit' in kwargs
+            if paged:
+                try:
+                    kwargs['limit'] = min(int(kwargs.get('limit', 1000)), 10000)
+                except ValueError:
+                    raise APIError('Invalid limit')
+                if kwargs['limit'] < 1:
+                    raise APIError('Invalid limit')
             if query is not None:
 
                 del kwargs['query']
@@ -123,6 +135,12 @@ def build(agora, server=None, import_name=__name__, fragment_function=None):
             stream_th.daemon = False
             stream_th.start()
 
+            if paged and fragment_dict.get('cursor', None) is not None:
+                next_args = dict(request.args.items())
+                next_args.update(cursor=fragment_dict['cursor'], limit=kwargs['limit'])
+                next_url = url_for('get_fragment', _external=True, **next_args)
+                return gen_queue(request_status), {'Link': '<{}>; rel="next"'.format(next_url)}
+
             return gen_queue(request_status)
         except Exception, e:
             traceback.print_exc()
@@ -137,20 +155,16 @@ class FragmentClient(Client):
 
     def fragment(self, query):
         # type: (str) -> iter
-        quads_gen = self._get_request('fragment?query={}'.format(query), accept='application/agora-quad')
+        quads_gen = self._get_request('fragment?query={}'.format(query), accept='application/agora-quad-bin')
         with closing(quads_gen) as gen:
-            for quad in gen:
-                quad = str(tuple(quad.split('\xc2\xb7')))
-                tp_str, s, p, o = triplify(quad)
+            for tp_str, s, p, o in decode_quad_records(gen):
                 yield TP.from_string(tp_str), s, p, o
 
     def agp_fragment(self, agp):
         # type: (AGP) -> iter
-        quads_gen = self._get_request('fragment?agp=%s' % agp, accept='application/agora-quad')
+        quads_gen = self._get_request('fragment?agp=%s' % agp, accept='application/agora-quad-bin')
         with closing(quads_gen) as gen:
-            for quad in gen:
-                quad = str(tuple(quad.split('\xc2\xb7')))
-                tp_str, s, p, o = triplify(quad)
+            for tp_str, s, p, o in decode_quad_records(gen):
                 yield TP.from_string(tp_str), s, p, o
 
 
@@ -35,7 +35,7 @@ from agora.collector import triplify
 from agora.engine.plan import AGP
 from agora.engine.plan.agp import TP
 from agora.engine.plan.graph import AGORA
-from agora.server import Server, APIError, Client
+from agora.server import Server, APIError, Client, JSON
 from flask import request, jsonify, url_for
 
 __author__ = 'Fernando Serena'
@@ -51,20 +51,33 @@ def build(cache, server=None, import_name=__name__, fragment_function=None):
 
     @server.get('/resources', produce_types=('text/turtle', 'text/html'))
     def get_resources():
-        store = cache.resource_cache
         uri = request.args.get('uri', None)
         if uri is None:
+            try:
+                limit = min(int(request.args.get('limit', 100)), 1000)
+                if limit < 1:
+                    raise ValueError('Invalid limit')
+                next_cursor, page = cache.list_resources(cursor=request.args.get('cursor', None), count=limit)
+            except ValueError as e:
+                raise APIError(e.message or 'Invalid limit')
+
             g = Graph()
             container_uri = URIRef(url_for('get_resources', _external=True))
-            for c in store.contexts():
-                if isinstance(c.identifier, URIRef):
-                    r_uri = container_uri + '?uri=' + c.identifier
-                    g.add((container_uri, AGORA.hasResource, r_uri))
+            for gid in page:
+                r_uri = container_uri + '?uri=' + gid
+                g.add((container_uri, AGORA.hasResource, r_uri))
+            if next_cursor:
+                next_uri = URIRef(url_for('get_resources', cursor=next_cursor, limit=limit, _external=True))
+                g.add((container_uri, AGORA.nextPage, next_uri))
         else:
-            g = store.get_context(uri)
+            g = cache.resource_cache.get_context(uri)
             if not g:
                 return 'not found'
 
         return g.serialize(format='turtle')
 
+    @server.get('/stats', produce_types=(JSON,))
+    def get_stats():
+        return cache.stats
+
     return server
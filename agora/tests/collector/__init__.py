@@ -0,0 +1,130 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+
+__author__ = 'Fernando Serena'
+
+import logging
+import unittest
+from StringIO import StringIO
+
+from agora import Agora, setup_logging
+from agora.collector.cache import RedisCache
+from agora.collector.scholar import Scholar
+from agora.tests.fountain import HEADER
+
+VOCABULARY = HEADER + """<http://example.org/voc#> a owl:Ontology .
+ex:Person a owl:Class .
+ex:Student a owl:Class ; rdfs:subClassOf ex:Person .
+ex:knows a owl:ObjectProperty ; rdfs:domain ex:Person ; rdfs:range ex:Person .
+ex:name a owl:DatatypeProperty ; rdfs:domain ex:Person .
+"""
+
+PREFIXES = '@prefix ex: <http://example.org/voc#> . '
+
+DATA = {
+    'http://example.org/a': PREFIXES + '<http://example.org/a> a ex:Person ; ex:name "Ann" ; '
+                                       'ex:knows <http://example.org/b> .',
+    'http://example.org/b': PREFIXES + '<http://example.org/b> a ex:Person ; ex:name "Bob" ; '
+                                       'ex:knows <http://example.org/c> .',
+    'http://example.org/c': PREFIXES + '<http://example.org/c> a ex:Person ; ex:name "Carl" .'
+}
+
+
+def load(data, ttl=30):
+    """
+    :return: A resource loader that serves the given turtle documents
+    """
+
+    def loader(uri, format):
+        if uri in data:
+            return StringIO(data[uri]), {'Content-Type': 'text/turtle', 'Cache-Control': 'max-age={}'.format(ttl)}
+        return True
+
+    return loader
+
+
+class CacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        setup_logging(logging.WARNING)
+        cls.cache = RedisCache(persist_mode=False, key_prefix=cls.__name__)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache.close()
+
+    def setUp(self):
+        self.log = logging.getLogger('agora.tests.collector')
+        self.cache.r.flushdb()
+
+    def cache_resources(self, uris, ttl=30):
+        loader = load({uri: '<{}> <http://example.org/voc#name> "x" .'.format(uri) for uri in uris}, ttl=ttl)
+        for uri in uris:
+            self.cache.create(gid=uri, loader=loader, format='text/turtle')
+
+
+class ScholarTest(unittest.TestCase):
+    """
+    Collects fragments of the in-memory DATA documents, seeded from http://example.org/a
+    """
+    data = DATA
+    ttl = 30
+    seeds = [('http://example.org/a', 'ex:Person')]
+    scholar_args = {}
+
+    @classmethod
+    def setUpClass(cls):
+        setup_logging(logging.WARNING)
+        cls.agora = Agora(persist_mode=False)
+        cls.fountain = cls.agora.fountain
+        cls.fountain.add_vocabulary(VOCABULARY)
+        for uri, ty in cls.seeds:
+            cls.fountain.add_seed(uri, ty)
+        cls.cache = RedisCache(persist_mode=False, key_prefix=cls.__name__)
+        cls.scholar = Scholar(id=cls.__name__, planner=cls.agora.planner, cache=cls.cache,
+                              loader=load(cls.data, ttl=cls.ttl), persist_mode=False, **cls.scholar_args)
+        cls.index = cls.scholar.index
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.scholar.shutdown()
+        cls.cache.close()
+        cls.agora.shutdown()
+
+    def setUp(self):
+        self.log = logging.getLogger('agora.tests.collector')
+
+    def agp(self, query):
+        agp, _ = list(self.agora.agp(query))[0]
+        return agp
+
+    def collect(self, query, **kwargs):
+        # type: (str) -> set
+        """
+        :return: The (triple pattern, s, p, o) quads of the fragment of a query
+        """
+        fragment = self.agora.fragment_generator(query=query, collector=self.scholar, **kwargs)
+        return set([(str(c), s, p, o) for c, s, p, o in fragment['generator']])
+
+
+def teardown():
+    # Stops the fragment daemon and any other background thread once all collector tests are done
+    Agora.close()
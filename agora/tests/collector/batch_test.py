@@ -0,0 +1,74 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+from threading import Event, Thread
+from time import sleep, time
+
+from agora.collector.scholar import Fragment
+from agora.tests.collector import DATA, ScholarTest
+
+__author__ = 'Fernando Serena'
+
+QUERY = 'SELECT * WHERE { ?s a <http://example.org/voc#Person> . ?s <http://example.org/voc#knows> ?o }'
+
+released = Event()
+
+
+class StalledData(dict):
+    """
+    Documents whose dereference of http://example.org/c blocks until released
+    """
+
+    def __getitem__(self, uri):
+        if uri == 'http://example.org/c':
+            released.wait(20)
+        return super(StalledData, self).__getitem__(uri)
+
+
+class StalledStreamTest(ScholarTest):
+    data = StalledData(DATA)
+
+    def tearDown(self):
+        released.set()
+
+    def test_flush_stalled_batch(self):
+        self.assertGreater(Fragment.batch_size, 4)
+        quads = []
+        collector = Thread(target=lambda: quads.extend(self.collect(QUERY)))
+        collector.daemon = True
+        collector.start()
+
+        # The batch is not full, but it is flushed while the dereference of c keeps the collection waiting
+        deadline = time() + 10
+        streamed = 0
+        while not streamed and time() < deadline:
+            fragments = self.index.fragments.values()
+            if fragments:
+                streamed = self.index.kv.zcard(fragments[0].stream.key)
+            sleep(0.1)
+        self.assertGreater(streamed, 0)
+        self.assertTrue(collector.is_alive())
+        fragment = self.index.fragments.values()[0]
+        self.assertTrue(fragment.collecting)
+
+        released.set()
+        collector.join(10)
+        self.assertFalse(collector.is_alive())
+        self.assertEqual(len(quads), 4)
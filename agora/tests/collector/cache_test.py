@@ -0,0 +1,172 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+import base64
+import json
+import os
+import tempfile
+
+from agora.server import publish
+from agora.tests.collector import CacheTest
+
+__author__ = 'Fernando Serena'
+
+EX = 'http://example.org/'
+
+
+class ResourceListingTest(CacheTest):
+    def test_pages(self):
+        uris = ['{}r{:02d}'.format(EX, i) for i in range(7)]
+        self.cache_resources(uris)
+
+        listed = []
+        pages = 0
+        cursor = None
+        while True:
+            cursor, page = self.cache.list_resources(cursor=cursor, count=3)
+            pages += 1
+            listed.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(listed, uris)
+        self.assertEqual(pages, 3)
+
+    def test_exact_pages(self):
+        uris = ['{}r{:02d}'.format(EX, i) for i in range(4)]
+        self.cache_resources(uris)
+
+        cursor, page = self.cache.list_resources(count=2)
+        self.assertEqual(page, uris[:2])
+        cursor, page = self.cache.list_resources(cursor=cursor, count=2)
+        self.assertEqual(page, uris[2:])
+        # The last full page still yields a cursor, but it points to an empty page
+        cursor, page = self.cache.list_resources(cursor=cursor, count=2)
+        self.assertEqual(page, [])
+        self.assertIsNone(cursor)
+
+    def test_empty(self):
+        cursor, page = self.cache.list_resources(count=5)
+        self.assertEqual(page, [])
+        self.assertIsNone(cursor)
+
+    def test_invalid_count(self):
+        self.assertRaises(ValueError, self.cache.list_resources, count=0)
+        self.assertRaises(ValueError, self.cache.list_resources, count=-1)
+
+    def test_invalid_limit(self):
+        client = publish.build(self.cache).test_client()
+        for limit in ['0', '-3', 'x']:
+            response = client.get('/resources?limit=' + limit, headers={'Accept': 'text/turtle'})
+            self.assertEqual(response.status_code, 400)
+        response = client.get('/resources?limit=1', headers={'Accept': 'text/turtle'})
+        self.assertEqual(response.status_code, 200)
+
+
+class CacheStatsTest(CacheTest):
+    def test_stats(self):
+        before = self.cache.stats
+        uris = ['{}s{}'.format(EX, i) for i in range(3)]
+        self.cache_resources(uris)
+        self.cache_resources(uris[:1])
+
+        stats = self.cache.stats
+        self.assertEqual(stats['entries'], 3)
+        self.assertGreater(stats['bytes'], 0)
+        self.assertEqual(stats['counters']['misses'] - before['counters']['misses'], 3)
+        self.assertEqual(stats['requests'] - before['requests'], 4)
+        self.assertGreaterEqual(stats['memory']['graphs'], 3)
+
+        client = publish.build(self.cache).test_client()
+        response = client.get('/stats', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['entries'], 3)
+
+
+class SnapshotTest(CacheTest):
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        self.path = tempfile.mktemp(suffix='.snapshot')
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_round_trip(self):
+        uris = ['{}h{}'.format(EX, i) for i in range(3)]
+        self.cache_resources(uris)
+        n_bytes = self.cache.stats['bytes']
+        self.assertEqual(self.cache.snapshot(self.path), 3)
+
+        self.cache.r.flushdb()
+        self.assertEqual(self.cache.restore(self.path), 3)
+        self.assertEqual(self.cache.stats['entries'], 3)
+        self.assertEqual(self.cache.stats['bytes'], n_bytes)
+        self.assertEqual(self.cache.list_resources()[1], uris)
+
+        # Restoring on top of the same entries does not count their size twice
+        self.assertEqual(self.cache.restore(self.path), 3)
+        self.assertEqual(self.cache.stats['bytes'], n_bytes)
+
+    def test_skip_expired(self):
+        self.cache_resources([EX + 'fresh'])
+        self.cache.snapshot(self.path)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'gid': EX + 'stale', 'ttl': 0, 'data': base64.b64encode('x')}) + '\n')
+
+        self.cache.r.flushdb()
+        self.assertEqual(self.cache.restore(self.path), 1)
+        self.assertEqual(self.cache.list_resources()[1], [EX + 'fresh'])
+
+    def test_skip_malformed(self):
+        self.cache_resources([EX + 'fine'])
+        self.cache.snapshot(self.path)
+        with open(self.path, 'a') as f:
+            f.write('not json\n')
+            f.write(json.dumps({'gid': EX + 'no-data', 'ttl': 2 ** 40}) + '\n')
+            f.write(json.dumps({'gid': EX + 'bad-data', 'ttl': 2 ** 40, 'data': 'abc'}) + '\n')
+            f.write(json.dumps([EX + 'not-an-entry']) + '\n')
+
+        self.cache.r.flushdb()
+        self.assertEqual(self.cache.restore(self.path), 1)
+        self.assertEqual(self.cache.list_resources()[1], [EX + 'fine'])
+
+
+class MatchingTest(CacheTest):
+    def setUp(self):
+        super(MatchingTest, self).setUp()
+        self.cache_resources(['http://one.org/a', 'http://one.org/b', 'http://One.org:8080/c', 'http://two.org/a'])
+
+    def test_indexed_authority(self):
+        self.assertEqual(sorted(self.cache.get_matching_uris('one.org')), ['http://one.org/a', 'http://one.org/b'])
+        self.assertEqual(self.cache.get_matching_uris(u'one.org:8080'), ['http://One.org:8080/c'])
+        self.assertEqual(self.cache.get_matching_uris('http://two.org/whatever'), ['http://two.org/a'])
+
+    def test_unindexed_authority(self):
+        self.assertEqual(self.cache.get_matching_uris('three.org'), [])
+        # Substrings of an indexed authority or uri are not matched
+        self.assertEqual(self.cache.get_matching_uris('one'), [])
+        self.assertEqual(self.cache.get_matching_uris('/a'), [])
+
+    def test_expire_matching(self):
+        self.assertEqual(self.cache.expire_matching('one.org'), 2)
+        refreshes = self.cache.stats['counters']['refreshes']
+        self.cache_resources(['http://one.org/a', 'http://two.org/a'])
+        self.assertEqual(self.cache.stats['counters']['refreshes'], refreshes + 1)
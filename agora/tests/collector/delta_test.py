@@ -0,0 +1,72 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+from time import sleep, time
+
+from agora.collector import decode_quad
+from agora.tests.collector import DATA, PREFIXES, ScholarTest
+
+__author__ = 'Fernando Serena'
+
+QUERY = 'SELECT * WHERE { ?s a <http://example.org/voc#Person> . ?s <http://example.org/voc#knows> ?o }'
+
+
+class DeltaTest(ScholarTest):
+    ttl = 2
+    data = dict(DATA)
+
+    def wait_version(self, fragment, version, timeout=20):
+        deadline = time() + timeout
+        while time() < deadline:
+            current = self.index.kv.get('{}:version'.format(fragment.key))
+            if current is not None and int(current) > version:
+                return int(current)
+            sleep(0.2)
+        self.fail('Fragment was not refreshed')
+
+    def test_apply_delta(self):
+        quads = self.collect(QUERY)
+        self.assertEqual(len(quads), 4)
+        fragment = self.index.fragments.values()[0]
+        version = int(self.index.kv.get('{}:version'.format(fragment.key)))
+        before = dict(self.index.kv.zrange(fragment.stream.key, 0, -1, withscores=True))
+
+        self.data['http://example.org/b'] = PREFIXES + '<http://example.org/b> a ex:Person ; ex:name "Bob" ; ' \
+                                                       'ex:knows <http://example.org/d> .'
+        self.cache.expire('http://example.org/b')
+        # Read again, so that it is refreshed once it expires
+        self.collect(QUERY)
+        self.assertEqual(self.wait_version(fragment, version), version + 1)
+
+        after = dict(self.index.kv.zrange(fragment.stream.key, 0, -1, withscores=True))
+        removed = [decode_quad(x)[1:] for x in set(before).difference(after)]
+        added = [decode_quad(x)[1:] for x in set(after).difference(before)]
+        ex = 'http://example.org/'
+        self.assertEqual([tuple(map(str, q)) for q in removed], [(ex + 'b', ex + 'voc#knows', ex + 'c')])
+        self.assertEqual([tuple(map(str, q)) for q in added], [(ex + 'b', ex + 'voc#knows', ex + 'd')])
+        # Unchanged quads were neither removed nor added again
+        for member in set(before).intersection(after):
+            self.assertEqual(before[member], after[member])
+        self.assertFalse(self.index.kv.exists('{}:stream:next'.format(fragment.key)))
+
+        refreshed = self.collect(QUERY)
+        self.assertEqual(set([q[1:] for q in refreshed]).symmetric_difference([q[1:] for q in quads]),
+                         set(removed).union(added))
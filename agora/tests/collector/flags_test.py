@@ -0,0 +1,104 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+from time import sleep, time
+
+from agora.collector import scholar
+from agora.tests.collector import ScholarTest
+
+__author__ = 'Fernando Serena'
+
+QUERY = 'SELECT * WHERE { ?s a <http://example.org/voc#Person> . ?s <http://example.org/voc#knows> ?o }'
+
+
+class CountingKV(object):
+    """
+    Counts the pipelines open on a kv
+    """
+
+    def __init__(self, kv):
+        self.kv = kv
+        self.pipelines = 0
+
+    def pipeline(self, *args, **kwargs):
+        self.pipelines += 1
+        return self.kv.pipeline(*args, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self.kv, item)
+
+
+class FlagsTest(ScholarTest):
+    def setUp(self):
+        super(FlagsTest, self).setUp()
+        self.collect(QUERY)
+        # Read once it is stored, so that it is demanded
+        self.collect(QUERY)
+        self.fragment = self.index.fragments.values()[0]
+        self.kv = self.fragment.kv
+        self.counter = CountingKV(self.kv)
+        self.fragment.kv = self.counter
+        self.channel = '{}:flags'.format(self.fragment.key[:-len(self.fragment.fid) - 1])
+
+    def tearDown(self):
+        self.fragment.kv = self.kv
+
+    def read_flags(self):
+        return (self.fragment.collecting, self.fragment.stored, self.fragment.demanded,
+                self.fragment.newcomer, self.fragment.updated)
+
+    def wait_demanded(self, demanded, timeout=5):
+        deadline = time() + timeout
+        while time() < deadline and self.fragment.demanded != demanded:
+            sleep(0.1)
+        return self.fragment.demanded
+
+    def test_fetched_once(self):
+        self.fragment.invalidate()
+        flags = self.read_flags()
+        self.assertEqual(flags, (False, True, True, False, True))
+        self.assertEqual(self.counter.pipelines, 1)
+        self.read_flags()
+        self.assertEqual(self.counter.pipelines, 1)
+        self.fragment.invalidate()
+        self.assertEqual(self.read_flags(), flags)
+        self.assertEqual(self.counter.pipelines, 2)
+
+    def test_local_changes(self):
+        self.fragment.invalidate()
+        self.read_flags()
+        self.fragment.collecting = True
+        try:
+            self.assertTrue(self.fragment.collecting)
+        finally:
+            self.fragment.collecting = False
+        self.assertFalse(self.fragment.collecting)
+        self.assertEqual(self.counter.pipelines, 1)
+
+    def test_remote_changes(self):
+        self.assertTrue(self.fragment.demanded)
+        # Changed by another process, still cached here
+        self.kv.delete('{}:demanded'.format(self.fragment.key))
+        self.assertTrue(self.fragment.demanded)
+        # Changes published by this process are already cached
+        self.kv.publish(self.channel, '{}|{}'.format(scholar._origin, self.fragment.fid))
+        self.assertTrue(self.wait_demanded(False, timeout=1.5))
+        self.kv.publish(self.channel, '{}|{}'.format('another', self.fragment.fid))
+        self.assertFalse(self.wait_demanded(False))
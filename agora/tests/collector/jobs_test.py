@@ -0,0 +1,84 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+from time import sleep
+
+from agora.collector.scholar import CollectionJobs
+from agora.tests.collector import CacheTest
+
+__author__ = 'Fernando Serena'
+
+
+class CollectionJobsTest(CacheTest):
+    def setUp(self):
+        super(CollectionJobsTest, self).setUp()
+        self.jobs = CollectionJobs(self.cache.r, 'fragments:jobs', lease_ttl=1)
+
+    def test_single_claim(self):
+        self.assertTrue(self.jobs.put('f1'))
+        self.assertEqual(self.jobs.claim('w1'), 'f1')
+        self.assertTrue(self.jobs.leased('f1'))
+        self.assertIsNone(self.jobs.claim('w2'))
+        # Leased jobs cannot be queued again until released
+        self.assertFalse(self.jobs.put('f1'))
+        self.assertIsNone(self.jobs.claim('w2'))
+
+    def test_priority(self):
+        self.jobs.put('f1', priority=2)
+        self.jobs.put('f2', priority=1)
+        self.jobs.put('f3', priority=2)
+        self.assertTrue(self.jobs.put('f3', priority=0))
+        self.assertEqual([self.jobs.claim('w') for _ in range(4)], ['f3', 'f2', 'f1', None])
+
+    def test_release(self):
+        self.jobs.put('f1')
+        self.jobs.claim('w1')
+        self.assertFalse(self.jobs.release('f1', 'w2'))
+        self.assertTrue(self.jobs.leased('f1'))
+        self.assertTrue(self.jobs.release('f1', 'w1'))
+        self.assertFalse(self.jobs.leased('f1'))
+        self.assertTrue(self.jobs.put('f1'))
+        self.assertEqual(self.jobs.claim('w2'), 'f1')
+
+    def test_lease_expiry(self):
+        self.jobs.put('f1')
+        self.assertEqual(self.jobs.claim('w1'), 'f1')
+        self.assertTrue(self.jobs.renew('f1', 'w1'))
+        self.assertFalse(self.jobs.renew('f1', 'w2'))
+        sleep(1.5)
+        # The worker died: its lease is gone and the job can be queued and claimed by another one
+        self.assertFalse(self.jobs.leased('f1'))
+        self.assertFalse(self.jobs.renew('f1', 'w1'))
+        self.assertTrue(self.jobs.put('f1'))
+        self.assertEqual(self.jobs.claim('w2'), 'f1')
+        self.assertFalse(self.jobs.release('f1', 'w1'))
+        self.assertTrue(self.jobs.leased('f1'))
+
+    def test_leased_stay_queued(self):
+        self.jobs.put('f1')
+        self.jobs.put('f2')
+        # A job queued again while being collected (e.g. its fragment expired meanwhile) is not lost
+        self.cache.r.set('fragments:jobs:lease:f1', 'w0', ex=10)
+        self.assertEqual(self.jobs.claim('w1'), 'f2')
+        self.assertEqual(len(self.jobs), 1)
+        self.cache.r.delete('fragments:jobs:lease:f1')
+        self.assertEqual(self.jobs.claim('w1'), 'f1')
+        self.assertEqual(len(self.jobs), 0)
@@ -0,0 +1,90 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+from rdflib import ConjunctiveGraph, URIRef, Variable
+
+from agora.collector.scholar import Fragment
+from agora.engine.plan.agp import AGP
+from agora.tests.collector import CacheTest
+
+__author__ = 'Fernando Serena'
+
+FRAGMENTS_KEY = 'keys:fragments'
+PREFIXES = {'ex': 'http://example.org/voc#'}
+
+
+class ScanCountingKV(object):
+    """
+    Counts the key scans made on a kv
+    """
+
+    def __init__(self, kv):
+        self.kv = kv
+        self.scans = 0
+
+    def scan_iter(self, *args, **kwargs):
+        self.scans += 1
+        return self.kv.scan_iter(*args, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self.kv, item)
+
+
+class KeyRegistryTest(CacheTest):
+    def setUp(self):
+        super(KeyRegistryTest, self).setUp()
+        self.kv = self.cache.r
+        agp = AGP(['?s ex:knows ?o'], prefixes=PREFIXES)
+        self.fragment = Fragment(agp, self.kv, ConjunctiveGraph(), FRAGMENTS_KEY, 'f',
+                                 filters={Variable('o'): {'http://example.org/b'}})
+        with self.kv.pipeline() as pipe:
+            self.fragment.save(pipe)
+            pipe.execute()
+        self.fragment.size = 1
+
+    def fragment_keys(self):
+        return set(self.kv.keys('{}*'.format(self.fragment.key)))
+
+    def test_registry(self):
+        registry = self.kv.smembers('{}:keys'.format(self.fragment.key))
+        self.assertIn('filters:o', registry)
+        self.assertTrue(registry.issuperset(['gp', 'fc', 'stream', 'size', 'version']))
+        # Every key of the fragment is registered
+        prefix = '{}:'.format(self.fragment.key)
+        self.assertTrue(registry.issuperset([k[len(prefix):] for k in self.fragment_keys() - {prefix + 'keys'}]))
+
+    def test_purge(self):
+        self.fragment.stream.put_many([('0', URIRef('http://example.org/a'), URIRef('http://example.org/voc#knows'),
+                                        URIRef('http://example.org/b'))])
+        self.assertTrue(self.fragment_keys())
+        self.fragment.remove()
+        self.assertEqual(self.fragment_keys(), set())
+
+    def test_legacy(self):
+        # Fragments saved before there was a registry
+        self.kv.delete('{}:keys'.format(self.fragment.key))
+        kv = ScanCountingKV(self.kv)
+        for _ in range(2):
+            fragment = Fragment.load(kv, ConjunctiveGraph(), FRAGMENTS_KEY, 'f', prefixes=PREFIXES, shared=True)
+            self.assertEqual(fragment.filters, {Variable('o'): {'http://example.org/b'}})
+        self.assertEqual(kv.scans, 1)
+        self.assertIn('filters:o', self.kv.smembers('{}:keys'.format(self.fragment.key)))
+        fragment.remove()
+        self.assertEqual(self.fragment_keys(), set())
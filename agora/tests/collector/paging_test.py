@@ -0,0 +1,96 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+import urllib
+
+from agora.collector import decode_quad_records
+from agora.collector.scholar import _decode_cursor, _encode_cursor
+from agora.server import fragment
+from agora.tests.collector import ScholarTest
+
+__author__ = 'Fernando Serena'
+
+QUERY = 'SELECT * WHERE { ?s a <http://example.org/voc#Person> . ?s <http://example.org/voc#knows> ?o }'
+
+BIN = 'application/agora-quad-bin'
+
+
+class PagingTest(ScholarTest):
+    def page(self, cursor=None, limit=None):
+        fragment_dict = self.agora.fragment_generator(query=QUERY, collector=self.scholar, cursor=cursor,
+                                                      limit=limit)
+        return set([(str(c), s, p, o) for c, s, p, o in fragment_dict['generator']]), fragment_dict['cursor']
+
+    def test_cursor(self):
+        self.assertEqual(_decode_cursor(_encode_cursor(3, 1000)), (3, 1000))
+        for cursor in ['nope', _encode_cursor(1, -1), '']:
+            self.assertRaises(ValueError, _decode_cursor, cursor)
+
+    def test_pages(self):
+        quads = self.collect(QUERY)
+        self.assertEqual(len(quads), 4)
+
+        first, cursor = self.page(limit=3)
+        self.assertEqual(len(first), 3)
+        self.assertIsNotNone(cursor)
+        last, last_cursor = self.page(cursor=cursor, limit=3)
+        self.assertEqual(len(last), 1)
+        self.assertIsNone(last_cursor)
+        self.assertEqual(first.union(last), quads)
+
+        # An exact fit is the last page too
+        whole, cursor = self.page(limit=4)
+        self.assertEqual(whole, quads)
+        self.assertIsNone(cursor)
+
+    def test_invalid_pages(self):
+        self.collect(QUERY)
+        self.assertRaises(ValueError, self.page, limit=0)
+        self.assertRaises(ValueError, self.page, limit=-1)
+        self.assertRaises(ValueError, self.page, cursor='nope', limit=2)
+        # Cursors are bound to the version of the contents they were issued for
+        _, cursor = self.page(limit=2)
+        version, offset = _decode_cursor(cursor)
+        self.assertRaises(ValueError, self.page, cursor=_encode_cursor(version + 1, offset), limit=2)
+
+    def test_server_pages(self):
+        quads = self.collect(QUERY)
+        client = fragment.build(self.agora, fragment_function=lambda **kwargs: self.agora.fragment_generator(
+            collector=self.scholar, **kwargs)).test_client()
+
+        url = '/fragment?' + urllib.urlencode({'query': QUERY, 'limit': 3})
+        read = set([])
+        pages = 0
+        while url is not None:
+            response = client.get(url, headers={'Accept': BIN})
+            self.assertEqual(response.status_code, 200)
+            read.update([(c, s, p, o) for c, s, p, o in decode_quad_records([response.data])])
+            pages += 1
+            link = response.headers.get('Link', None)
+            url = link[link.index('/fragment'):link.index('>')] if link else None
+            self.assertTrue(link is None or link.endswith('; rel="next"'))
+        self.assertEqual(pages, 2)
+        self.assertEqual(read, quads)
+
+        for limit in ['0', '-1', 'x']:
+            response = client.get('/fragment?' + urllib.urlencode({'query': QUERY, 'limit': limit}),
+                                  headers={'Accept': BIN})
+            self.assertEqual(response.status_code, 400)
@@ -0,0 +1,68 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+import unittest
+
+from rdflib import BNode, Literal, URIRef, XSD
+
+from agora.collector import decode_quad, decode_quad_records, encode_quad, encode_quad_record
+
+__author__ = 'Fernando Serena'
+
+EX = 'http://example.org/'
+
+TP = '?s <http://example.org/voc#name> ?o'
+
+
+class QuadCodecTest(unittest.TestCase):
+    terms = [URIRef(EX + 'a'), URIRef(EX + u'caf\xe9:12:x'), BNode('b1'),
+             Literal('plain'), Literal(''), Literal('12:34:x'), Literal('"quoted" <not an uri>'),
+             Literal('line\nbreak'), Literal(u'se\xf1or'), Literal('Q12:x', lang='en'),
+             Literal('3:^x', datatype=URIRef(EX + 'voc#odd:type')), Literal('42', datatype=XSD.integer)]
+
+    def test_round_trip(self):
+        for o in self.terms:
+            c, s, p, decoded = decode_quad(encode_quad(TP, URIRef(EX + 'a'), URIRef(EX + 'p'), o))
+            self.assertEqual(c, TP)
+            self.assertEqual(decoded, o)
+            self.assertEqual(type(decoded), type(o))
+            if isinstance(o, Literal):
+                self.assertEqual((decoded.language, decoded.datatype), (o.language, o.datatype))
+
+    def test_delimiters_in_context(self):
+        tp = '?s <{}p> "1:2:3"'.format(EX)
+        self.assertEqual(decode_quad(encode_quad(tp, BNode('x'), URIRef(EX + 'p'), Literal('1:2:3')))[0], tp)
+
+    def test_legacy(self):
+        legacy = repr((TP, u'<{}a>'.format(EX), u'<{}p>'.format(EX), u'"Ann"@en'))
+        self.assertEqual(decode_quad(legacy), (TP, URIRef(EX + 'a'), URIRef(EX + 'p'), Literal('Ann', lang='en')))
+
+    def test_truncated(self):
+        x = encode_quad(TP, URIRef(EX + 'a'), URIRef(EX + 'p'), Literal('12:34:x'))
+        for end in [len(x) - 1, len(x) - 8, 10]:
+            self.assertRaises(ValueError, decode_quad, x[:end])
+
+    def test_records(self):
+        quads = [(TP, URIRef(EX + 'a'), URIRef(EX + 'p'), o) for o in self.terms]
+        stream = '\n'.join(encode_quad_record(*q) for q in quads)
+        for size in [1, 3, 7, len(stream)]:
+            chunks = [stream[i:i + size] for i in range(0, len(stream), size)]
+            self.assertEqual(list(decode_quad_records(chunks)), quads)
@@ -0,0 +1,95 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+import unittest
+from time import sleep, time
+
+from agora.collector.scholar import CollectionQueue, FragmentIndex
+from agora.tests.collector import ScholarTest
+
+__author__ = 'Fernando Serena'
+
+
+class CollectionQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = CollectionQueue()
+
+    def drain(self):
+        items = []
+        item = self.queue.get()
+        while item is not None:
+            items.append(item)
+            item = self.queue.get()
+        return items
+
+    def test_priority_order(self):
+        self.queue.put('i', 'f1', priority=(0, 2, 0))
+        self.queue.put('i', 'f2', priority=(0, 0, -3))
+        self.queue.put('i', 'f3', priority=(0, 1, -10.0))
+        self.queue.put('i', 'f4', priority=(0, 0, -5))
+        self.assertEqual([fid for _, fid in self.drain()], ['f4', 'f2', 'f3', 'f1'])
+        self.assertEqual(len(self.queue), 0)
+
+    def test_arrival_order(self):
+        for fid in ['f1', 'f2', 'f3']:
+            self.queue.put('i', fid)
+        self.assertEqual([fid for _, fid in self.drain()], ['f1', 'f2', 'f3'])
+
+    def test_raise_priority(self):
+        self.assertTrue(self.queue.put('i', 'f1', priority=2))
+        self.assertTrue(self.queue.put('i', 'f2', priority=1))
+        self.assertFalse(self.queue.put('i', 'f1', priority=3))
+        self.assertTrue(self.queue.put('i', 'f1', priority=0))
+        self.assertIn(('i', 'f1'), self.queue)
+        self.assertEqual(len(self.queue), 2)
+        # The entry with the former priority is skipped
+        self.assertEqual(self.drain(), [('i', 'f1'), ('i', 'f2')])
+
+    def test_fairness(self):
+        for fid in ['a1', 'a2', 'a3']:
+            self.queue.put('a', fid)
+        self.queue.put('b', 'b1', priority=5)
+        self.queue.put('b', 'b2', priority=5)
+        # Indexes are served in turns, regardless of the priorities of each other's fragments
+        self.assertEqual(self.drain(), [('a', 'a1'), ('b', 'b1'), ('a', 'a2'), ('b', 'b2'), ('a', 'a3')])
+
+    def test_requeue(self):
+        self.queue.put('i', 'f1')
+        self.assertEqual(self.queue.get(), ('i', 'f1'))
+        self.assertNotIn(('i', 'f1'), self.queue)
+        self.assertTrue(self.queue.put('i', 'f1'))
+        self.assertEqual(self.queue.get(), ('i', 'f1'))
+        self.assertIsNone(self.queue.get())
+
+
+class FragmentTimerTest(ScholarTest):
+    ttl = 20
+
+    def test_expiry_timer(self):
+        self.collect('SELECT * WHERE { ?s <http://example.org/voc#knows> ?o }')
+        fid = self.index.fragments.keys()[0]
+        deadline = time() + 5
+        while (self.index.id, fid) not in FragmentIndex.timer_dues and time() < deadline:
+            sleep(0.1)
+        # Its next check is due when it expires, not on every daemon wake-up
+        due = FragmentIndex.timer_dues.get((self.index.id, fid))
+        self.assertIsNotNone(due)
+        self.assertAlmostEqual(due - time(), self.index.fragments[fid].expires_in, delta=1)
@@ -0,0 +1,83 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+from time import sleep, time
+
+from agora.collector.scholar import FragmentIndex
+from agora.tests.collector import ScholarTest
+
+__author__ = 'Fernando Serena'
+
+HOT = 'SELECT * WHERE { ?s a <http://example.org/voc#Person> . ?s <http://example.org/voc#knows> ?o }'
+COLD = 'SELECT * WHERE { ?s <http://example.org/voc#name> ?n }'
+
+
+class RefreshAheadTest(ScholarTest):
+    """
+    Each test class gets its own cache, so that fragments last for the whole ttl of their resources
+    """
+    ttl = 6
+
+    @classmethod
+    def setUpClass(cls):
+        cls.refresh_ahead = FragmentIndex.refresh_ahead
+        FragmentIndex.refresh_ahead = 2
+        super(RefreshAheadTest, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(RefreshAheadTest, cls).tearDownClass()
+        FragmentIndex.refresh_ahead = cls.refresh_ahead
+
+    def fragment(self, query):
+        agp = self.agp(query)
+        return [f for f in self.index.fragments.values() if f.agp.signature == agp.signature][0]
+
+    def version(self, fragment):
+        return int(self.index.kv.get('{}:version'.format(fragment.key)) or 0)
+
+
+class HotRefreshTest(RefreshAheadTest):
+    def test_hot(self):
+        for _ in range(int(FragmentIndex.hot_usage) + 1):
+            self.collect(HOT)
+        fragment = self.fragment(HOT)
+        self.assertGreaterEqual(fragment.usage, FragmentIndex.hot_usage)
+        expires_at = time() + fragment.expires_in
+        version = self.version(fragment)
+
+        while self.version(fragment) == version and time() < expires_at + 5:
+            sleep(0.1)
+        # Refreshed while still up-to-date, so that readers never wait for it
+        self.assertGreater(self.version(fragment), version)
+        self.assertLess(time(), expires_at)
+        self.assertTrue(fragment.updated)
+
+
+class ColdRefreshTest(RefreshAheadTest):
+    def test_cold(self):
+        self.collect(COLD)
+        fragment = self.fragment(COLD)
+        self.assertLess(fragment.usage, FragmentIndex.hot_usage)
+        expires_at = time() + fragment.expires_in
+        version = self.version(fragment)
+        sleep(max(expires_at - time() - 0.5, 0))
+        self.assertEqual(self.version(fragment), version)
@@ -0,0 +1,125 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+import unittest
+from collections import namedtuple
+
+import networkx as nx
+from rdflib import URIRef, Variable
+
+from agora.collector.scholar import Scholar
+from agora.engine.plan.agp import TP
+
+__author__ = 'Fernando Serena'
+
+EX = 'http://example.org/'
+
+Fragment = namedtuple('Fragment', 'agp filters generator')
+
+
+def follow_filter(candidates, tp, s, o, trace=None, prev=None):
+    """
+    Former (recursive) traversal of the candidates of a filtered fragment, kept as reference
+    """
+
+    def seek_join(tps, f):
+        for t in tps:
+            for (ss, oo) in filter(lambda x: f(x), candidates[t]):
+                if (ss, t.p, oo) not in trace:
+                    yield (t, ss, t.p, oo)
+                    trace.add((ss, t.p, oo))
+                    for q in follow_filter(candidates, t, ss, oo, trace, prev=tp):
+                        yield q
+
+    if trace is None:
+        trace = set([])
+    trace.add((s, tp.p, o))
+    valid_tps = filter(lambda x: x != prev, candidates.keys())
+    up_tps = filter(lambda x: x != prev and x.o == tp.s, valid_tps)
+    for q in seek_join(up_tps, lambda (ss, oo): oo == s):
+        yield q
+    down_tps = filter(lambda x: x.s == tp.o, valid_tps)
+    for q in seek_join(down_tps, lambda (ss, oo): ss == o):
+        yield q
+    sib_tps = filter(lambda x: x.s == tp.s and x.o != tp.o, valid_tps)
+    for q in seek_join(sib_tps, lambda (ss, oo): ss == s):
+        yield q
+
+
+def reduce_candidates(candidates, roots):
+    for tp in roots:
+        pairs = {}
+        for (s, o) in candidates.get(tp, set([])).copy():
+            if tp not in pairs:
+                pairs[tp] = set([])
+            pairs[tp].add((s, o))
+            for ftp, fs, fp, fo in follow_filter(candidates, tp, s, o):
+                if ftp not in pairs:
+                    pairs[ftp] = set([])
+                pairs[ftp].add((fs, fo))
+                candidates[ftp].remove((fs, fo))
+
+        if len(candidates) != len(pairs):
+            return {}
+        candidates = pairs.copy()
+    return candidates
+
+
+class FilteredFragmentTest(unittest.TestCase):
+    def setUp(self):
+        # Only the static semi-join machinery of the scholar is needed
+        self.scholar = object.__new__(Scholar)
+        a, b, c, d = Variable('a'), Variable('b'), Variable('c'), Variable('d')
+        self.tps = [TP(a, URIRef(EX + 'p1'), b), TP(b, URIRef(EX + 'p2'), c), TP(b, URIRef(EX + 'p3'), d)]
+        self.filters = {c: set(['?c = <{}c0>'.format(EX)]), d: set(['?d != <{}d0>'.format(EX)])}
+        self.passing = {c: lambda x: x == URIRef(EX + 'c0'), d: lambda x: x != URIRef(EX + 'd0')}
+
+    def __quads(self, rnd):
+        def resource(var, n):
+            return URIRef('{}{}{}'.format(EX, var, rnd.randrange(n)))
+
+        quads = set([])
+        for tp in self.tps:
+            for _ in range(rnd.randrange(1, 12)):
+                quads.add((tp, resource(tp.s, 5), tp.p, resource(tp.o, 4)))
+        return list(quads)
+
+    def __expected(self, quads):
+        candidates = {}
+        for tp, s, p, o in quads:
+            if all(self.passing.get(v, lambda x: True)(r) for v, r in [(tp.s, s), (tp.o, o)]):
+                candidates.setdefault(tp, set([])).add((s, o))
+        graph = nx.DiGraph([(tp.s, tp.o) for tp in self.tps])
+        roots = filter(lambda x: x.s in self.filters or x.o in self.filters, candidates.keys())
+        roots = sorted(roots, key=lambda x: graph.out_degree(x.o), reverse=True)
+        reduced = reduce_candidates(candidates, roots)
+        return set([(tp, s, o) for tp, pairs in reduced.items() for s, o in pairs])
+
+    def test_semi_joins(self):
+        rnd = random.Random(0)
+        non_empty = 0
+        for _ in range(50):
+            quads = self.__quads(rnd)
+            mapping = {'fragment': Fragment(self.tps, {}, iter(quads))}
+            result = set([(tp, s, o) for tp, s, p, o in self.scholar.mapped_gen(mapping, self.filters)])
+            self.assertEqual(result, self.__expected(quads))
+            non_empty += bool(result)
+        self.assertTrue(non_empty)
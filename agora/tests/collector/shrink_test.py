@@ -0,0 +1,95 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+from time import time
+
+from agora.collector.scholar import Fragment
+from agora.tests.collector import ScholarTest
+
+__author__ = 'Fernando Serena'
+
+QUERY = 'SELECT * WHERE { ?s a <http://example.org/voc#Person> . ?s <http://example.org/voc#knows> ?o }'
+
+
+class ShrinkTest(ScholarTest):
+    def setUp(self):
+        super(ShrinkTest, self).setUp()
+        self.built = {}
+        # The daemon does not check (and collect) the fragments of the index while the lock is held
+        self.index.lock.acquire()
+
+    def tearDown(self):
+        try:
+            for fragment in self.built.values():
+                if self.index.fragments.pop(fragment.fid, None) is not None:
+                    fragment.remove()
+            self.index.max_triples = None
+        finally:
+            self.index.lock.release()
+
+    def build(self, name, size, stored=True, hits=0, last_hit=None, demanded=False, collecting=False):
+        # type: (str, int) -> Fragment
+        fragment = Fragment(self.agp(QUERY), self.index.kv, self.index.triples, '{}:fragments'.format(self.index.id),
+                            '{}-{}'.format(self.id(), name))
+        if stored:
+            fragment.stored = True
+        if demanded:
+            self.index.kv.set('{}:demanded'.format(fragment.key), True)
+        if collecting:
+            fragment.collecting = True
+        fragment.size = size
+        fragment._Fragment__hits = hits
+        fragment._Fragment__last_hit = time() if last_hit is None else last_hit
+        fragment.invalidate()
+        self.index.fragments[fragment.fid] = fragment
+        self.built[name] = fragment
+        return fragment
+
+    def remaining(self):
+        return set([name for name, fragment in self.built.items() if fragment.fid in self.index.fragments])
+
+    def test_within_budget(self):
+        self.build('cold', 5)
+        self.build('warm', 5, hits=5)
+        self.assertEqual(self.index.shrink(), 0)
+        self.index.max_triples = 10
+        self.assertEqual(self.index.shrink(), 0)
+        self.assertEqual(self.remaining(), {'cold', 'warm'})
+
+    def test_eviction_order(self):
+        orphan = self.build('orphan', 5, hits=10)
+        self.build('cold', 5, hits=1, last_hit=time() - 2 * Fragment.hit_half_life)
+        self.build('warm', 5, hits=5)
+        self.index.add_orphaned(orphan.fid)
+        self.index.max_triples = 6
+        # Orphaned ones go first, no matter how used they were; then the least used one
+        self.assertEqual(self.index.shrink(), 2)
+        self.assertEqual(self.remaining(), {'warm'})
+
+    def test_kept_fragments(self):
+        self.build('demanded', 5, demanded=True)
+        self.build('collecting', 5, collecting=True)
+        self.build('newcomer', 5, stored=False)
+        self.build('empty', 0)
+        self.build('cold', 5)
+        self.index.max_triples = 1
+        # Only the cold one can be evicted, even if the rest do not fit in the budget
+        self.assertEqual(self.index.shrink(), 1)
+        self.assertEqual(self.remaining(), {'demanded', 'collecting', 'newcomer', 'empty'})
@@ -0,0 +1,49 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+from agora.tests.collector import ScholarTest
+
+__author__ = 'Fernando Serena'
+
+KNOWS = 'SELECT * WHERE {{ ?{0} a <http://example.org/voc#Person> . ?{0} <http://example.org/voc#knows> ?{1} }}'
+
+
+class SignatureTest(ScholarTest):
+    def test_signature(self):
+        agp = self.agp(KNOWS.format('s', 'o'))
+        self.assertEqual(agp.signature, self.agp(KNOWS.format('x', 'y')).signature)
+        # Variables are not interchangeable if their roles differ
+        self.assertNotEqual(agp.signature, self.agp(KNOWS.format('o', 's').replace('?o a', '?s a')).signature)
+        self.assertNotEqual(agp.signature,
+                            self.agp('SELECT * WHERE { ?s <http://example.org/voc#knows> ?o }').signature)
+
+    def test_isomorphic_reuse(self):
+        quads = self.collect(KNOWS.format('s', 'o'))
+        self.assertEqual(len(self.index.fragments), 1)
+        self.assertEqual(len(quads), 4)
+
+        renamed = self.collect(KNOWS.format('x', 'y'))
+        self.assertEqual(len(self.index.fragments), 1)
+        self.assertEqual(set([(s, p, o) for _, s, p, o in renamed]), set([(s, p, o) for _, s, p, o in quads]))
+        self.assertTrue(all('?x' in c for c, _, _, _ in renamed))
+
+        self.collect('SELECT * WHERE { ?s <http://example.org/voc#knows> ?o }')
+        self.assertEqual(len(self.index.fragments), 2)
@@ -0,0 +1,91 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import gzip
+import json
+import os
+import shutil
+from tempfile import mkdtemp
+from time import sleep, time
+
+from rdflib import ConjunctiveGraph
+
+from agora.collector.scholar import Fragment
+from agora.tests.collector import ScholarTest
+
+__author__ = 'Fernando Serena'
+
+QUERY = 'SELECT * WHERE { ?s a <http://example.org/voc#Person> . ?s <http://example.org/voc#knows> ?o }'
+
+
+class SnapshotTest(ScholarTest):
+    scholar_args = {'snapshot_dir': mkdtemp()}
+
+    @classmethod
+    def tearDownClass(cls):
+        super(SnapshotTest, cls).tearDownClass()
+        shutil.rmtree(cls.scholar_args['snapshot_dir'], ignore_errors=True)
+
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        self.quads = self.collect(QUERY)
+        self.fragment = self.index.fragments.values()[0]
+        self.path = os.path.join(self.index.snapshot_dir, '{}.snap.gz'.format(self.fragment.fid))
+        # Collected fragments are snapshotted in the background
+        deadline = time() + 10
+        while not os.path.exists(self.path) and time() < deadline:
+            sleep(0.1)
+        self.assertTrue(os.path.exists(self.path))
+
+    def restore(self, path):
+        return Fragment.restore(self.index.kv, ConjunctiveGraph(), 'restored:fragments', path,
+                                prefixes=self.fountain.prefixes)
+
+    def test_restore(self):
+        self.assertTrue(self.index.snapshot(self.fragment.fid).result(timeout=10) is None)
+        restored = self.restore(self.path)
+        try:
+            self.assertEqual(restored.fid, self.fragment.fid)
+            self.assertEqual(restored.agp, self.fragment.agp)
+            self.assertTrue(restored.updated)
+            self.assertEqual(restored.size, self.fragment.size)
+            quads = set([(str(c), s, p, o) for c, s, p, o in restored.generator])
+            self.assertEqual(quads, self.quads)
+        finally:
+            restored.remove()
+
+    def test_expired(self):
+        expired = os.path.join(self.index.snapshot_dir, 'expired.snap.gz')
+        with gzip.open(self.path, 'rb') as f:
+            meta = json.loads(f.readline())
+            contents = f.read()
+        meta['expires_at'] = time() - 1
+        with gzip.open(expired, 'wb') as f:
+            f.write(json.dumps(meta) + '\n')
+            f.write(contents)
+        try:
+            self.assertTrue(self.restore(expired) is None)
+            self.assertFalse(self.index.kv.exists('restored:fragments:{}:gp'.format(self.fragment.fid)))
+        finally:
+            os.remove(expired)
+
+    def test_remove(self):
+        self.index.clear()
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,79 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import logging
+import unittest
+
+from agora import Agora, setup_logging
+
+__author__ = 'Fernando Serena'
+
+HEADER = """@prefix owl: <http://www.w3.org/2002/07/owl#> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+@prefix ex: <http://example.org/voc#> .
+@prefix ex2: <http://example.org/voc2#> .
+"""
+
+PEOPLE = HEADER + """<http://example.org/voc#> a owl:Ontology .
+ex:Person a owl:Class .
+ex:Student a owl:Class ; rdfs:subClassOf ex:Person .
+ex:Org a owl:Class .
+ex:knows a owl:ObjectProperty ; rdfs:domain ex:Person ; rdfs:range ex:Person .
+ex:memberOf a owl:ObjectProperty ; rdfs:domain ex:Person ; rdfs:range ex:Org .
+ex:hasMember a owl:ObjectProperty ; owl:inverseOf ex:memberOf .
+ex:name a owl:DatatypeProperty ; rdfs:domain ex:Person .
+ex:Club a owl:Class ; rdfs:subClassOf [ a owl:Restriction ; owl:onProperty ex:hasMember ; owl:allValuesFrom ex:Student ] .
+"""
+
+PEOPLE_UPDATED = HEADER + """<http://example.org/voc#> a owl:Ontology .
+ex:Person a owl:Class ; rdfs:label "person" .
+ex:Student a owl:Class ; rdfs:subClassOf ex:Person .
+ex:PhD a owl:Class ; rdfs:subClassOf ex:Student .
+ex:Org a owl:Class .
+ex:knows a owl:ObjectProperty ; rdfs:domain ex:Person ; rdfs:range ex:Org .
+ex:memberOf a owl:ObjectProperty ; rdfs:domain ex:Person ; rdfs:range ex:Org .
+ex:hasMember a owl:ObjectProperty ; owl:inverseOf ex:memberOf .
+ex:Club a owl:Class ; rdfs:subClassOf [ a owl:Restriction ; owl:onProperty ex:hasMember ; owl:allValuesFrom ex:PhD ] .
+"""
+
+TEACHING = HEADER + """<http://example.org/voc2#> a owl:Ontology .
+ex2:Teacher a owl:Class ; rdfs:subClassOf ex:Person .
+ex2:teaches a owl:ObjectProperty ; rdfs:domain ex2:Teacher ; rdfs:range ex:Student .
+ex2:age a owl:DatatypeProperty ; rdfs:domain ex:Person .
+"""
+
+
+class FountainTest(unittest.TestCase):
+    vocabularies = [PEOPLE, TEACHING]
+
+    @classmethod
+    def setUpClass(cls):
+        setup_logging(logging.WARNING)
+        cls.agora = Agora(persist_mode=False)
+        cls.fountain = cls.agora.fountain
+        for owl in cls.vocabularies:
+            cls.fountain.add_vocabulary(owl)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.agora.shutdown()
+
+    def setUp(self):
+        self.log = logging.getLogger('agora.tests.fountain')
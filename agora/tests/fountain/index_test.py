@@ -0,0 +1,177 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import json
+from time import sleep
+
+from agora.engine.fountain.index import _get_types, _get_type, _get_properties, _get_property, _migrate, \
+    INVERSE_OF_KEY, LAYOUT_KEY, PROPERTIES_KEY, TYPES_KEY, VOCABS_KEY
+from agora.tests.fountain import FountainTest, PEOPLE, PEOPLE_UPDATED, TEACHING
+
+__author__ = 'Fernando Serena'
+
+
+class IncrementalIndexTest(FountainTest):
+    def __state(self):
+        r = self.fountain.index.r
+        state = {}
+        for t in _get_types(r):
+            state['type', t] = {facet: sorted(values) for facet, values in _get_type(r, t).items()}
+        for p in _get_properties(r):
+            state['property', p] = {facet: sorted(values) if isinstance(values, list) else values
+                                    for facet, values in _get_property(r, p).items()}
+        for vid in r.smembers(VOCABS_KEY):
+            state['vocab', vid] = sorted(_get_types(r, vid)), sorted(_get_properties(r, vid))
+        state['inverse_of'] = r.hgetall(INVERSE_OF_KEY)
+        return state
+
+    def __assert_reindexed(self):
+        updated = self.__state()
+        for vid in self.fountain.vocabularies:
+            self.fountain.index.index_vocabulary(vid)
+        self.assertEqual(updated, self.__state())
+
+    def test_update(self):
+        self.fountain.update_vocabulary('ex', PEOPLE_UPDATED)
+        self.assertIn('ex:PhD', self.fountain.get_type('ex:Person')['sub'])
+        self.__assert_reindexed()
+
+        self.fountain.update_vocabulary('ex', PEOPLE)
+        self.assertNotIn('ex:PhD', self.fountain.types)
+        self.__assert_reindexed()
+
+    def test_delete(self):
+        self.fountain.delete_vocabulary('ex2')
+        self.assertNotIn('ex2:Teacher', self.fountain.get_type('ex:Person')['sub'])
+        self.__assert_reindexed()
+
+
+class InverseIndexTest(FountainTest):
+    inverses = {'ex:memberOf': '["ex:hasMember"]', 'ex:hasMember': '["ex:memberOf"]'}
+
+    def test_inverse_of(self):
+        r = self.fountain.index.r
+        self.assertEqual(r.hgetall(INVERSE_OF_KEY), self.inverses)
+        self.assertIn('ex:Org', self.fountain.get_property('ex:hasMember')['domain'])
+
+        no_inverse = PEOPLE.replace('ex:hasMember a owl:ObjectProperty ; owl:inverseOf ex:memberOf .',
+                                    'ex:hasMember a owl:ObjectProperty .')
+        self.fountain.update_vocabulary('ex', no_inverse)
+        self.assertEqual(r.hgetall(INVERSE_OF_KEY), {})
+        self.assertNotIn('ex:Org', self.fountain.get_property('ex:hasMember')['domain'])
+
+        self.fountain.update_vocabulary('ex', PEOPLE)
+        self.assertEqual(r.hgetall(INVERSE_OF_KEY), self.inverses)
+
+    def test_inverse_domain_change(self):
+        # A new domain of memberOf has to reach the range of hasMember through the reverse index
+        self.fountain.update_vocabulary('ex', PEOPLE.replace('ex:memberOf a owl:ObjectProperty ; rdfs:domain ex:Person',
+                                                             'ex:memberOf a owl:ObjectProperty ; rdfs:domain ex:Org'))
+        self.assertIn('ex:Org', self.fountain.get_property('ex:hasMember')['range'])
+        self.fountain.update_vocabulary('ex', PEOPLE)
+        self.assertNotIn('ex:Org', self.fountain.get_property('ex:hasMember')['range'])
+
+    def test_migrate(self):
+        r = self.fountain.index.r
+        r.delete(INVERSE_OF_KEY)
+        r.set(LAYOUT_KEY, 2)
+        _migrate(r)
+        self.assertEqual(r.hgetall(INVERSE_OF_KEY), self.inverses)
+
+
+class MergedHashTest(FountainTest):
+    def test_merged_type(self):
+        r = self.fountain.index.r
+        self.assertEqual(r.smembers(TYPES_KEY), set(self.fountain.types))
+        record = r.hgetall('types:ex:Person')
+        # ex:Person is extended by the teaching vocabulary
+        self.assertEqual(json.loads(record['vocabs']), ['ex', 'ex2'])
+        self.assertIn('ex2:Teacher', json.loads(record['sub']))
+        self.assertIn('ex2:age', json.loads(record['properties']))
+        self.assertEqual(_get_type(r, 'ex:Person')['sub'], json.loads(record['sub']))
+
+    def test_merged_property(self):
+        r = self.fountain.index.r
+        self.assertEqual(r.smembers(PROPERTIES_KEY), set(self.fountain.properties))
+        record = r.hgetall('properties:ex2:teaches')
+        self.assertEqual(json.loads(record['vocabs']), ['ex2'])
+        self.assertEqual(record['type'], 'object')
+        self.assertEqual(_get_property(r, 'ex2:teaches')['range'], ['ex:Student'])
+        self.assertEqual(_get_property(r, 'ex:name')['type'], 'data')
+        self.assertRaises(TypeError, _get_property, r, 'ex:nope')
+
+    def test_delete(self):
+        r = self.fountain.index.r
+        self.fountain.delete_vocabulary('ex2')
+        try:
+            self.assertFalse(r.exists('types:ex2:Teacher'))
+            self.assertFalse(r.sismember(TYPES_KEY, 'ex2:Teacher'))
+            self.assertFalse(r.sismember(PROPERTIES_KEY, 'ex2:age'))
+            record = r.hgetall('types:ex:Person')
+            self.assertEqual(json.loads(record['vocabs']), ['ex'])
+            self.assertNotIn('ex2:age', json.loads(record['properties']))
+        finally:
+            self.fountain.add_vocabulary(TEACHING)
+
+
+class SnapshotTest(FountainTest):
+    def test_snapshot(self):
+        index = self.fountain.index
+        # Snapshots taken by former tests are checked again
+        sleep(index.snapshot_ttl)
+        snapshot = index.snapshot
+        self.assertIs(index.snapshot, snapshot)
+        self.assertEqual(snapshot.ts, index.ts)
+        self.assertEqual(snapshot.types, frozenset(_get_types(index.r)))
+        self.assertEqual(set(snapshot.get_type('ex:Person')['sub']), set(_get_type(index.r, 'ex:Person')['sub']))
+
+        # Lookups give back copies
+        snapshot.get_type('ex:Person')['sub'].append('ex:Nope')
+        self.assertNotIn('ex:Nope', snapshot.get_type('ex:Person')['sub'])
+        self.assertRaises(TypeError, snapshot.get_type, 'ex:Nope')
+        self.assertRaises(TypeError, snapshot.get_property, 'ex:nope')
+
+        self.fountain.update_vocabulary('ex', PEOPLE_UPDATED)
+        try:
+            updated = index.snapshot
+            self.assertIsNot(updated, snapshot)
+            self.assertGreater(updated.ts, snapshot.ts)
+            self.assertTrue(updated.is_type('ex:PhD'))
+            # Readers that got the former snapshot keep an unchanged view
+            self.assertFalse(snapshot.is_type('ex:PhD'))
+        finally:
+            self.fountain.update_vocabulary('ex', PEOPLE)
+
+    def test_foreign_changes(self):
+        index = self.fountain.index
+        snapshot = index.snapshot
+        # Another process indexes a type: the ts is checked again once the snapshot ttl is over
+        index.r.sadd(TYPES_KEY, 'ex:Foreign')
+        index.r.hmset('types:ex:Foreign', {field: '[]' for field in ['super', 'sub', 'properties', 'spec_properties',
+                                                                     'refs', 'spec_refs']})
+        index.r.incr('ts')
+        try:
+            self.assertIs(index.snapshot, snapshot)
+            sleep(index.snapshot_ttl)
+            self.assertTrue(index.snapshot.is_type('ex:Foreign'))
+        finally:
+            index.r.srem(TYPES_KEY, 'ex:Foreign')
+            index.r.delete('types:ex:Foreign')
+            index.r.incr('ts')
@@ -0,0 +1,112 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+
+import networkx as nx
+
+from agora.engine.fountain.path import PathCache, _bounded_cycles, _cycles_prefix
+from agora.tests.fountain import FountainTest, PEOPLE, PEOPLE_UPDATED
+
+__author__ = 'Fernando Serena'
+
+
+def canonical(cycle):
+    # type: (list) -> tuple
+    i = cycle.index(min(cycle))
+    return tuple(cycle[i:] + cycle[:i])
+
+
+class CycleTest(FountainTest):
+    def test_bounded_cycles(self):
+        rnd = random.Random(0)
+        graph = nx.DiGraph([(rnd.randrange(12), rnd.randrange(12)) for _ in range(30)])
+        graph.remove_edges_from(list(nx.selfloop_edges(graph)))
+        expected = set(canonical(c) for c in nx.simple_cycles(graph))
+        found = set()
+        for nodes in nx.strongly_connected_components(graph):
+            if len(nodes) > 1:
+                cycles, truncated = _bounded_cycles(graph.subgraph(nodes), len(graph), 10000)
+                self.assertFalse(truncated)
+                found.update(canonical(c) for c in cycles)
+        self.assertEqual(found, expected)
+
+        component = graph.subgraph(max(nx.strongly_connected_components(graph), key=len))
+        short_cycles, _ = _bounded_cycles(component, 3, 10000)
+        self.assertEqual(set(canonical(c) for c in short_cycles),
+                         set(canonical(c) for c in nx.simple_cycles(component) if len(c) <= 3))
+        some_cycles, truncated = _bounded_cycles(component, len(component), 2)
+        self.assertTrue(truncated)
+        self.assertEqual(len(some_cycles), 2)
+
+    def test_cycle_versions(self):
+        r = self.fountain.index.r
+        prefix = _cycles_prefix(r)
+        cycles = r.zrange(prefix, 0, -1)
+        self.assertTrue(cycles)
+
+        self.fountain.path_manager.calculate()
+        new_prefix = _cycles_prefix(r)
+        self.assertNotEqual(prefix, new_prefix)
+        self.assertEqual(r.zrange(new_prefix, 0, -1), cycles)
+        self.assertFalse(r.keys('{}*'.format(prefix + ':')) or r.exists(prefix))
+
+        paths = self.fountain.get_paths('ex:Person')
+        self.assertTrue(paths['all-cycles'])
+
+
+class PathCacheTest(FountainTest):
+    def test_lru(self):
+        cache = PathCache(max_size=2)
+        cache.put(('a',), [1])
+        cache.put(('b',), [2])
+        self.assertEqual(cache.get(('a',)), [1])
+        cache.put(('c',), [3])
+        # b was the least recently used entry
+        self.assertIsNone(cache.get(('b',)))
+        self.assertEqual(cache.get(('a',)), [1])
+        self.assertEqual(cache.get(('c',)), [3])
+        cache.put(('a',), [4])
+        self.assertEqual(cache.get(('a',)), [4])
+        self.assertEqual(len(cache), 2)
+
+    def test_version_invalidation(self):
+        r = self.fountain.index.r
+        self.fountain.add_seed('http://example.org/people/1', 'ex:Person')
+        paths = self.fountain.get_paths('ex:Org')
+        graph = self.fountain.path_manager.path_graph
+        version = graph.graph['version']
+        self.assertEqual(version, self.fountain.index.ts)
+        cached = graph.graph['paths']
+        n_cached = len(cached)
+        self.assertTrue(n_cached)
+        self.assertEqual(self.fountain.get_paths('ex:Org'), paths)
+        self.assertEqual(len(cached), n_cached)
+        prefix = _cycles_prefix(r)
+
+        self.fountain.update_vocabulary('ex', PEOPLE_UPDATED)
+        # Paths of the former index version are not served anymore, but enumerated again
+        self.assertNotEqual(self.fountain.get_paths('ex:Org'), paths)
+        self.assertGreater(graph.graph['version'], version)
+        self.assertGreater(len(cached), n_cached)
+        self.assertNotEqual(_cycles_prefix(r), prefix)
+
+        self.fountain.update_vocabulary('ex', PEOPLE)
+        self.assertEqual(self.fountain.get_paths('ex:Org'), paths)
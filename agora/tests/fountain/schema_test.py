@@ -0,0 +1,162 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+import random
+import unittest
+
+from rdflib import Graph, URIRef, BNode, Literal, RDF, RDFS
+from rdflib.namespace import OWL, XSD
+
+from agora.engine.fountain.schema import SchemaClosure
+
+__author__ = 'Fernando Serena'
+
+PREFIXES = """PREFIX owl: <http://www.w3.org/2002/07/owl#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+"""
+
+
+def random_ontology(seed, n=30, ns='http://example.org/voc#'):
+    # type: (int, int, str) -> Graph
+    rnd = random.Random(seed)
+    g = Graph()
+    g.bind('ex', ns)
+    g.add((URIRef(ns), RDF.type, OWL.Ontology))
+    classes = [URIRef(ns + 'C{}'.format(i)) for i in range(n)]
+    properties = [URIRef(ns + 'p{}'.format(i)) for i in range(n)]
+    data_properties = [URIRef(ns + 'd{}'.format(i)) for i in range(n / 2)]
+    for i, c in enumerate(classes):
+        g.add((c, RDF.type, OWL.Class))
+        g.add((c, RDFS.label, Literal('c{}'.format(i))))
+        if i and rnd.random() < 0.8:
+            g.add((c, RDFS.subClassOf, classes[rnd.randrange(i)]))
+        if i > 2 and rnd.random() < 0.1:
+            g.add((c, RDFS.subClassOf, classes[rnd.randrange(i)]))
+    for p in properties:
+        g.add((p, RDF.type, OWL.ObjectProperty))
+        if rnd.random() < 0.7:
+            g.add((p, RDFS.domain, rnd.choice(classes)))
+        if rnd.random() < 0.7:
+            g.add((p, RDFS.range, rnd.choice(classes)))
+        if rnd.random() < 0.1:
+            g.add((p, OWL.inverseOf, rnd.choice(properties)))
+    for d in data_properties:
+        g.add((d, RDF.type, OWL.DatatypeProperty))
+        g.add((d, RDFS.domain, rnd.choice(classes)))
+        g.add((d, RDFS.range, XSD.string))
+    for _ in range(n / 3):
+        r = BNode()
+        g.add((rnd.choice(classes), RDFS.subClassOf, r))
+        g.add((r, RDF.type, OWL.Restriction))
+        g.add((r, OWL.onProperty, rnd.choice(properties + data_properties)))
+        g.add((r, rnd.choice([OWL.allValuesFrom, OWL.someValuesFrom, OWL.onClass]), rnd.choice(classes)))
+    return g
+
+
+class SparqlSchema(object):
+    """
+    Reference (and much slower) answers, straight from SPARQL queries and graph traversals
+    """
+
+    def __init__(self, g):
+        self.g = g
+
+    def name(self, term):
+        return term.n3(self.g.namespace_manager)
+
+    def uri(self, name):
+        prefix, local = name.split(':')
+        return URIRef(dict(self.g.namespaces())[prefix] + local)
+
+    def pairs(self, q):
+        return set([(self.name(a), self.name(b)) for a, b in self.g.query(PREFIXES + q)])
+
+    def supertypes(self, t):
+        return set([self.name(x) for x in self.g.transitive_objects(self.uri(t), RDFS.subClassOf)
+                    if isinstance(x, URIRef)]).difference([t])
+
+    def subtypes(self, t):
+        return set([self.name(x) for x in self.g.transitive_subjects(RDFS.subClassOf, self.uri(t))
+                    if isinstance(x, URIRef)]).difference([t])
+
+    def with_subtypes(self, types):
+        return set(types).union(*[self.subtypes(t) for t in types])
+
+    @property
+    def domains(self):
+        return self.pairs("""SELECT DISTINCT ?p ?c WHERE {
+                               { ?p rdfs:domain ?c } UNION { ?c rdfs:subClassOf [ owl:onProperty ?p ] }
+                               FILTER (isURI(?p) && isURI(?c)) }""")
+
+    @property
+    def ranges(self):
+        return self.pairs("""SELECT DISTINCT ?p ?r WHERE {
+                               { ?p rdfs:range ?r } UNION {
+                                 ?d owl:onProperty ?p .
+                                 { ?d owl:allValuesFrom ?r } UNION { ?d owl:someValuesFrom ?r }
+                                 UNION { ?d owl:onClass ?r } UNION { ?d owl:onDataRange ?r } }
+                               FILTER (isURI(?p) && isURI(?r)) }""")
+
+    @property
+    def references(self):
+        return self.pairs("""SELECT DISTINCT ?p ?c WHERE {
+                               { ?r owl:onProperty ?p .
+                                 { ?r owl:someValuesFrom ?c } UNION { ?r owl:allValuesFrom ?c }
+                                 UNION { ?r owl:onClass ?c } }
+                               UNION { ?p rdfs:range ?c }
+                               FILTER (isURI(?p) && isURI(?c)) }""")
+
+    @property
+    def inverses(self):
+        return self.pairs("""SELECT DISTINCT ?p ?i WHERE {
+                               { ?p owl:inverseOf ?i } UNION { ?i owl:inverseOf ?p }
+                               FILTER (isURI(?i) && isURI(?p)) }""")
+
+
+class SchemaClosureTest(unittest.TestCase):
+    def __assert_equivalent(self, g):
+        closure = SchemaClosure(g)
+        ref = SparqlSchema(g)
+        domains, ranges, references, inverses = ref.domains, ref.ranges, ref.references, ref.inverses
+        self.assertTrue(closure.types and closure.properties)
+
+        for t in closure.types:
+            self.assertEqual(set(closure.get_supertypes(t)), ref.supertypes(t), t)
+            self.assertEqual(set(closure.get_subtypes(t)), ref.subtypes(t), t)
+            all_types = ref.supertypes(t).union([t])
+            self.assertEqual(set(closure.get_type_properties(t)),
+                             set([p for p, c in domains if c in all_types]), t)
+            self.assertEqual(set(closure.get_type_specific_properties(t)),
+                             set([p for p, c in domains if c == t]), t)
+            self.assertEqual(set(closure.get_type_references(t)),
+                             set([p for p, c in references if c in all_types]), t)
+            self.assertEqual(set(closure.get_type_specific_references(t)),
+                             set([p for p, c in references if c == t]), t)
+
+        for p in closure.properties:
+            self.assertEqual(set(closure.get_property_domain(p)),
+                             ref.with_subtypes([c for q, c in domains if q == p]), p)
+            self.assertEqual(set(closure.get_property_range(p)),
+                             ref.with_subtypes([r for q, r in ranges if q == p]), p)
+            self.assertEqual(set(closure.get_property_inverses(p)), set([i for q, i in inverses if q == p]), p)
+
+    def test_random_ontologies(self):
+        for seed in range(5):
+            self.__assert_equivalent(random_ontology(seed))
@@ -0,0 +1,108 @@
+"""
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Ontology Engineering Group
+        http://www.oeg-upm.net/
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Copyright (C) 2016 Ontology Engineering Group.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+            http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=#
+"""
+from agora.engine.fountain.seed import SEED_DIGESTS_KEY, SEED_REFS_PREFIX, NTRIPLES, _add_seeds, \
+    _rebuild_seed_digests, read_seeds, seed_digest
+from agora.tests.fountain import FountainTest, PEOPLE, PEOPLE_UPDATED
+
+__author__ = 'Fernando Serena'
+
+
+class SeedTest(FountainTest):
+    def __seed_state(self):
+        r = self.fountain.index.r
+        return r.hgetall(SEED_DIGESTS_KEY), {k: r.hgetall(k) for k in r.keys(SEED_REFS_PREFIX + '*')}
+
+    def assert_consistent(self):
+        """
+        Digests and counters must be the same that would be rebuilt from scratch
+        """
+        state = self.__seed_state()
+        _rebuild_seed_digests(self.fountain.index)
+        self.assertEqual(state, self.__seed_state())
+
+
+class BulkSeedTest(SeedTest):
+    def test_bulk_seeds(self):
+        types = ['ex:Person', 'ex:Student', 'ex2:Teacher', 'ex:Org']
+        seeds = [('http://example.org/bulk/{}'.format(i), types[i % len(types)]) for i in range(1000)]
+        self.fountain.add_seed('http://example.org/bulk/0', 'ex:Person')
+        result = self.fountain.add_seeds(seeds + [('not an uri', 'ex:Person'), ('http://example.org/x', 'ex:Nope')])
+        self.assertEqual(result['added'], 999)
+        self.assertEqual(result['duplicated'], 1)
+        self.assertEqual(result['invalid'], 2)
+        self.assert_consistent()
+
+        person_seeds = self.fountain.get_type_seeds('ex:Person')
+        self.assertEqual(len(person_seeds), 750)
+        self.assertEqual(self.fountain.get_seed_type_digest('ex:Person'), seed_digest(person_seeds))
+
+    def test_malformed_lines(self):
+        lines = ['{{"uri": "http://example.org/lines/{}", "type": "ex:Org"}}'.format(i) for i in range(5)]
+        lines.insert(4, 'not json')
+        types = set(self.fountain.types)
+        result = _add_seeds(self.fountain.index.r, read_seeds(lines), types, lambda ty: [], batch_size=2)
+        self.assertEqual(result['added'], 5)
+        self.assertEqual(result['invalid'], 1)
+        self.assert_consistent()
+
+    def test_read_ntriples(self):
+        rdf_type = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+        lines = ['<http://example.org/t1> {} <http://example.org/voc#Student> .'.format(rdf_type),
+                 '<http://example.org/t1> <http://example.org/voc#name> "t1" .',
+                 '<http://example.org/t2> {}'.format(rdf_type)]
+        seeds = list(read_seeds(lines, format=NTRIPLES, prefixes=self.fountain.prefixes))
+        self.assertEqual(seeds[0], ('http://example.org/t1', 'ex:Student'))
+        self.assertEqual(len(seeds), 2)
+        self.assertIn('line 3', seeds[1].message)
+
+
+class SeedDigestTest(SeedTest):
+    def test_vocabulary_changes(self):
+        self.fountain.add_seed('http://example.org/people/1', 'ex:Student')
+        self.fountain.add_seed('http://example.org/people/2', 'ex2:Teacher')
+        self.fountain.add_seed('http://example.org/orgs/1', 'ex:Org')
+
+        self.fountain.update_vocabulary('ex', PEOPLE_UPDATED)
+        self.fountain.add_seed('http://example.org/people/3', 'ex:PhD')
+        self.assert_consistent()
+
+        self.fountain.update_vocabulary('ex', PEOPLE)
+        self.assertNotIn('ex:PhD', self.fountain.seeds)
+        self.assert_consistent()
+
+        self.fountain.delete_vocabulary('ex2')
+        self.assertNotIn('ex2:Teacher', self.fountain.seeds)
+        self.assertEqual(self.fountain.get_seed_type_digest('ex:Person'),
+                         seed_digest(['http://example.org/people/1']))
+        self.assert_consistent()
+
+
+class DeleteTypeSeedsTest(SeedTest):
+    def test_delete_type_seeds(self):
+        self.fountain.add_seeds([('http://example.org/del/{}'.format(i), 'ex:Student') for i in range(20)] +
+                                [('http://example.org/del/{}'.format(i), 'ex:Person') for i in range(15, 25)])
+        self.fountain.delete_type_seeds('ex:Student')
+        self.assertNotIn('ex:Student', self.fountain.seeds)
+        person_seeds = self.fountain.get_type_seeds('ex:Person')
+        self.assertEqual(len(person_seeds), 10)
+        self.assertEqual(self.fountain.get_seed_type_digest('ex:Person'), seed_digest(person_seeds))
+        self.assertEqual(self.fountain.get_seed_type_digest('ex:Student'), seed_digest([]))
+        self.assert_consistent()